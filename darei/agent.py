@@ -1,10 +1,12 @@
 
 
 from distutils.command.config import config
+import math
 import os
 import hydra
 from omegaconf import DictConfig, OmegaConf
 from hydra.utils import to_absolute_path
+from hydra import compose
 import re
 import time
 
@@ -21,7 +23,13 @@ from isaacgymenvs.learning import amp_continuous
 from isaacgymenvs.learning import amp_players
 from isaacgymenvs.learning import amp_models
 from isaacgymenvs.learning import amp_network_builder
+from darei.config import cfg
+from darei.utils import dedup
+from darei.utils import events
+from darei.utils import fidelity
 from darei.utils import file as fu
+from darei.utils import species
+from darei.utils import store as pstore
 
 from darei.tools.rlgames_utils import RLGPUEnv, RLGPUAlgoObserver, get_rlgames_env_creator
 ## OmegaConf & Hydra Config
@@ -74,6 +82,10 @@ from darei.tools.rlgames_utils import RLGPUEnv, RLGPUAlgoObserver, get_rlgames_e
 #     # Train agent
 #     train_agent(xml_path, model_path)
 
+# Metrics of a multi morphology run which hold for each of its unimals, the
+# rewards are reported per unimal by the task (see UnimalMulti.get_group_metrics).
+SHARED_METRICS = ["frames", "epochs", "wall_time"]
+
 # register the rl-games adapter to use inside the runner
 vecenv.register('RLGPU',
                 lambda config_name, num_actors, **kwargs: RLGPUEnv(config_name, num_actors, **kwargs))
@@ -89,33 +101,83 @@ def build_runner(algo_observer):
     return runner
 
 
-def save_metadata(model_output_dir, unimal_id, max_epochs, train_time, parent_id=None, yacs_cfg=None):
+def get_last_checkpoint(model_output_dir, max_epochs):
+    """Return path and reward of the checkpoint saved at the end of training."""
     reg_str = r'.*\[(.*)\].pth'
     model_files = fu.get_files(model_output_dir, reg_str, sort=True, sort_type="time")
     best_model = model_files[-1]
     assert(str(max_epochs+1) in best_model)
     p = re.compile(reg_str)
     result = p.search(best_model)
-    reward = result.group(1)
+    return best_model, result.group(1)
+
+
+def save_metadata(model_output_dir, unimal_id, max_epochs, train_time, parent_id=None, yacs_cfg=None, reward=None, fidelity=None, duplicate_of=None, metrics=None):
+    # Reward of the unimal is reported by the algo observer (metrics), unless
+    # it was measured separately (e.g multi morphology training). Runs which
+    # did not report it fall back to the name of the last checkpoint.
+    if reward is None and metrics is not None:
+        reward = metrics.get("reward")
+    if reward is None:
+        _, reward = get_last_checkpoint(model_output_dir, max_epochs)
 
     metadata = {}
+    if metrics is not None:
+        metadata.update(metrics)
     metadata["reward"] = reward
     metadata["id"] = unimal_id
     metadata["train_time"] = train_time
+    if fidelity is not None:
+        metadata["fidelity"] = fidelity
+    if duplicate_of is not None:
+        metadata["duplicate_of"] = duplicate_of
+
+    store = pstore.get_store(config=yacs_cfg)
 
     if parent_id == None or parent_id == 'None':
         metadata["lineage"] = "{}".format(unimal_id)
     else:
-        parent_metadata_path = os.path.join(fu.get_subfolder("metadata", config=yacs_cfg), "{}.json".format(parent_id))
-        parent_metadata = fu.load_json(parent_metadata_path)
+        parent_metadata = None
+        if store is not None:
+            parent_metadata = store.get(parent_id)
+        if parent_metadata is None:
+            parent_metadata_path = os.path.join(fu.get_subfolder("metadata", config=yacs_cfg), "{}.json".format(parent_id))
+            parent_metadata = fu.load_json(parent_metadata_path)
         metadata["lineage"] = "{}/{}".format(parent_metadata["lineage"], unimal_id)
 
     path = os.path.join(fu.get_subfolder("metadata", config=yacs_cfg), "{}.json".format(unimal_id))
     fu.save_json(metadata, path)
+    if store is not None:
+        store.add(metadata, parent_id=parent_id)
+    index_cfg = yacs_cfg if yacs_cfg is not None else cfg
+    # Only results of actual training go into the duplicate index.
+    if index_cfg.EVO.DUPLICATE_POLICY and duplicate_of is None:
+        dedup.record(unimal_id, metadata, config=index_cfg)
+    if index_cfg.EVO.SPECIES_INDEX:
+        species.record(unimal_id, config=index_cfg)
+    events.notify("done", unimal_id=unimal_id)
     print(f"Saved metadata to {path}")
 
 
-def train_agent(hydra_cfg: DictConfig, yacs_cfg=None):
+def is_lease_lost(lease_lost, unimal_id):
+    """Return True if the worker lost its lease on unimal_id (see
+    LeaseQueue.hold). Another worker trains the unimal again and saves its
+    metadata, so the results of this worker are dropped.
+    """
+    if lease_lost is None or unimal_id not in lease_lost:
+        return False
+    if not lease_lost[unimal_id].is_set():
+        return False
+    print(f"Lost the lease of {unimal_id}, not saving its metadata")
+    return True
+
+
+def train_agent(hydra_cfg: DictConfig, yacs_cfg=None, write_metadata=True, lease_lost=None):
+    """Train the agent of hydra_cfg, returns the dir of the saved models, the
+    train time and the metrics reported by the algo observer.
+    write_metadata=False leaves saving metadata to the caller. lease_lost is
+    {unimal id: event} of the leases held on the unimals, if any.
+    """
     # ensure checkpoints can be specified as relative paths
     if hydra_cfg.checkpoint:
         hydra_cfg.checkpoint = to_absolute_path(hydra_cfg.checkpoint)
@@ -141,16 +203,25 @@ def train_agent(hydra_cfg: DictConfig, yacs_cfg=None):
         multi_gpu=hydra_cfg.multi_gpu,
     )
 
+    # Keep track of the envs created by rl_games so that their sims can be
+    # released once training is over.
+    envs = []
+    def create_env(**kwargs):
+        env = create_rlgpu_env(**kwargs)
+        envs.append(env)
+        return env
+
     env_configurations.register('rlgpu', {
         'vecenv_type': 'RLGPU',
-        'env_creator': lambda **kwargs: create_rlgpu_env(**kwargs),
+        'env_creator': create_env,
     })
 
     rlg_config_dict = omegaconf_to_dict(hydra_cfg.train)
 
     # convert CLI arguments into dictionory
     # create runner and set the settings
-    runner = build_runner(RLGPUAlgoObserver())
+    algo_observer = RLGPUAlgoObserver()
+    runner = build_runner(algo_observer)
     runner.load(rlg_config_dict)
     runner.reset()
 
@@ -164,18 +235,112 @@ def train_agent(hydra_cfg: DictConfig, yacs_cfg=None):
     runner.run({
         'train': not hydra_cfg.test,
         'play': hydra_cfg.test,
+        'checkpoint': hydra_cfg.checkpoint,
     })
     end = time.time()
     time_elapsed = end - start
+    metrics = algo_observer.get_metrics()
+
+    # Multi morphology tasks report the reward and reward terms of each of
+    # their unimals.
+    group_metrics = None
+    if hasattr(envs[0], "get_group_metrics"):
+        group_metrics = envs[0].get_group_metrics()
+
+    # Persistent workers train many unimals in the same process, free the
+    # sim before the next one is created.
+    for env in envs:
+        env.close()
 
     # Dir where model actually gets saved. IsaacGym creates "nn" subfolder automatically.
     model_output_dir = os.path.join(experiment_dir, 'nn')
-    save_metadata(model_output_dir, 
-                  hydra_cfg.train.params.config.name, 
-                  hydra_cfg.train.params.config.max_epochs,
-                  train_time=time_elapsed,
-                  parent_id=hydra_cfg.train.params.config.parent_name,
-                  yacs_cfg=yacs_cfg)
+    if not write_metadata:
+        return model_output_dir, time_elapsed, metrics
+
+    if group_metrics is None:
+        if is_lease_lost(lease_lost, hydra_cfg.train.params.config.name):
+            return model_output_dir, time_elapsed, metrics
+        save_metadata(model_output_dir, 
+                      hydra_cfg.train.params.config.name, 
+                      hydra_cfg.train.params.config.max_epochs,
+                      train_time=time_elapsed,
+                      parent_id=hydra_cfg.train.params.config.parent_name,
+                      yacs_cfg=yacs_cfg,
+                      metrics=metrics)
+        return model_output_dir, time_elapsed, metrics
+
+    for unimal_id, unimal_metrics in group_metrics.items():
+        if is_lease_lost(lease_lost, unimal_id):
+            continue
+        # All unimals share the experiment dir of the multi morphology run.
+        unimal_dir = os.path.join(hydra_cfg.train.params.config.train_dir, unimal_id)
+        if not os.path.lexists(unimal_dir):
+            os.symlink(hydra_cfg.train.params.config.name, unimal_dir)
+        # Progress of the run is shared, rewards are those of the unimal.
+        unimal_metrics = dict(
+            {key: metrics[key] for key in SHARED_METRICS if key in metrics},
+            **unimal_metrics
+        )
+        print(f"Reward of {unimal_id}: {unimal_metrics['reward']}")
+        save_metadata(model_output_dir,
+                      unimal_id,
+                      hydra_cfg.train.params.config.max_epochs,
+                      train_time=time_elapsed,
+                      yacs_cfg=yacs_cfg,
+                      metrics=unimal_metrics)
+
+    return model_output_dir, time_elapsed, metrics
+
+
+def train_agent_with_fidelity(overrides, yacs_cfg, checkpoint="", lease_lost=None):
+    """Train a unimal with successive halving over its training budget (see
+    utils/fidelity.py). overrides are the hydra overrides of the full run,
+    checkpoint the initial controller of the first rung. Training stops at
+    the end of a rung if the lease on the unimal (lease_lost) was lost.
+    """
+    hydra_cfg = compose(config_name="config", overrides=overrides)
+    max_epochs = hydra_cfg.train.params.config.max_epochs
+    unimal_id = hydra_cfg.train.params.config.name
+    parent_id = hydra_cfg.train.params.config.parent_name
+
+    # Epochs needed to finish at least one full length episode.
+    min_epochs = int(math.ceil(
+        hydra_cfg.task.env.episodeLength / hydra_cfg.train.params.config.horizon_length
+    )) + 1
+    rung_epochs = fidelity.get_rung_epochs(max_epochs, min_epochs=min_epochs, config=yacs_cfg)
+    train_time = 0
+    for rung, epochs in enumerate(rung_epochs):
+        # Later rungs continue from the checkpoint of the previous one, rl_games
+        # restores the epoch count so they only train the remaining epochs.
+        hydra_cfg = compose(config_name="config", overrides=overrides + [
+            # Checkpoint names contain brackets, quote them for hydra.
+            f"max_iterations={epochs}", f"checkpoint='{checkpoint}'"
+        ])
+        model_output_dir, time_elapsed, metrics = train_agent(
+            hydra_cfg, yacs_cfg=yacs_cfg, write_metadata=False
+        )
+        train_time += time_elapsed
+        if is_lease_lost(lease_lost, unimal_id):
+            return
+        checkpoint, reward = get_last_checkpoint(model_output_dir, epochs)
+        reward = metrics.get("reward", reward)
+
+        fidelity.record_result(rung, unimal_id, reward, config=yacs_cfg)
+        if rung == len(rung_epochs) - 1:
+            break
+        if not fidelity.should_promote(rung, reward, config=yacs_cfg):
+            break
+        print(f"Promoting {unimal_id} to rung {rung + 1}, reward: {reward}")
+
+    save_metadata(model_output_dir,
+                  unimal_id,
+                  epochs,
+                  train_time=train_time,
+                  parent_id=parent_id,
+                  yacs_cfg=yacs_cfg,
+                  reward=reward,
+                  fidelity={"rung": rung, "epochs": epochs, "max_epochs": max_epochs},
+                  metrics=metrics)
 
 def generate_unimal(xml_path):
     pass
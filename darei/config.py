@@ -60,6 +60,15 @@ _C.BODY.JOINT_ANGLE_LIST = [
 
 _C.BODY.MOTOR_GEAR_RANGE = [150, 300, 50]
 
+# How grow_limb checks that a grown unimal is symmetric and free of
+# self-intersections. "mujoco": from contacts after a step of an MjSim,
+# "analytic": from the capsules of the geoms (see utils/capsule.py), which
+# is faster. tests/test_growth_check.py compares both.
+_C.BODY.GROWTH_CHECK = "mujoco"
+
+# Confirm growth accepted by the analytic check with MuJoCo.
+_C.BODY.GROWTH_CHECK_CONFIRM = False
+
 # Joint axis in the geom frame. x means we will choose the x-axis in geom frame
 # as the joint axis.
 _C.BODY.JOINT_AXIS = ["x", "y", "xy"]
@@ -410,6 +419,9 @@ _C.EVO.NUM_PROCESSES = 18
 
 _C.EVO.NUM_CPU_PROCESSES = 32
 
+# Modules imported by the workers of utils/executor.py when they start
+_C.EVO.EXECUTOR_PRELOAD = ["lxml.etree", "mujoco_py", "darei.utils.similarity"]
+
 # Number of GPUs available at workstation.
 _C.EVO.NUM_GPUS = 2
 
@@ -418,6 +430,56 @@ _C.EVO.NUM_GPUS = 2
 # GPU available.
 _C.EVO.NUM_WORKERS_PER_GPU = 2
 
+# Number of children a tournament worker trains before it exits and gets
+# relaunched. The worker keeps python, hydra and isaacgym loaded between
+# children. 1 means one child per process, -1 means never recycle.
+_C.EVO.MAX_JOBS_PER_WORKER = 1
+
+# Workers notify the supervisor of every trained unimal, but the population
+# is recounted from disk every SUPERVISOR_SYNC_PERIOD secs to account for
+# unimals trained on other nodes.
+_C.EVO.SUPERVISOR_SYNC_PERIOD = 60
+
+# Keep an sqlite index (OUT_DIR/population.db) of the population next to the
+# metadata files. Parent selection, population counting and init completion
+# checks then query it instead of listing and parsing metadata/*.json.
+_C.EVO.USE_POPULATION_STORE = False
+
+# Journal mode of the population store. "delete" works with OUT_DIR shared
+# across nodes on a network filesystem. "wal" is faster but needs all workers
+# on the host of OUT_DIR, i.e NUM_NODES == 1.
+_C.EVO.POPULATION_STORE_JOURNAL = "delete"
+
+# Successive halving over the training budget (see utils/fidelity.py). A
+# unimal trains for max_epochs / FIDELITY_ETA^(FIDELITY_RUNGS - 1 - r) epochs
+# at rung r and only the top 1 / FIDELITY_ETA of each rung is trained further.
+# 1 rung means every unimal is trained for the full budget.
+_C.EVO.FIDELITY_RUNGS = 1
+
+_C.EVO.FIDELITY_ETA = 3
+
+# What to do with a child whose xml is identical to an already trained
+# unimal (see utils/dedup.py). "" trains it anyway, "reuse" copies the latest
+# stored result.
+_C.EVO.DUPLICATE_POLICY = ""
+
+# Cache similarity descriptors (point_cloud, geom_orientation and hash) in
+# OUT_DIR/descriptors (see utils/descriptor.py). A descriptor is cached the
+# first time it is computed, keyed by the xml and EVO.DESCRIPTOR_BACKEND.
+_C.EVO.DESCRIPTOR_CACHE = False
+
+# How point_cloud and geom_orientation descriptors are computed. "mujoco":
+# from an MjSim, "kinematics": from the xml without MuJoCo (see
+# utils/kinematics.py and tools/validate_kinematics.py).
+_C.EVO.DESCRIPTOR_BACKEND = "mujoco"
+
+# Record the descriptor of every saved unimal for the species index (see
+# utils/species.py).
+_C.EVO.SPECIES_INDEX = False
+
+# Similarity metric which defines a species: geom_orientation or point_cloud
+_C.EVO.SPECIES_METRIC = "geom_orientation"
+
 # Number of generations to run evolution for.
 _C.EVO.NUM_GENERATIONS = 10
 
@@ -434,6 +496,20 @@ _C.EVO.INIT_POPULATION_SIZE = 576
 
 _C.EVO.INIT_METHOD = "limb_count_pop_init"
 
+# How the initial population is divided among workers. "static" splits it
+# evenly by node and proc_id upfront, "lease" lets workers of all nodes claim
+# unimals one at a time from a shared queue in OUT_DIR/leases.
+_C.EVO.INIT_SCHEDULER = "static"
+
+# Number of unimals of the initial population trained together in one
+# IsaacGym sim (UnimalMulti task). NUM_ISAAC_ENVS are split between them and
+# they share a single policy which gets a one hot morphology id as input.
+_C.EVO.MORPHOLOGIES_PER_SIM = 1
+
+# Secs after which the lease on a unimal expires if the worker training it
+# stops renewing it, e.g because it crashed or its node went down.
+_C.EVO.LEASE_DURATION = 600
+
 # Total number of unimals evolved over the course of evolution. Includes the
 # initial population size. Note we can also do it on the basis of time but
 # time can vary depending on implementation, hardware, etc.
@@ -442,6 +518,8 @@ _C.EVO.SEARCH_SPACE_SIZE = 4000
 # Types of tournament selection: vanila (select N, choose best and remove the
 # others), aging (select N from the most recent EVO.AGING_WINDOW_SIZE). _num
 # means use EVO.NUM_PARTICIPANTS, _percent means use EVO.PERCENT_PARTICIPANTS.
+# aging_nsga_num and aging_nsga_percent select the best of N by Pareto rank
+# and crowding distance computed over the whole aging window (NSGA-II).
 _C.EVO.TOURNAMENT_TYPE = "aging_num"
 
 # See EVO.TOURNAMENT_TYPE
@@ -483,6 +561,8 @@ _C.EVO.POP_CONTROLLER_STATE_INITIAL = "controller_random"
 # controller is initialized using the weights of the parent.
 # _inherit_oldest means that the child controller will be initialized using the
 # weights of the older agent that will be culled to make space for the child.
+# Only _random and _inherit_parent are supported. Observation and action dims
+# of limbs added or removed by the mutation are remapped (utils/checkpoint.py).
 _C.EVO.CHILD_CONTROLLER_STATE_INITIAL = "controller_random"
 
 # --------------------------------------------------------------------------- #
@@ -542,6 +622,30 @@ _C.ISAAC_ENV_SPACING = 5.0
 
 _C.ISAAC_HORIZON_LENGTH = 16
 
+# Time the phases of VecTask.step (actions, simulate, observations, reward,
+# resets, ...). The summary of the run is saved in the metadata of the
+# unimal under "profile". Disabled costs nothing.
+_C.ISAAC_PROFILE_STEP = False
+
+# Kernel computing the observations of the Unimal task. jit: scripted
+# compute_unimal_observations, inplace: ObservationWriter which writes into
+# obs_buf without allocating (see tasks/unimal_kernels.py), fused:
+# compute_unimal_observations_and_reward which also computes the reward,
+# resets and time outs in one scripted kernel. The UnimalMulti task only
+# supports jit.
+_C.ISAAC_OBS_KERNEL = "jit"
+
+# Bodies with a force sensor, 6 observation dims each. all: every body,
+# leaves: bodies without child limbs, feet: bodies touching the ground at
+# qpos0, none: no force sensor (see obsu.SENSOR_MODES).
+_C.ISAAC_FORCE_SENSORS = "all"
+
+# dtype of the observation and states buffers of the task: float32, float16
+# or bfloat16. With float16 and bfloat16 the reset and time out buffers are
+# int8. Buffers are cast back to float32 and long on the rl device. Check the
+# accuracy with tools/check_buffer_precision.py.
+_C.ISAAC_BUFFER_PRECISION = "float32"
+
 def dump_cfg():
     """Dumps the config to the output directory."""
     cfg_file = os.path.join(_C.OUT_DIR, _C.CFG_DEST)
@@ -7,6 +7,7 @@ import numpy as np
 from lxml import etree
 
 from darei.config import cfg
+from darei.utils import capsule as cu
 from darei.utils import file as fu
 from darei.utils import geom as gu
 from darei.utils import mjpy as mu
@@ -603,6 +604,11 @@ class SymmetricUnimal:
                 ][insert_pos]
 
     def grow_limb(self):
+        if cfg.BODY.GROWTH_CHECK == "analytic":
+            capsules = cu.UnimalCapsules(self.unimal)
+        else:
+            capsules = None
+
         # Try for N = 50 times to grow a limb
         for _ in range(50):
             # Find a site to grow
@@ -636,20 +642,22 @@ class SymmetricUnimal:
                 exclude_geom_pairs.append((limbs[0], limbs[1]))
 
             # Check if new unimal is valid
-            sim = mu.mjsim_from_etree(self.root)
-            sim.step()
-
-            is_symmetric = self._is_symmetric(sim)
-            new_contacts = self._new_contacts(sim, exclude_geom_pairs)
+            if capsules is not None:
+                new_contacts = self._new_contacts_analytic(
+                    capsules, limbs, exclude_geom_pairs
+                )
+                if new_contacts is not None and cfg.BODY.GROWTH_CHECK_CONFIRM:
+                    new_contacts = self._new_contacts_mujoco(exclude_geom_pairs)
+            else:
+                new_contacts = self._new_contacts_mujoco(exclude_geom_pairs)
 
             # Update things if new unimal is valid
-            if is_symmetric and new_contacts is not None:
+            if new_contacts is not None:
                 # self._remove_used_sites(parents, attach_sites)
                 # Add actuators
                 for idx in range(self.limb_idx, self.limb_idx + limbs2add):
                     self._add_actuator("limb", idx, limb_params)
                 # Update contacts
-                new_contacts = self._contact_id2name(sim, new_contacts)
                 self.contact_pairs = self.contact_pairs.union(new_contacts)
                 # Update limbs
                 self.limb_list.append([xu.name2id(limb_) for limb_ in limbs])
@@ -816,6 +824,42 @@ class SymmetricUnimal:
 
         return site, limbs2add
 
+    def _new_contacts_mujoco(self, exclude_geom_pairs):
+        """Return new contact pairs (names) if the grown unimal is valid,
+        None otherwise.
+        """
+        sim = mu.mjsim_from_etree(self.root)
+        sim.step()
+
+        if not self._is_symmetric(sim):
+            return None
+        new_contacts = self._new_contacts(sim, exclude_geom_pairs)
+        if new_contacts is None:
+            return None
+        return self._contact_id2name(sim, new_contacts)
+
+    def _new_contacts_analytic(self, capsules, limbs, exclude_geom_pairs):
+        """Same as _new_contacts_mujoco, based on the capsules of the unimal
+        before limbs were attached.
+        """
+        new_geoms = capsules.get_geoms(limbs)
+        if not capsules.is_symmetric(cfg.BODY.SYMMETRY_PLANE, new_geoms):
+            return None
+
+        exclude_geom_pairs = [
+            (geom1.get("name"), geom2.get("name"))
+            for (geom1, geom2) in exclude_geom_pairs
+        ]
+        allowed_pairs = {
+            frozenset(pair)
+            for pair in list(self.contact_pairs) + exclude_geom_pairs
+        }
+        for pair in capsules.get_contacts(new_geoms):
+            if frozenset(pair) not in allowed_pairs:
+                return None
+
+        return exclude_geom_pairs
+
     def _is_symmetric(self, sim):
         """Check if current unimal is symmetric along BODY.SYMMETRY_PLANE."""
 
@@ -11,9 +11,11 @@ from darei.utils import file as fu
 from darei.config import cfg, dump_cfg
 from darei.tools import evolution
 from darei.utils import evo as eu
+from darei.utils import events
+from darei.utils import store as pstore
+import selectors
 import time
 import signal
-import psutil
 
 class DAREI:
     def __init__(self) -> None:
@@ -21,6 +23,7 @@ class DAREI:
 
     def run(self):
         if cfg.NODE_ID == 0:
+            self.import_population()
             self.setup_population()
         else:
             self.wait_till_init()
@@ -34,27 +37,36 @@ class DAREI:
         cfg_path = os.path.abspath(cfg_path)
         gpu_device_idx = (proc_id % cfg.EVO.NUM_GPUS)
         cuda_selection = f"CUDA_VISIBLE_DEVICES={gpu_device_idx}"
+        # Pipe over which the worker reports events. It also reaches EOF as
+        # soon as the worker exits.
+        read_fd, write_fd = os.pipe()
+        event_fd = f"{events.EVENT_FD_ENV}={write_fd}"
         cwd = os.path.dirname(os.path.realpath(__file__)) 
-        cmd = "{} python {} --cfg {} --proc_id {} NODE_ID {} {}".format(
-            cuda_selection, script_name, cfg_path, proc_id, 
+        cmd = "{} {} python {} --cfg {} --proc_id {} NODE_ID {} {}".format(
+            cuda_selection, event_fd, script_name, cfg_path, proc_id, 
             cfg.NODE_ID, additional_args
         )
         p = subprocess.Popen(
             cmd, shell=True, executable="/bin/bash", preexec_fn=os.setsid,
-            cwd=cwd
+            cwd=cwd, pass_fds=(write_fd,)
         )
+        os.close(write_fd)
+        p.event_fd = read_fd
         print(f"PID {p.pid} launched cmd: {cmd}")
         return p
 
     def kill_pg(self, p):
+        # Process group id is the pid of the worker as it was started with
+        # setsid. This also works if the worker itself was already reaped.
         try:
-            os.killpg(os.getpgid(p.pid), signal.SIGTERM)
-            time.sleep(5)
-            if psutil.pid_exists(p.pid):
+            os.killpg(p.pid, signal.SIGTERM)
+            try:
+                p.wait(timeout=5)
+            except subprocess.TimeoutExpired:
                 print(f"Sending SIGKILL to process {p.pid}")
-                os.killpg(os.getpgid(p.pid), signal.SIGKILL)
+                os.killpg(p.pid, signal.SIGKILL)
         except ProcessLookupError:
-            print(f"Encountered ProcessLookupError exception for process {p.pid}")
+            # Process group has already exited
             pass
 
 
@@ -69,32 +81,63 @@ class DAREI:
 
 
     def wait_or_kill(self, subprocs, search_space_size, script_name, additional_args=""):
-        # Main process will wait till we have done search
-        while eu.get_population_size() < search_space_size:
-            time.sleep(10)  # 10 secs
-
-            # Re-launch subproc if exit was due to error
-            new_subprocs = []
-            for idx in range(len(subprocs)):
-                p, proc_id = subprocs[idx]
-                poll = p.poll()
-
-                is_error_path = os.path.join(
-                    cfg.OUT_DIR, "{}_{}".format(cfg.NODE_ID, p.pid)
-                )
-
-                err_exists = os.path.exists(is_error_path)
-                if err_exists or poll:
-                    if err_exists:
-                        print(f"Relaunching process {p.pid}, error path detected {is_error_path}")
+        # Workers report trained unimals and errors over their event pipe and
+        # the pipe reaches EOF when a worker exits, so we react to both right
+        # away. The population is only recounted from disk every
+        # EVO.SUPERVISOR_SYNC_PERIOD secs to account for the other nodes.
+        selector = selectors.DefaultSelector()
+        workers = {}
+        for p, proc_id in subprocs:
+            selector.register(p.event_fd, selectors.EVENT_READ, data=proc_id)
+            workers[proc_id] = p
+
+        def relaunch(proc_id, reason):
+            p = workers[proc_id]
+            selector.unregister(p.event_fd)
+            os.close(p.event_fd)
+            print(f"Relaunching process {p.pid}, {reason}")
+            fu.remove_file(
+                os.path.join(cfg.OUT_DIR, "{}_{}".format(cfg.NODE_ID, p.pid))
+            )
+            p = self.relaunch_proc(p, proc_id, script_name, additional_args)
+            selector.register(p.event_fd, selectors.EVENT_READ, data=proc_id)
+            workers[proc_id] = p
+
+        pop_size = eu.get_population_size()
+        last_sync = time.time()
+        while pop_size < search_space_size:
+            # All workers exited as there is no work left for them.
+            if not selector.get_map():
+                break
+            for key, _ in selector.select(timeout=cfg.EVO.SUPERVISOR_SYNC_PERIOD):
+                proc_id = key.data
+                worker_events = events.read_events(key.fd)
+
+                if worker_events is None:
+                    p = workers[proc_id]
+                    poll = p.wait()
+                    # Workers exit with 0 only once there is no work left for
+                    # them, otherwise they exited due to error or recycling.
+                    if poll == 0:
+                        selector.unregister(key.fd)
+                        os.close(key.fd)
+                        print(f"Process {p.pid} finished")
                     else:
-                        print(f"Relaunching process {p.pid}, received poll value {poll}")
-                    fu.remove_file(is_error_path)
-                    p = self.relaunch_proc(p, proc_id, script_name, additional_args)
-
-                new_subprocs.append((p, proc_id))
-
-            subprocs = new_subprocs
+                        relaunch(proc_id, f"received poll value {poll}")
+                    continue
+
+                for event in worker_events:
+                    if event["event"] == "done":
+                        pop_size += 1
+                    elif event["event"] == "error":
+                        # Workers can hang while exiting after an error, do
+                        # not wait for the EOF.
+                        relaunch(proc_id, "error event received")
+                        break
+
+            if time.time() - last_sync >= cfg.EVO.SUPERVISOR_SYNC_PERIOD:
+                pop_size = eu.get_population_size()
+                last_sync = time.time()
 
         # if eu.should_save_video():
         #     video_dir = fu.get_subfolder("videos")
@@ -104,8 +147,12 @@ class DAREI:
 
         # Ensure that all process will close, dangling process will prevent docker
         # from exiting.
-        for p, _ in subprocs:
+        for p in workers.values():
             self.kill_pg(p)
+            if p.event_fd in selector.get_map():
+                selector.unregister(p.event_fd)
+                os.close(p.event_fd)
+        selector.close()
 
 
     def init_population(self):
@@ -142,8 +189,7 @@ class DAREI:
         subprocs = []
         script_name = "tools/tournament_evolution.py"
         additional_args = f"NUM_ISAAC_ENVS {cfg.NUM_ISAAC_ENVS} ISAAC_ENV_SPACING {cfg.ISAAC_ENV_SPACING}"
-        max_searched_space_size = (cfg.EVO.INIT_POPULATION_SIZE + 
-                (cfg.EVO.NUM_GENERATIONS * cfg.EVO.NUM_TOURNAMENTS_PER_GEN))
+        max_searched_space_size = eu.get_max_searched_space_size()
 
         print(f"Launching {num_workers} workers to execute tournament evolution.")
         for idx in range(num_workers):
@@ -153,6 +199,16 @@ class DAREI:
         self.wait_or_kill(subprocs, search_space_size=max_searched_space_size,
             script_name=script_name, additional_args=additional_args)
 
+    def import_population(self):
+        """Adds unimals of a run started without the population store."""
+        store = pstore.get_store()
+        if store is None:
+            return
+
+        num_imported = store.import_run(cfg.OUT_DIR)
+        if num_imported > 0:
+            print(f"Imported {num_imported} unimals into the population store.")
+
     def setup_population(self):
         """Generates unimals in initial population and serializes to disk in 
         XML format.
@@ -195,6 +251,11 @@ def setup_output_dir():
         "videos",
         "error_metadata",
         "images",
+        "leases",
+        "fidelity",
+        "hash_index",
+        "species",
+        "descriptors",
     ]
     for folder in subfolders:
         os.makedirs(os.path.join(cfg.OUT_DIR, folder), exist_ok=True)
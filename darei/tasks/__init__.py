@@ -28,8 +28,10 @@
 
 
 from darei.tasks.unimal import Unimal
+from darei.tasks.unimal_multi import UnimalMulti
 
 # Mappings from strings to environments
 isaacgym_task_map = {
     "Unimal": Unimal,
+    "UnimalMulti": UnimalMulti,
 }
\ No newline at end of file
@@ -45,6 +45,17 @@ import torch
 import gym
 from gym import spaces
 
+from darei.utils.profiler import StepProfiler
+
+# dtypes of the (observation and states, reset and time out) buffers for
+# each env.bufferPrecision. Buffers are cast to float32 and long when they
+# are handed to the RL algo, see VecTask.step.
+BUFFER_PRECISIONS = {
+    "float32": (torch.float, torch.long),
+    "float16": (torch.half, torch.int8),
+    "bfloat16": (torch.bfloat16, torch.int8),
+}
+
 
 
 class Env(ABC):
@@ -72,6 +83,10 @@ class Env(ABC):
 
         self.rl_device = config.get("rl_device", "cuda:0")
 
+        self.buffer_precision = config["env"].get("bufferPrecision", "float32")
+        assert self.buffer_precision in BUFFER_PRECISIONS, \
+            "Invalid bufferPrecision: {}".format(self.buffer_precision)
+
         # Rendering
         # if training in a headless mode
         self.headless = headless
@@ -174,6 +189,11 @@ class VecTask(Env):
             msg = f"Invalid physics engine backend: {self.cfg['physics_engine']}"
             raise ValueError(msg)
 
+        # Per phase timers of step, see utils/profiler.py
+        self.profiler = None
+        if self.cfg["env"].get("profileStep", False):
+            self.profiler = StepProfiler(self.num_envs, self.device)
+
         # optimization flags for pytorch JIT
         torch._C._jit_set_profiling_mode(False)
         torch._C._jit_set_profiling_executor(False)
@@ -238,17 +258,18 @@ class VecTask(Env):
 
         """
 
-        # allocate buffers
+        # allocate buffers, rewards stay float32 as they are summed into returns
+        obs_dtype, flag_dtype = BUFFER_PRECISIONS[self.buffer_precision]
         self.obs_buf = torch.zeros(
-            (self.num_envs, self.num_obs), device=self.device, dtype=torch.float)
+            (self.num_envs, self.num_obs), device=self.device, dtype=obs_dtype)
         self.states_buf = torch.zeros(
-            (self.num_envs, self.num_states), device=self.device, dtype=torch.float)
+            (self.num_envs, self.num_states), device=self.device, dtype=obs_dtype)
         self.rew_buf = torch.zeros(
             self.num_envs, device=self.device, dtype=torch.float)
         self.reset_buf = torch.ones(
-            self.num_envs, device=self.device, dtype=torch.long)
+            self.num_envs, device=self.device, dtype=flag_dtype)
         self.timeout_buf = torch.zeros(
-             self.num_envs, device=self.device, dtype=torch.long)
+             self.num_envs, device=self.device, dtype=flag_dtype)
         self.progress_buf = torch.zeros(
             self.num_envs, device=self.device, dtype=torch.long)
         self.randomize_buf = torch.zeros(
@@ -273,9 +294,18 @@ class VecTask(Env):
 
         return sim
 
+    def close(self):
+        """Destroy the viewer and the sim, allowing another task to be created in this process."""
+        if self.viewer is not None:
+            self.gym.destroy_viewer(self.viewer)
+            self.viewer = None
+        if self.sim is not None:
+            self.gym.destroy_sim(self.sim)
+            self.sim = None
+
     def get_state(self):
         """Returns the state buffer of the environment (the priviledged observations for asymmetric training)."""
-        return torch.clamp(self.states_buf, -self.clip_obs, self.clip_obs).to(self.rl_device)
+        return torch.clamp(self.states_buf, -self.clip_obs, self.clip_obs).to(self.rl_device).float()
 
     @abc.abstractmethod
     def pre_physics_step(self, actions: torch.Tensor):
@@ -289,6 +319,10 @@ class VecTask(Env):
     def post_physics_step(self):
         """Compute reward and observations, reset any environments that require it."""
 
+    def compute_timeouts(self):
+        """Fill the time out buffer from the progress of each env."""
+        self.timeout_buf = torch.where(self.progress_buf >= self.max_episode_length - 1, torch.ones_like(self.timeout_buf), torch.zeros_like(self.timeout_buf))
+
     def step(self, actions: torch.Tensor) -> Tuple[Dict[str, torch.Tensor], torch.Tensor, torch.Tensor, Dict[str, Any]]:
         """Step the physics of the environment.
 
@@ -299,13 +333,21 @@ class VecTask(Env):
             Observations are dict of observations (currently only one member called 'obs')
         """
 
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_step()
+
         # randomize actions
         if self.dr_randomizations.get('actions', None):
             actions = self.dr_randomizations['actions']['noise_lambda'](actions)
 
         action_tensor = torch.clamp(actions, -self.clip_actions, self.clip_actions)
+        if profiler is not None:
+            profiler.mark("actions")
         # apply actions
         self.pre_physics_step(action_tensor)
+        if profiler is not None:
+            profiler.mark("pre_physics")
 
         # step physics and render each frame
         for i in range(self.control_freq_inv):
@@ -315,9 +357,13 @@ class VecTask(Env):
         # to fix!
         if self.device == 'cpu':
             self.gym.fetch_results(self.sim, True)
+        if profiler is not None:
+            profiler.mark("simulate")
 
         # fill time out buffer
-        self.timeout_buf = torch.where(self.progress_buf >= self.max_episode_length - 1, torch.ones_like(self.timeout_buf), torch.zeros_like(self.timeout_buf))
+        self.compute_timeouts()
+        if profiler is not None:
+            profiler.mark("timeouts")
         
         # compute observations, rewards, resets, ...
         self.post_physics_step()
@@ -325,16 +371,23 @@ class VecTask(Env):
         # randomize observations
         if self.dr_randomizations.get('observations', None):
             self.obs_buf = self.dr_randomizations['observations']['noise_lambda'](self.obs_buf)
+        if profiler is not None:
+            profiler.mark("post_physics")
 
-        self.extras["time_outs"] = self.timeout_buf.to(self.rl_device)
+        # Buffers are moved in their own precision and cast on the rl device,
+        # casts are no-ops with float32 buffers.
+        self.extras["time_outs"] = self.timeout_buf.to(self.rl_device).long()
 
-        self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device)
+        self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device).float()
 
         # asymmetric actor-critic
         if self.num_states > 0:
             self.obs_dict["states"] = self.get_state()
+        if profiler is not None:
+            profiler.mark("transfer")
+            profiler.end_step()
 
-        return self.obs_dict, self.rew_buf.to(self.rl_device), self.reset_buf.to(self.rl_device), self.extras
+        return self.obs_dict, self.rew_buf.to(self.rl_device), self.reset_buf.to(self.rl_device).long(), self.extras
 
     def zero_actions(self) -> torch.Tensor:
         """Returns a buffer with zero actions.
@@ -358,7 +411,7 @@ class VecTask(Env):
         Returns:
             Observation dictionary
         """
-        self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device)
+        self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device).float()
 
         # asymmetric actor-critic
         if self.num_states > 0:
@@ -375,7 +428,7 @@ class VecTask(Env):
         if len(done_env_ids) > 0:
             self.reset_idx(done_env_ids)
 
-        self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device)
+        self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device).float()
 
         # asymmetric actor-critic
         if self.num_states > 0:
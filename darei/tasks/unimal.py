@@ -30,6 +30,7 @@ import numpy as np
 import os
 from collections import OrderedDict
 
+from darei.utils import observation as obsu
 from darei.utils import xml as xu
 
 import isaacgym
@@ -39,33 +40,24 @@ from isaacgym.gymtorch import *
 
 from isaacgymenvs.utils.torch_jit_utils import *
 from darei.tasks.base.vec_task import VecTask
+from darei.tasks.unimal_kernels import OBS_KERNELS, ObservationWriter
 
 import torch
 
+# Reward terms whose episode return is reported, see Unimal.end_episodes
+REWARD_TERMS = ["forward", "stand"]
+
+# When the bodies of the envs are colored. all: at creation, deferred: by
+# Unimal.apply_body_colors, none: never, auto: all with a viewer, deferred
+# when headless.
+BODY_COLOR_MODES = ["auto", "all", "deferred", "none"]
+
 class Unimal(VecTask):
 
     def __init__(self, cfg, sim_device, graphics_device_id, headless):
 
         self.cfg = cfg
-
-        self.max_episode_length = self.cfg["env"]["episodeLength"]
-
-        self.randomization_params = self.cfg["task"]["randomization_params"]
-        self.randomize = self.cfg["task"]["randomize"]
-        self.dof_vel_scale = self.cfg["env"]["dofVelocityScale"]
-        self.contact_force_scale = self.cfg["env"]["contactForceScale"]
-        self.power_scale = self.cfg["env"]["powerScale"]
-        self.heading_weight = self.cfg["env"]["headingWeight"]
-        self.up_weight = self.cfg["env"]["upWeight"]
-        self.actions_cost_scale = self.cfg["env"]["actionsCost"]
-        self.energy_cost_scale = self.cfg["env"]["energyCost"]
-        self.joints_at_limit_cost_scale = self.cfg["env"]["jointsAtLimitCost"]
-        self.death_cost = self.cfg["env"]["deathCost"]
-
-        self.debug_viz = self.cfg["env"]["enableDebugVis"]
-        self.plane_static_friction = self.cfg["env"]["plane"]["staticFriction"]
-        self.plane_dynamic_friction = self.cfg["env"]["plane"]["dynamicFriction"]
-        self.plane_restitution = self.cfg["env"]["plane"]["restitution"]
+        self._read_cfg()
 
         # asset_file = "/home/smnair/work/embodied-intelligence/IsaacGymEnvs/assets/mjcf/nv_unimal.xml"
         # self.asset_file = "/home/smnair/work/embodied-intelligence/derl/output/ft_test.bk/xml/0-27-27-19-59-32.xml"
@@ -81,26 +73,19 @@ class Unimal(VecTask):
         self.head_height_init = head_position[2]
         self.termination_height = 0.5 * self.head_height_init
 
-        sensors = self.root.findall("./sensor")[0]
-        touch_sensors = [sensor for sensor in sensors if sensor.tag == "touch"]
-        self.sensors_per_env = len(touch_sensors)
+        # Bodies with a force sensor, picked from the touch sites of the xml.
+        self.sensor_body_names = obsu.get_sensor_body_names(self.root, self.force_sensors)
+        self.sensors_per_env = len(self.sensor_body_names)
         # Each force sensor state has forces (3) and torques (3) data => 6.
-        self.vec_sensor_length = self.sensors_per_env * 6
+        self.vec_sensor_length = self.sensors_per_env * obsu.SENSOR_DIM
 
         actuators = self.root.findall("./actuator")[0]
         self.num_actuators = len(actuators)
 
         # Refer to section A.2.1 in IsaacGym Paper for details on observation space.
-        self.observation_space_map = OrderedDict()
-        self.observation_space_map['torso_vertical_position'] = 1
-        self.observation_space_map['velocity_positional'] = 3
-        self.observation_space_map['velocity_angular'] = 3
-        self.observation_space_map['angle_to_target'] = 3
-        self.observation_space_map['up_and_heading_vec_proj'] = 2
-        self.observation_space_map['dof_meas_pos'] = self.num_actuators
-        self.observation_space_map['dof_meas_vel'] = self.num_actuators
-        self.observation_space_map['sensor_state'] = self.vec_sensor_length
-        self.observation_space_map['actions'] = self.num_actuators
+        self.observation_space_map = obsu.get_observation_space_map(
+            self.num_actuators, self.sensors_per_env
+        )
 
         self.observation_space_map_cum = {}
         cumulative_idx = 0
@@ -110,6 +95,8 @@ class Unimal(VecTask):
 
         self.num_observations = cumulative_idx
         self.cfg["env"]["numObservations"] = self.num_observations
+        print("Force sensors ({}): {}, observation width: {}".format(
+            self.force_sensors, self.sensors_per_env, self.num_observations))
         # TODO(snair): Fix
         self.cfg["env"]["numActions"] = self.observation_space_map['actions']
 
@@ -125,7 +112,10 @@ class Unimal(VecTask):
         dof_state_tensor = self.gym.acquire_dof_state_tensor(self.sim)
         sensor_tensor = self.gym.acquire_force_sensor_tensor(self.sim)
         
-        self.vec_sensor_tensor = gymtorch.wrap_tensor(sensor_tensor).view(self.num_envs, self.vec_sensor_length)
+        if self.sensors_per_env > 0:
+            self.vec_sensor_tensor = gymtorch.wrap_tensor(sensor_tensor).view(self.num_envs, self.vec_sensor_length)
+        else:
+            self.vec_sensor_tensor = torch.zeros((self.num_envs, 0), device=self.device)
 
         self.gym.refresh_dof_state_tensor(self.sim)
         self.gym.refresh_actor_root_state_tensor(self.sim)
@@ -158,6 +148,44 @@ class Unimal(VecTask):
         self.potentials = to_torch([-1000./self.dt], device=self.device).repeat(self.num_envs)
         self.prev_potentials = self.potentials.clone()
 
+        # Return of each reward term in the current episode, reported through
+        # extras["episode"] as __reward__<term> (see EVO.SELECTION_CRITERIA).
+        self.episode_reward_terms = {
+            term: torch.zeros(self.num_envs, device=self.device, dtype=torch.float)
+            for term in REWARD_TERMS
+        }
+
+        self.init_next_timeouts()
+
+        self.obs_writer = None
+        if self.obs_kernel == "inplace":
+            self.obs_writer = ObservationWriter(self.obs_buf, self.observation_space_map)
+
+    def _read_cfg(self):
+        self.max_episode_length = self.cfg["env"]["episodeLength"]
+        self.force_sensors = self.cfg["env"].get("forceSensors", "all")
+        self.body_color = self.cfg["env"].get("bodyColor", "auto")
+        assert self.body_color in BODY_COLOR_MODES, "Invalid bodyColor: {}".format(self.body_color)
+        self.obs_kernel = self.cfg["env"].get("obsKernel", "jit")
+        assert self.obs_kernel in OBS_KERNELS, "Invalid obsKernel: {}".format(self.obs_kernel)
+
+        self.randomization_params = self.cfg["task"]["randomization_params"]
+        self.randomize = self.cfg["task"]["randomize"]
+        self.dof_vel_scale = self.cfg["env"]["dofVelocityScale"]
+        self.contact_force_scale = self.cfg["env"]["contactForceScale"]
+        self.power_scale = self.cfg["env"]["powerScale"]
+        self.heading_weight = self.cfg["env"]["headingWeight"]
+        self.up_weight = self.cfg["env"]["upWeight"]
+        self.actions_cost_scale = self.cfg["env"]["actionsCost"]
+        self.energy_cost_scale = self.cfg["env"]["energyCost"]
+        self.joints_at_limit_cost_scale = self.cfg["env"]["jointsAtLimitCost"]
+        self.death_cost = self.cfg["env"]["deathCost"]
+
+        self.debug_viz = self.cfg["env"]["enableDebugVis"]
+        self.plane_static_friction = self.cfg["env"]["plane"]["staticFriction"]
+        self.plane_dynamic_friction = self.cfg["env"]["plane"]["dynamicFriction"]
+        self.plane_restitution = self.cfg["env"]["plane"]["restitution"]
+
     def create_sim(self):
         self.up_axis_idx = 2 # index of up axis: Y=1, Z=2
         self.sim = super().create_sim(self.device_id, self.graphics_device_id, self.physics_engine, self.sim_params)
@@ -205,10 +233,7 @@ class Unimal(VecTask):
 
         self.torso_index = 0
         self.num_bodies = self.gym.get_asset_rigid_body_count(unimal_asset)
-        body_names = [self.gym.get_asset_rigid_body_name(unimal_asset, i) for i in range(self.num_bodies)]
-        # extremity_names = [s for s in body_names if "foot" in s]
-        extremity_names = body_names
-        self.extremities_index = torch.zeros(len(extremity_names), dtype=torch.long, device=self.device)
+        extremity_names = self.sensor_body_names
 
         # create force sensors attached to the "feet"
         extremity_indices = [self.gym.find_asset_rigid_body_index(unimal_asset, name) for name in extremity_names]
@@ -218,9 +243,8 @@ class Unimal(VecTask):
 
         self.unimal_handles = []
         self.envs = []
-        self.dof_limits_lower = []
-        self.dof_limits_upper = []
 
+        color_bodies = self._color_at_creation()
         for i in range(self.num_envs):
             # create env instance
             env_ptr = self.gym.create_env(
@@ -228,27 +252,44 @@ class Unimal(VecTask):
             )
             unimal_handle = self.gym.create_actor(env_ptr, unimal_asset, start_pose, "unimal", 0, 0, 0)
 
-            for j in range(self.num_bodies):
-                self.gym.set_rigid_body_color(
-                    env_ptr, unimal_handle, j, gymapi.MESH_VISUAL, gymapi.Vec3(0.97, 0.38, 0.06))
+            if color_bodies:
+                self._color_bodies(env_ptr, unimal_handle, self.num_bodies)
 
             self.envs.append(env_ptr)
             self.unimal_handles.append(unimal_handle)
-
-        dof_prop = self.gym.get_actor_dof_properties(env_ptr, unimal_handle)
-        for j in range(self.num_dof):
-            if dof_prop['lower'][j] > dof_prop['upper'][j]:
-                self.dof_limits_lower.append(dof_prop['upper'][j])
-                self.dof_limits_upper.append(dof_prop['lower'][j])
-            else:
-                self.dof_limits_lower.append(dof_prop['lower'][j])
-                self.dof_limits_upper.append(dof_prop['upper'][j])
-
-        self.dof_limits_lower = to_torch(self.dof_limits_lower, device=self.device)
-        self.dof_limits_upper = to_torch(self.dof_limits_upper, device=self.device)
-
-        for i in range(len(extremity_names)):
-            self.extremities_index[i] = self.gym.find_actor_rigid_body_handle(self.envs[0], self.unimal_handles[0], extremity_names[i])
+        self.bodies_colored = color_bodies
+
+        # Actors have the dof properties of the asset, read them once.
+        self.dof_limits_lower, self.dof_limits_upper = self._get_dof_limits(unimal_asset)
+
+        # Single actor envs, the rigid body handles are the asset indices.
+        self.extremities_index = to_torch(extremity_indices, dtype=torch.long, device=self.device)
+
+    def _color_at_creation(self):
+        return self.body_color == "all" or (self.body_color == "auto" and not self.headless)
+
+    def _color_bodies(self, env_ptr, unimal_handle, num_bodies):
+        for j in range(num_bodies):
+            self.gym.set_rigid_body_color(
+                env_ptr, unimal_handle, j, gymapi.MESH_VISUAL, gymapi.Vec3(0.97, 0.38, 0.06))
+
+    def apply_body_colors(self):
+        """Color the bodies of envs created without colors (bodyColor
+        deferred, or auto when headless), e.g before recording a camera.
+        """
+        if self.bodies_colored:
+            return
+        for env_ptr, unimal_handle in zip(self.envs, self.unimal_handles):
+            num_bodies = self.gym.get_actor_rigid_body_count(env_ptr, unimal_handle)
+            self._color_bodies(env_ptr, unimal_handle, num_bodies)
+        self.bodies_colored = True
+
+    def _get_dof_limits(self, unimal_asset):
+        """Lower and upper dof limits of an asset, swapped where reversed."""
+        dof_prop = self.gym.get_asset_dof_properties(unimal_asset)
+        lower = np.minimum(dof_prop['lower'], dof_prop['upper'])
+        upper = np.maximum(dof_prop['lower'], dof_prop['upper'])
+        return to_torch(lower, device=self.device), to_torch(upper, device=self.device)
 
     def compute_reward(self, actions):
         velocity_obs_start = self.observation_space_map_cum['dof_meas_vel']
@@ -278,12 +319,86 @@ class Unimal(VecTask):
             position_idx
         )
 
+    def compute_observations_and_reward(self):
+        """Fused compute_observations and compute_reward (obsKernel fused)."""
+        self.gym.refresh_dof_state_tensor(self.sim)
+        self.gym.refresh_actor_root_state_tensor(self.sim)
+        self.gym.refresh_force_sensor_tensor(self.sim)
+
+        (self.obs_buf[:], self.potentials[:], self.prev_potentials[:], self.up_vec[:],
+         self.heading_vec[:], self.rew_buf[:], self.reset_buf[:], self.next_timeout_buf) = \
+            compute_unimal_observations_and_reward(
+                self.obs_buf, self.root_states, self.targets, self.potentials,
+                self.inv_start_rot, self.dof_pos, self.dof_vel,
+                self.dof_limits_lower, self.dof_limits_upper, self.dof_vel_scale,
+                self.basis_vec0, self.basis_vec1, self.up_axis_idx,
+                self.vec_sensor_tensor, self.actions, self.dt, self.contact_force_scale,
+                self.vec_sensor_length,
+                self.reset_buf, self.progress_buf, self.up_weight, self.heading_weight,
+                self.actions_cost_scale, self.energy_cost_scale, self.joints_at_limit_cost_scale,
+                self.termination_height, self.death_cost, self.max_episode_length
+            )
+
+    def init_next_timeouts(self):
+        """Time outs of the next step when obsKernel is fused. Those of the
+        first step come from the initial progress_buf, as without fusing.
+        """
+        VecTask.compute_timeouts(self)
+        self.next_timeout_buf = self.timeout_buf.clone()
+
+    def compute_timeouts(self):
+        if self.obs_kernel != "fused":
+            super().compute_timeouts()
+            return
+        # Computed by the fused kernel of the previous step from the same
+        # progress_buf.
+        self.timeout_buf = self.next_timeout_buf
+
+    def accumulate_reward_terms(self):
+        # forward: progress towards the target, stand: reward for keeping the
+        # up axis aligned, as in compute_unimal_reward.
+        self.episode_reward_terms["forward"] += self.potentials - self.prev_potentials
+        self.episode_reward_terms["stand"] += torch.where(
+            self.obs_buf[:, 10] > 0.93,
+            torch.full_like(self.potentials, self.up_weight),
+            torch.zeros_like(self.potentials),
+        )
+
+    def finished_episodes(self, env_ids):
+        """Mask of the envs of env_ids whose reset ends an episode. Envs are
+        also reset before their first step, e.g all of them on the first
+        step. post_physics_step already counted the current step, so those
+        have progress_buf 1 and envs with an episode at least 2.
+        """
+        return self.progress_buf[env_ids] > 1
+
+    def end_episodes(self, env_ids):
+        """Report the reward terms of the episodes of env_ids which ended."""
+        finished_ids = env_ids[self.finished_episodes(env_ids)]
+        self.extras["episode"] = {
+            "__reward__{}".format(term): returns[finished_ids].clone()
+            for term, returns in self.episode_reward_terms.items()
+        }
+        for returns in self.episode_reward_terms.values():
+            returns[env_ids] = 0
+
     def compute_observations(self):
         self.gym.refresh_dof_state_tensor(self.sim)
         self.gym.refresh_actor_root_state_tensor(self.sim)
         self.gym.refresh_force_sensor_tensor(self.sim)
         #print("Feet forces and torques: ", self.vec_sensor_tensor[0, :])
 
+        if self.obs_writer is not None:
+            self.obs_writer.write(
+                self.root_states, self.targets, self.potentials, self.prev_potentials,
+                self.inv_start_rot, self.dof_pos, self.dof_vel,
+                self.dof_limits_lower, self.dof_limits_upper, self.dof_vel_scale,
+                self.basis_vec0, self.basis_vec1, self.up_axis_idx,
+                self.vec_sensor_tensor, self.actions, self.dt, self.contact_force_scale,
+                self.vec_sensor_length, self.up_vec, self.heading_vec
+            )
+            return
+
         self.obs_buf[:], self.potentials[:], self.prev_potentials[:], self.up_vec[:], self.heading_vec[:] = compute_unimal_observations(
             self.obs_buf, self.root_states, self.targets, self.potentials,
             self.inv_start_rot, self.dof_pos, self.dof_vel,
@@ -332,12 +447,27 @@ class Unimal(VecTask):
         self.progress_buf += 1
         self.randomize_buf += 1
 
+        profiler = self.profiler
         env_ids = self.reset_buf.nonzero(as_tuple=False).flatten()
         if len(env_ids) > 0:
+            self.end_episodes(env_ids)
             self.reset_idx(env_ids)
-
-        self.compute_observations()
-        self.compute_reward(self.actions)
+        else:
+            self.extras.pop("episode", None)
+        if profiler is not None:
+            profiler.count("resets", len(env_ids))
+            profiler.mark("resets")
+
+        if self.obs_kernel == "fused":
+            self.compute_observations_and_reward()
+        else:
+            self.compute_observations()
+            if profiler is not None:
+                profiler.mark("observations")
+            self.compute_reward(self.actions)
+        self.accumulate_reward_terms()
+        if profiler is not None:
+            profiler.mark("reward")
 
         # debug viz
         if self.viewer and self.debug_viz:
@@ -452,7 +582,85 @@ def compute_unimal_observations(obs_buf, root_states, targets, potentials,
     obs = torch.cat((torso_position[:, up_axis_idx].view(-1, 1), vel_loc, angvel_loc,
                      yaw.unsqueeze(-1), roll.unsqueeze(-1), angle_to_target.unsqueeze(-1),
                      up_proj.unsqueeze(-1), heading_proj.unsqueeze(-1), dof_pos_scaled,
-                     dof_vel * dof_vel_scale, sensor_force_torques.view(-1, vec_sensor_length) * contact_force_scale,
+                     dof_vel * dof_vel_scale, sensor_force_torques.view(root_states.shape[0], vec_sensor_length) * contact_force_scale,
                      actions), dim=-1)
 
     return obs, potentials, prev_potentials_new, up_vec, heading_vec
+
+
+@torch.jit.script
+def compute_unimal_observations_and_reward(
+    obs_buf, root_states, targets, potentials,
+    inv_start_rot, dof_pos, dof_vel,
+    dof_limits_lower, dof_limits_upper, dof_vel_scale,
+    basis_vec0, basis_vec1, up_axis_idx,
+    sensor_force_torques, actions, dt, contact_force_scale,
+    vec_sensor_length,
+    reset_buf, progress_buf, up_weight, heading_weight,
+    actions_cost_scale, energy_cost_scale, joints_at_limit_cost_scale,
+    termination_height, death_cost, max_episode_length
+):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, float, Tensor, Tensor, int, Tensor, Tensor, float, float, int, Tensor, Tensor, float, float, float, float, float, float, float, float) -> Tuple[Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor]
+    # compute_unimal_observations and compute_unimal_reward in one pass, the
+    # reward uses the projections and scaled dofs directly instead of reading
+    # them back from obs_buf. Also returns the time outs of the next step.
+
+    torso_position = root_states[:, 0:3]
+    torso_rotation = root_states[:, 3:7]
+    velocity = root_states[:, 7:10]
+    ang_velocity = root_states[:, 10:13]
+
+    to_target = targets - torso_position
+    to_target[:, 2] = 0.0
+
+    prev_potentials_new = potentials.clone()
+    potentials = -torch.norm(to_target, p=2, dim=-1) / dt
+
+    torso_quat, up_proj, heading_proj, up_vec, heading_vec = compute_heading_and_up(
+        torso_rotation, inv_start_rot, to_target, basis_vec0, basis_vec1, 2)
+
+    vel_loc, angvel_loc, roll, pitch, yaw, angle_to_target = compute_rot(
+        torso_quat, velocity, ang_velocity, targets, torso_position)
+
+    torso_height = torso_position[:, up_axis_idx]
+    dof_pos_scaled = unscale(dof_pos, dof_limits_lower, dof_limits_upper)
+    dof_vel_scaled = dof_vel * dof_vel_scale
+
+    obs = torch.cat((torso_height.view(-1, 1), vel_loc, angvel_loc,
+                     yaw.unsqueeze(-1), roll.unsqueeze(-1), angle_to_target.unsqueeze(-1),
+                     up_proj.unsqueeze(-1), heading_proj.unsqueeze(-1), dof_pos_scaled,
+                     dof_vel_scaled, sensor_force_torques.view(root_states.shape[0], vec_sensor_length) * contact_force_scale,
+                     actions), dim=-1)
+
+    # reward from direction headed
+    heading_weight_tensor = torch.ones_like(heading_proj) * heading_weight
+    heading_reward = torch.where(heading_proj > 0.8, heading_weight_tensor, heading_weight * heading_proj / 0.8)
+
+    # aligning up axis of unimal and environment
+    up_reward = torch.zeros_like(heading_reward)
+    up_reward = torch.where(up_proj > 0.93, up_reward + up_weight, up_reward)
+
+    # energy penalty for movement
+    actions_cost = torch.sum(actions ** 2, dim=-1)
+    electricity_cost = torch.sum(torch.abs(actions * dof_vel_scaled), dim=-1)
+    dof_at_limit_cost = torch.sum(dof_pos_scaled > 0.99, dim=-1)
+
+    # reward for duration of staying alive
+    alive_reward = torch.ones_like(potentials) * 0.5
+    progress_reward = potentials - prev_potentials_new
+
+    total_reward = progress_reward + alive_reward + up_reward + heading_reward - \
+        actions_cost_scale * actions_cost - energy_cost_scale * electricity_cost - dof_at_limit_cost * joints_at_limit_cost_scale
+
+    # adjust reward for fallen agents
+    fallen = torso_height < termination_height
+    total_reward = torch.where(fallen, torch.ones_like(total_reward) * death_cost, total_reward)
+
+    # reset agents, progress_buf is the one VecTask.step of the next step
+    # computes its time outs from.
+    timeout = progress_buf >= max_episode_length - 1
+    reset = torch.where(fallen, torch.ones_like(reset_buf), reset_buf)
+    reset = torch.where(timeout, torch.ones_like(reset_buf), reset)
+    timeout_buf = torch.where(timeout, torch.ones_like(reset_buf), torch.zeros_like(reset_buf))
+
+    return obs, potentials, prev_potentials_new, up_vec, heading_vec, total_reward, reset, timeout_buf
@@ -0,0 +1,151 @@
+"""Kernels of the Unimal task which write into preallocated buffers.
+
+compute_unimal_observations allocates the full observation with torch.cat
+and a dozen intermediate tensors every step. ObservationWriter computes the
+same observation in place: each section is written through a view of
+obs_buf (see observation_space_map_cum) with out= ops, and intermediate
+results go to scratch buffers allocated once. The observation is always
+computed in float32: with a reduced precision obs_buf (bufferPrecision) the
+sections are written to a float32 scratch observation, cast into obs_buf by
+a single copy at the end of the write. Only torch is needed, so the
+kernels can be checked and benchmarked on CPU without IsaacGym (see
+tools/bench_unimal_kernels.py).
+"""
+
+import math
+
+import torch
+
+# Kernels computing the observations of the Unimal task. fused also computes
+# the reward, resets and time outs, see compute_unimal_observations_and_reward.
+OBS_KERNELS = ["jit", "inplace", "fused"]
+
+
+def get_section_views(obs_buf, observation_space_map):
+    """Return {section: view of obs_buf}, in the order of the layout."""
+    views = {}
+    start = 0
+    for section, size in observation_space_map.items():
+        views[section] = obs_buf[:, start:start + size]
+        start += size
+    return views
+
+
+class ObservationWriter:
+    def __init__(self, obs_buf, observation_space_map):
+        self.obs_buf = obs_buf
+        num_envs = obs_buf.shape[0]
+        kwargs = {"device": obs_buf.device, "dtype": torch.float}
+        # Sections are written in place when obs_buf is float32, otherwise
+        # the out= ops would round every intermediate result.
+        if obs_buf.dtype == torch.float:
+            self.obs = obs_buf
+        else:
+            self.obs = torch.zeros(obs_buf.shape, **kwargs)
+        self.views = get_section_views(self.obs, observation_space_map)
+
+        self.to_target = torch.zeros((num_envs, 3), **kwargs)
+        self.target_dirs = torch.zeros((num_envs, 3), **kwargs)
+        self.torso_quat = torch.zeros((num_envs, 4), **kwargs)
+        self.vec_tmp = torch.zeros((num_envs, 3), **kwargs)
+        self.scalar_tmp = [torch.zeros(num_envs, **kwargs) for _ in range(3)]
+        # Allocated on the first write, once the number of dofs is known
+        self.dof_range = None
+
+    def _quat_mul(self, a, b):
+        """torso_quat = a * b, quaternions are (x, y, z, w)."""
+        x1, y1, z1, w1 = a.unbind(-1)
+        x2, y2, z2, w2 = b.unbind(-1)
+        x, y, z, w = self.torso_quat.unbind(-1)
+        torch.mul(w1, x2, out=x).addcmul_(x1, w2).addcmul_(y1, z2).addcmul_(z1, y2, value=-1)
+        torch.mul(w1, y2, out=y).addcmul_(x1, z2, value=-1).addcmul_(y1, w2).addcmul_(z1, x2)
+        torch.mul(w1, z2, out=z).addcmul_(x1, y2).addcmul_(y1, x2, value=-1).addcmul_(z1, w2)
+        torch.mul(w1, w2, out=w).addcmul_(x1, x2, value=-1).addcmul_(y1, y2, value=-1).addcmul_(z1, z2, value=-1)
+
+    def _quat_rotate(self, v, out, inverse=False):
+        """out = v rotated by torso_quat (by its inverse if inverse)."""
+        q = self.torso_quat
+        q_vec, q_w = q[:, :3], q[:, 3:]
+        s = self.scalar_tmp[0].unsqueeze(-1)
+
+        torch.mul(q_w, q_w, out=s).mul_(2.0).sub_(1.0)
+        torch.mul(v, s, out=out)
+        torch.cross(q_vec, v, dim=-1, out=self.vec_tmp)
+        out.addcmul_(self.vec_tmp, q_w, value=-2.0 if inverse else 2.0)
+        torch.mul(q_vec, v, out=self.vec_tmp)
+        torch.sum(self.vec_tmp, dim=-1, keepdim=True, out=s).mul_(2.0)
+        out.addcmul_(q_vec, s)
+
+    def _dot(self, a, b, out):
+        torch.mul(a, b, out=self.vec_tmp)
+        torch.sum(self.vec_tmp, dim=-1, out=out)
+
+    def write(self, root_states, targets, potentials, prev_potentials,
+              inv_start_rot, dof_pos, dof_vel,
+              dof_limits_lower, dof_limits_upper, dof_vel_scale,
+              basis_vec0, basis_vec1, up_axis_idx,
+              sensor_force_torques, actions, dt, contact_force_scale,
+              vec_sensor_length, up_vec, heading_vec):
+        """Same as compute_unimal_observations, but obs_buf, potentials,
+        prev_potentials, up_vec and heading_vec are written in place.
+        """
+        views = self.views
+        torso_position = root_states[:, 0:3]
+        torso_rotation = root_states[:, 3:7]
+        velocity = root_states[:, 7:10]
+        ang_velocity = root_states[:, 10:13]
+        norm, s1, s2 = self.scalar_tmp[1], self.scalar_tmp[2], self.scalar_tmp[0]
+
+        to_target = self.to_target
+        torch.sub(targets, torso_position, out=to_target)
+        to_target[:, 2].zero_()
+
+        prev_potentials.copy_(potentials)
+        torch.linalg.vector_norm(to_target, dim=-1, out=norm)
+        torch.div(norm, -dt, out=potentials)
+
+        # compute_heading_and_up
+        torch.clamp(norm, min=1e-9, out=norm)
+        torch.div(to_target, norm.unsqueeze(-1), out=self.target_dirs)
+        self._quat_mul(torso_rotation, inv_start_rot)
+        self._quat_rotate(basis_vec1, up_vec)
+        self._quat_rotate(basis_vec0, heading_vec)
+        proj = views["up_and_heading_vec_proj"]
+        proj[:, 0].copy_(up_vec[:, 2])
+        self._dot(heading_vec, self.target_dirs, proj[:, 1])
+
+        # compute_rot
+        self._quat_rotate(velocity, views["velocity_positional"], inverse=True)
+        self._quat_rotate(ang_velocity, views["velocity_angular"], inverse=True)
+        x, y, z, w = self.torso_quat.unbind(-1)
+        angles = views["angle_to_target"]
+        yaw, roll, angle_to_target = angles.unbind(-1)
+        torch.mul(w, x, out=s1).addcmul_(y, z).mul_(2.0)
+        torch.mul(w, w, out=s2).addcmul_(x, x, value=-1).addcmul_(y, y, value=-1).addcmul_(z, z)
+        torch.atan2(s1, s2, out=roll).remainder_(2 * math.pi)
+        torch.mul(w, z, out=s1).addcmul_(x, y).mul_(2.0)
+        torch.mul(w, w, out=s2).addcmul_(x, x).addcmul_(y, y, value=-1).addcmul_(z, z, value=-1)
+        torch.atan2(s1, s2, out=yaw).remainder_(2 * math.pi)
+        torch.sub(targets[:, 2], torso_position[:, 2], out=s1)
+        torch.sub(targets[:, 0], torso_position[:, 0], out=s2)
+        torch.atan2(s1, s2, out=angle_to_target).sub_(yaw)
+
+        views["torso_vertical_position"][:, 0].copy_(torso_position[:, up_axis_idx])
+
+        # unscale
+        if self.dof_range is None:
+            self.dof_range = torch.empty_like(dof_limits_upper)
+        torch.sub(dof_limits_upper, dof_limits_lower, out=self.dof_range)
+        dof_meas_pos = views["dof_meas_pos"]
+        torch.mul(dof_pos, 2.0, out=dof_meas_pos).sub_(dof_limits_upper).sub_(dof_limits_lower)
+        dof_meas_pos.div_(self.dof_range)
+
+        torch.mul(dof_vel, dof_vel_scale, out=views["dof_meas_vel"])
+        torch.mul(
+            sensor_force_torques.view(root_states.shape[0], vec_sensor_length), contact_force_scale,
+            out=views["sensor_state"]
+        )
+        views["actions"].copy_(actions)
+
+        if self.obs is not self.obs_buf:
+            self.obs_buf.copy_(self.obs)
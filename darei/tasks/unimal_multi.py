@@ -0,0 +1,415 @@
+import numpy as np
+import os
+from collections import OrderedDict
+
+from darei.utils import observation as obsu
+from darei.utils import xml as xu
+
+import isaacgym
+from isaacgym import gymapi
+from isaacgym import gymtorch
+from isaacgym.gymtorch import *
+
+from isaacgymenvs.utils.torch_jit_utils import *
+from darei.tasks.base.vec_task import VecTask
+from darei.tasks.unimal import REWARD_TERMS, Unimal, compute_unimal_observations, compute_unimal_reward
+
+import torch
+
+
+class MorphologyGroup:
+    """Contiguous range of envs [start, end) which simulate the same unimal."""
+
+    def __init__(self, asset_file, start, end, force_sensors="all"):
+        self.asset_file = asset_file
+        self.unimal_id = os.path.basename(asset_file).split(".")[0]
+        self.start = start
+        self.end = end
+        self.num_envs = end - start
+
+        root, _ = xu.etree_from_xml(asset_file)
+        worldbody = root.findall("./worldbody")[0]
+        body = worldbody.findall("./body")[0]
+        assert(body.attrib['name'] == 'torso/0')
+
+        head_position = [float(n) for n in body.attrib['pos'].split(' ')]
+        self.termination_height = 0.5 * head_position[2]
+
+        self.num_actuators = len(root.findall("./actuator")[0])
+        self.num_bodies = len(worldbody.findall(".//body"))
+        # Bodies with a force sensor, see obsu.get_sensor_body_names.
+        self.sensor_body_names = obsu.get_sensor_body_names(root, force_sensors)
+        self.num_sensors = len(self.sensor_body_names)
+        # Each force sensor state has forces (3) and torques (3) data => 6.
+        self.vec_sensor_length = self.num_sensors * obsu.SENSOR_DIM
+
+
+class UnimalMulti(Unimal):
+    """Unimal task which simulates several morphologies in a single sim.
+
+    Envs are split into contiguous groups, one per asset in
+    env.asset.assetFileNames. Observations and actions are padded to the
+    largest morphology and a one hot morphology id is appended to the
+    observations, so a single policy is trained for all the groups. Episode
+    returns are tracked per group, see get_group_rewards.
+    """
+
+    def __init__(self, cfg, sim_device, graphics_device_id, headless):
+
+        self.cfg = cfg
+        self._read_cfg()
+        # Observations are computed per group with the scripted kernel, the
+        # inplace and fused kernels only support a single morphology.
+        assert self.obs_kernel == "jit", \
+            "UnimalMulti only supports obsKernel jit, got {}".format(self.obs_kernel)
+
+        asset_files = list(self.cfg["env"]["asset"]["assetFileNames"])
+        num_envs = self.cfg["env"]["numEnvs"]
+        num_groups = len(asset_files)
+        assert num_groups > 0, "UnimalMulti needs at least one asset"
+        assert num_envs >= num_groups, "Less envs than morphologies"
+
+        # Split envs as evenly as possible, first groups get the remainder.
+        self.groups = []
+        start = 0
+        for idx, asset_file in enumerate(asset_files):
+            group_num_envs = num_envs // num_groups + int(idx < num_envs % num_groups)
+            self.groups.append(MorphologyGroup(
+                asset_file, start, start + group_num_envs, self.force_sensors
+            ))
+            start += group_num_envs
+        self.unimal_ids = [group.unimal_id for group in self.groups]
+
+        self.num_actuators = max(group.num_actuators for group in self.groups)
+        self.vec_sensor_length = max(group.vec_sensor_length for group in self.groups)
+
+        # Same layout as Unimal, sections are sized for the largest morphology.
+        self.observation_space_map = obsu.get_observation_space_map(
+            self.num_actuators, self.vec_sensor_length // obsu.SENSOR_DIM
+        )
+        self.observation_space_map['morphology_id'] = num_groups
+
+        self.observation_space_map_cum = {}
+        cumulative_idx = 0
+        for obs_key in self.observation_space_map:
+            self.observation_space_map_cum[obs_key] = cumulative_idx
+            cumulative_idx += self.observation_space_map[obs_key]
+
+        self.num_observations = cumulative_idx
+        self.cfg["env"]["numObservations"] = self.num_observations
+        self.cfg["env"]["numActions"] = self.num_actuators
+
+        VecTask.__init__(self, config=self.cfg, sim_device=sim_device, graphics_device_id=graphics_device_id, headless=headless)
+
+        if self.viewer != None:
+            cam_pos = gymapi.Vec3(50.0, 25.0, 2.4)
+            cam_target = gymapi.Vec3(45.0, 25.0, 0.0)
+            self.gym.viewer_camera_look_at(self.viewer, None, cam_pos, cam_target)
+
+        # get gym GPU state tensors
+        actor_root_state = self.gym.acquire_actor_root_state_tensor(self.sim)
+        dof_state_tensor = self.gym.acquire_dof_state_tensor(self.sim)
+        sensor_tensor = self.gym.acquire_force_sensor_tensor(self.sim)
+
+        self.gym.refresh_dof_state_tensor(self.sim)
+        self.gym.refresh_actor_root_state_tensor(self.sim)
+
+        self.root_states = gymtorch.wrap_tensor(actor_root_state)
+        self.initial_root_states = self.root_states.clone()
+        self.initial_root_states[:, 7:13] = 0  # set lin_vel and ang_vel to 0
+
+        # DOFs and force sensors of all actors are laid out env after env, so
+        # each group owns a contiguous slice of the state tensors.
+        self.dof_state = gymtorch.wrap_tensor(dof_state_tensor)
+        if self.vec_sensor_length > 0:
+            self.vec_sensor_tensor = gymtorch.wrap_tensor(sensor_tensor)
+        else:
+            self.vec_sensor_tensor = torch.zeros((0, obsu.SENSOR_DIM), device=self.device)
+        zero_tensor = torch.tensor([0.0], device=self.device)
+        dof_offset = 0
+        sensor_offset = 0
+        for group in self.groups:
+            num_group_dofs = group.num_envs * group.num_dof
+            group_dof_state = self.dof_state[dof_offset : dof_offset + num_group_dofs]
+            group_dof_state = group_dof_state.view(group.num_envs, group.num_dof, 2)
+            group.dof_pos = group_dof_state[..., 0]
+            group.dof_vel = group_dof_state[..., 1]
+            dof_offset += num_group_dofs
+
+            num_group_sensors = group.num_envs * group.num_sensors
+            group.vec_sensor_tensor = self.vec_sensor_tensor[
+                sensor_offset : sensor_offset + num_group_sensors
+            ].view(group.num_envs, group.vec_sensor_length)
+            sensor_offset += num_group_sensors
+
+            group.initial_dof_pos = torch.zeros_like(group.dof_pos, device=self.device, dtype=torch.float)
+            group.initial_dof_pos = torch.where(group.dof_limits_lower > zero_tensor, group.dof_limits_lower,
+                                                torch.where(group.dof_limits_upper < zero_tensor, group.dof_limits_upper, group.initial_dof_pos))
+
+        self._init_padding()
+
+        # initialize some data used later on
+        self.up_vec = to_torch(get_axis_params(1., self.up_axis_idx), device=self.device).repeat((self.num_envs, 1))
+        self.heading_vec = to_torch([1, 0, 0], device=self.device).repeat((self.num_envs, 1))
+        self.inv_start_rot = quat_conjugate(self.start_rotation).repeat((self.num_envs, 1))
+
+        self.basis_vec0 = self.heading_vec.clone()
+        self.basis_vec1 = self.up_vec.clone()
+
+        self.targets = to_torch([1000, 0, 0], device=self.device).repeat((self.num_envs, 1))
+        self.target_dirs = to_torch([1, 0, 0], device=self.device).repeat((self.num_envs, 1))
+        self.dt = self.cfg["sim"]["dt"]
+        self.potentials = to_torch([-1000./self.dt], device=self.device).repeat(self.num_envs)
+        self.prev_potentials = self.potentials.clone()
+
+        # Return of the running and of the last finished episode of each env.
+        self.episode_return = torch.zeros(self.num_envs, device=self.device, dtype=torch.float)
+        self.last_episode_return = torch.zeros_like(self.episode_return)
+        self.has_episode = torch.zeros(self.num_envs, device=self.device, dtype=torch.bool)
+        self.episode_reward_terms = {
+            term: torch.zeros(self.num_envs, device=self.device, dtype=torch.float)
+            for term in REWARD_TERMS
+        }
+        self.last_episode_reward_terms = {
+            term: torch.zeros_like(returns)
+            for term, returns in self.episode_reward_terms.items()
+        }
+
+    def _init_padding(self):
+        """Index tensors mapping each group onto the padded obs and actions."""
+        self.action_mask = torch.zeros((self.num_envs, self.num_actuators), device=self.device, dtype=torch.float)
+        self.morphology_onehot = torch.zeros((self.num_envs, len(self.groups)), device=self.device, dtype=torch.float)
+
+        # Position of each simulated dof in the flattened padded actions.
+        action_index = []
+        joint_gears = []
+        for group_idx, group in enumerate(self.groups):
+            self.action_mask[group.start : group.end, : group.num_dof] = 1.0
+            self.morphology_onehot[group.start : group.end, group_idx] = 1.0
+
+            env_ids = torch.arange(group.start, group.end, device=self.device)
+            dof_ids = torch.arange(group.num_dof, device=self.device)
+            action_index.append((env_ids.view(-1, 1) * self.num_actuators + dof_ids).flatten())
+            joint_gears.append(group.joint_gears.repeat(group.num_envs))
+
+            # Columns of obs_buf which hold the unpadded obs of the group.
+            obs_cols = []
+            for obs_key, size in self.observation_space_map.items():
+                if obs_key == 'morphology_id':
+                    continue
+                if obs_key in ('dof_meas_pos', 'dof_meas_vel', 'actions'):
+                    size = group.num_dof
+                elif obs_key == 'sensor_state':
+                    size = group.vec_sensor_length
+                start = self.observation_space_map_cum[obs_key]
+                obs_cols.extend(range(start, start + size))
+            group.obs_cols = torch.tensor(obs_cols, device=self.device, dtype=torch.long)
+
+        self.action_index = torch.cat(action_index)
+        self.joint_gears = torch.cat(joint_gears)
+
+        morphology_start = self.observation_space_map_cum['morphology_id']
+        self.morphology_cols = slice(morphology_start, morphology_start + len(self.groups))
+
+    def _create_envs(self, num_envs, spacing, num_per_row):
+        lower = gymapi.Vec3(-spacing, -spacing, 0.0)
+        upper = gymapi.Vec3(spacing, spacing, spacing)
+
+        asset_options = gymapi.AssetOptions()
+        # Note - DOF mode is set in the MJCF file and loaded by Isaac Gym
+        asset_options.default_dof_drive_mode = gymapi.DOF_MODE_NONE
+        asset_options.angular_damping = 0.0
+
+        start_pose = gymapi.Transform()
+        start_pose.p = gymapi.Vec3(*get_axis_params(2, self.up_axis_idx))
+
+        self.start_rotation = torch.tensor([start_pose.r.x, start_pose.r.y, start_pose.r.z, start_pose.r.w], device=self.device)
+
+        self.torso_index = 0
+        self.unimal_handles = []
+        self.envs = []
+        color_bodies = self._color_at_creation()
+
+        for group in self.groups:
+            asset_root = os.path.dirname(group.asset_file)
+            asset_file = os.path.basename(group.asset_file)
+            unimal_asset = self.gym.load_asset(self.sim, asset_root, asset_file, asset_options)
+            group.num_dof = self.gym.get_asset_dof_count(unimal_asset)
+            assert group.num_dof == group.num_actuators, f"{group.unimal_id} has unactuated dofs"
+            assert self.gym.get_asset_rigid_body_count(unimal_asset) == group.num_bodies
+
+            # Note - for this asset we are loading the actuator info from the MJCF
+            actuator_props = self.gym.get_asset_actuator_properties(unimal_asset)
+            motor_efforts = [prop.motor_effort for prop in actuator_props]
+            group.joint_gears = to_torch(motor_efforts, device=self.device)
+
+            # create force sensors attached to the bodies of forceSensors
+            sensor_pose = gymapi.Transform()
+            for name in group.sensor_body_names:
+                body_idx = self.gym.find_asset_rigid_body_index(unimal_asset, name)
+                self.gym.create_asset_force_sensor(unimal_asset, body_idx, sensor_pose)
+
+            for i in range(group.start, group.end):
+                # create env instance
+                env_ptr = self.gym.create_env(
+                    self.sim, lower, upper, num_per_row
+                )
+                unimal_handle = self.gym.create_actor(env_ptr, unimal_asset, start_pose, "unimal", 0, 0, 0)
+
+                if color_bodies:
+                    self._color_bodies(env_ptr, unimal_handle, group.num_bodies)
+
+                self.envs.append(env_ptr)
+                self.unimal_handles.append(unimal_handle)
+
+            group.dof_limits_lower, group.dof_limits_upper = self._get_dof_limits(unimal_asset)
+
+        self.bodies_colored = color_bodies
+        self.num_dof = self.num_actuators
+
+    def compute_reward(self, actions):
+        velocity_obs_start = self.observation_space_map_cum['dof_meas_vel']
+        velocity_obs_end = velocity_obs_start + self.observation_space_map['dof_meas_vel']
+        velocity_idx = (velocity_obs_start, velocity_obs_end)
+
+        position_obs_start = self.observation_space_map_cum['dof_meas_pos']
+        position_obs_end = position_obs_start + self.observation_space_map['dof_meas_pos']
+        position_idx = (position_obs_start, position_obs_end)
+
+        # Padded obs and actions are zero so they do not contribute to the
+        # costs, only the termination height differs between groups.
+        for group in self.groups:
+            s = slice(group.start, group.end)
+            self.rew_buf[s], self.reset_buf[s] = compute_unimal_reward(
+                self.obs_buf[s],
+                self.reset_buf[s],
+                self.progress_buf[s],
+                self.actions[s],
+                self.up_weight,
+                self.heading_weight,
+                self.potentials[s],
+                self.prev_potentials[s],
+                self.actions_cost_scale,
+                self.energy_cost_scale,
+                self.joints_at_limit_cost_scale,
+                group.termination_height,
+                self.death_cost,
+                self.max_episode_length,
+                velocity_idx,
+                position_idx
+            )
+
+        self.episode_return += self.rew_buf
+
+    def compute_observations(self):
+        self.gym.refresh_dof_state_tensor(self.sim)
+        self.gym.refresh_actor_root_state_tensor(self.sim)
+        self.gym.refresh_force_sensor_tensor(self.sim)
+
+        for group in self.groups:
+            s = slice(group.start, group.end)
+            group_obs, self.potentials[s], self.prev_potentials[s], self.up_vec[s], self.heading_vec[s] = compute_unimal_observations(
+                self.obs_buf[s], self.root_states[s], self.targets[s], self.potentials[s],
+                self.inv_start_rot[s], group.dof_pos, group.dof_vel,
+                group.dof_limits_lower, group.dof_limits_upper, self.dof_vel_scale,
+                self.basis_vec0[s], self.basis_vec1[s], self.up_axis_idx,
+                group.vec_sensor_tensor, self.actions[s, :group.num_dof], self.dt, self.contact_force_scale,
+                group.vec_sensor_length
+            )
+            self.obs_buf[s].index_copy_(1, group.obs_cols, group_obs.to(self.obs_buf.dtype))
+
+        self.obs_buf[:, self.morphology_cols] = self.morphology_onehot
+
+    def reset_idx(self, env_ids):
+        # Randomization can happen only at reset time, since it can reset actor positions on GPU
+        if self.randomize:
+            self.apply_randomizations(self.randomization_params)
+
+        for group in self.groups:
+            group_env_ids = env_ids[(env_ids >= group.start) & (env_ids < group.end)]
+            if len(group_env_ids) == 0:
+                continue
+            local_ids = group_env_ids - group.start
+
+            positions = torch_rand_float(-0.2, 0.2, (len(local_ids), group.num_dof), device=self.device)
+            velocities = torch_rand_float(-0.1, 0.1, (len(local_ids), group.num_dof), device=self.device)
+
+            group.dof_pos[local_ids] = tensor_clamp(group.initial_dof_pos[local_ids] + positions, group.dof_limits_lower, group.dof_limits_upper)
+            group.dof_vel[local_ids] = velocities
+
+        env_ids_int32 = env_ids.to(dtype=torch.int32)
+
+        self.gym.set_actor_root_state_tensor_indexed(self.sim,
+                                                     gymtorch.unwrap_tensor(self.initial_root_states),
+                                                     gymtorch.unwrap_tensor(env_ids_int32), len(env_ids_int32))
+
+        self.gym.set_dof_state_tensor_indexed(self.sim,
+                                              gymtorch.unwrap_tensor(self.dof_state),
+                                              gymtorch.unwrap_tensor(env_ids_int32), len(env_ids_int32))
+
+        to_target = self.targets[env_ids] - self.initial_root_states[env_ids, 0:3]
+        to_target[:, 2] = 0.0
+        self.prev_potentials[env_ids] = -torch.norm(to_target, p=2, dim=-1) / self.dt
+        self.potentials[env_ids] = self.prev_potentials[env_ids].clone()
+
+        finished = self.finished_episodes(env_ids)
+        self.last_episode_return[env_ids] = torch.where(
+            finished, self.episode_return[env_ids], self.last_episode_return[env_ids])
+        self.has_episode[env_ids] |= finished
+        self.episode_return[env_ids] = 0
+
+        self.progress_buf[env_ids] = 0
+        self.reset_buf[env_ids] = 0
+
+    def pre_physics_step(self, actions):
+        # Zero the padded actions, they are not applied but would add to the
+        # action cost and show up in the observations.
+        self.actions = actions.clone().to(self.device) * self.action_mask
+        forces = self.actions.view(-1)[self.action_index] * self.joint_gears * self.power_scale
+        force_tensor = gymtorch.unwrap_tensor(forces)
+        self.gym.set_dof_actuation_force_tensor(self.sim, force_tensor)
+
+    def end_episodes(self, env_ids):
+        finished = self.finished_episodes(env_ids)
+        for term, returns in self.episode_reward_terms.items():
+            last_returns = self.last_episode_reward_terms[term]
+            last_returns[env_ids] = torch.where(
+                finished, returns[env_ids], last_returns[env_ids])
+        super().end_episodes(env_ids)
+
+    def _group_mean(self, group, last_returns, returns):
+        """Mean of last_returns over the envs of group with a finished
+        episode, of the running returns if none finished yet.
+        """
+        s = slice(group.start, group.end)
+        has_episode = self.has_episode[s]
+        if has_episode.any():
+            return last_returns[s][has_episode].mean().item()
+        return returns[s].mean().item()
+
+    def get_group_rewards(self):
+        """Return the mean return of the last finished episode of every env
+        in each group, keyed by unimal id.
+        """
+        rewards = OrderedDict()
+        for group in self.groups:
+            rewards[group.unimal_id] = self._group_mean(
+                group, self.last_episode_return, self.episode_return)
+        return rewards
+
+    def get_group_metrics(self):
+        """Return the metrics of each group keyed by unimal id: the reward
+        (see get_group_rewards) and the return of each reward term as
+        __reward__<term>, like the algo observer reports for a single unimal.
+        """
+        metrics = OrderedDict()
+        for group in self.groups:
+            group_metrics = {
+                "reward": self._group_mean(
+                    group, self.last_episode_return, self.episode_return)
+            }
+            for term, returns in self.episode_reward_terms.items():
+                group_metrics["__reward__{}".format(term)] = self._group_mean(
+                    group, self.last_episode_reward_terms[term], returns)
+            metrics[group.unimal_id] = group_metrics
+        return metrics
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+
+import isaacgym
+
+from hydra import compose, initialize
+from omegaconf import OmegaConf
+from isaacgymenvs.utils.reformat import omegaconf_to_dict
+
+from darei.tasks import isaacgym_task_map
+from darei.tasks.unimal import BODY_COLOR_MODES
+
+OmegaConf.register_new_resolver('eq', lambda x, y: x.lower()==y.lower())
+OmegaConf.register_new_resolver('contains', lambda x, y: x.lower() in y.lower())
+OmegaConf.register_new_resolver('if', lambda pred, a, b: a if pred else b)
+OmegaConf.register_new_resolver('resolve_default', lambda default, arg: default if arg=='' else arg)
+
+
+def parse_args():
+    """Parses the arguments."""
+    parser = argparse.ArgumentParser(
+        description="Time the creation of the Unimal task on the CPU pipeline"
+    )
+    parser.add_argument("--xml", help="Unimal xml", required=True, type=str)
+    parser.add_argument(
+        "--num_envs", help="Numbers of envs", nargs="+", type=int,
+        default=[1024, 2048, 4096, 8192],
+    )
+    parser.add_argument(
+        "--body_color", help="Body color modes", nargs="+", default=["all", "auto"],
+        choices=BODY_COLOR_MODES,
+    )
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+
+def create_task(xml_path, num_envs, body_color):
+    hydra_cfg = compose(config_name="config", overrides=[
+        "task=Unimal", "headless=True", "pipeline=cpu", "sim_device=cpu",
+        f"num_envs={num_envs}", f"assetFileName={xml_path}",
+        f"body_color={body_color}",
+    ])
+    start = time.perf_counter()
+    task = isaacgym_task_map["Unimal"](
+        cfg=omegaconf_to_dict(hydra_cfg.task), sim_device="cpu",
+        graphics_device_id=hydra_cfg.graphics_device_id, headless=True,
+    )
+    elapsed = time.perf_counter() - start
+    task.close()
+    return elapsed
+
+
+def main():
+    args = parse_args()
+    initialize(config_path="../cfg")
+    xml_path = os.path.abspath(args.xml)
+
+    for body_color in args.body_color:
+        for num_envs in args.num_envs:
+            elapsed = create_task(xml_path, num_envs, body_color)
+            print(
+                "bodyColor {}, num_envs {}: {:.2f}s, {:.3f}ms per env".format(
+                    body_color, num_envs, elapsed, 1000 * elapsed / num_envs
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
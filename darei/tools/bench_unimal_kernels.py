@@ -0,0 +1,235 @@
+import argparse
+import math
+import time
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from darei.tasks.unimal import (
+    compute_unimal_observations,
+    compute_unimal_observations_and_reward,
+    compute_unimal_reward,
+)
+from darei.tasks.unimal_kernels import ObservationWriter, get_section_views
+from darei.utils import observation as obsu
+
+# Sections holding angles in [0, 2pi), compared modulo 2pi
+ANGLE_SECTIONS = ["angle_to_target"]
+
+# Reward parameters of cfg/task/Unimal.yaml
+REWARD_PARAMS = {
+    "up_weight": 0.1,
+    "heading_weight": 0.5,
+    "actions_cost_scale": 0.005,
+    "energy_cost_scale": 0.05,
+    "joints_at_limit_cost_scale": 0.1,
+    "termination_height": 0.31,
+    "death_cost": -2.0,
+    "max_episode_length": 1000,
+}
+
+
+def parse_args():
+    """Parses the arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Unimal observation and reward kernels on CPU"
+    )
+    parser.add_argument(
+        "--num_envs", help="Numbers of envs", nargs="+", type=int,
+        default=[4096, 8192, 16384],
+    )
+    parser.add_argument("--num_dofs", help="Dofs per env", default=12, type=int)
+    parser.add_argument("--num_sensors", help="Force sensors per env", default=13, type=int)
+    parser.add_argument("--steps", help="Timed steps per kernel", default=100, type=int)
+    return parser.parse_args()
+
+
+def random_state(num_envs, num_dofs, num_sensors):
+    quat = torch.randn(num_envs, 4)
+    quat /= torch.norm(quat, dim=-1, keepdim=True)
+    root_states = torch.cat(
+        [torch.randn(num_envs, 3), quat, torch.randn(num_envs, 6)], dim=-1
+    )
+    lower = -torch.rand(num_dofs) - 0.1
+    upper = torch.rand(num_dofs) + 0.1
+    state = {
+        "root_states": root_states,
+        "targets": torch.tensor([1000.0, 0.0, 0.0]).repeat(num_envs, 1),
+        "potentials": torch.randn(num_envs),
+        "inv_start_rot": torch.tensor([0.0, 0.0, 0.0, 1.0]).repeat(num_envs, 1),
+        "dof_pos": torch.rand(num_envs, num_dofs) * (upper - lower) + lower,
+        "dof_vel": torch.randn(num_envs, num_dofs),
+        "dof_limits_lower": lower,
+        "dof_limits_upper": upper,
+        "basis_vec0": torch.tensor([1.0, 0.0, 0.0]).repeat(num_envs, 1),
+        "basis_vec1": torch.tensor([0.0, 0.0, 1.0]).repeat(num_envs, 1),
+        "sensors": torch.randn(num_envs, num_sensors * obsu.SENSOR_DIM),
+        "actions": torch.rand(num_envs, num_dofs) * 2 - 1,
+        "reset_buf": torch.zeros(num_envs, dtype=torch.long),
+        "progress_buf": torch.randint(0, REWARD_PARAMS["max_episode_length"] + 1, (num_envs,)),
+    }
+    return state
+
+
+def make_jit_step(state, obs_buf, dt):
+    potentials = state["potentials"].clone()
+
+    def step():
+        obs, pot, _, _, _ = compute_unimal_observations(
+            obs_buf, state["root_states"], state["targets"], potentials,
+            state["inv_start_rot"], state["dof_pos"], state["dof_vel"],
+            state["dof_limits_lower"], state["dof_limits_upper"], 0.2,
+            state["basis_vec0"], state["basis_vec1"], 2,
+            state["sensors"], state["actions"], dt, 0.1, state["sensors"].shape[1]
+        )
+        # Same copies as Unimal.compute_observations
+        obs_buf[:] = obs
+        potentials[:] = pot
+    step.potentials = potentials
+    return step
+
+
+def make_inplace_step(state, obs_buf, dt, observation_space_map):
+    writer = ObservationWriter(obs_buf, observation_space_map)
+    potentials = state["potentials"].clone()
+    prev_potentials = torch.zeros_like(potentials)
+    up_vec = torch.zeros_like(state["basis_vec1"])
+    heading_vec = torch.zeros_like(state["basis_vec0"])
+
+    def step():
+        writer.write(
+            state["root_states"], state["targets"], potentials, prev_potentials,
+            state["inv_start_rot"], state["dof_pos"], state["dof_vel"],
+            state["dof_limits_lower"], state["dof_limits_upper"], 0.2,
+            state["basis_vec0"], state["basis_vec1"], 2,
+            state["sensors"], state["actions"], dt, 0.1, state["sensors"].shape[1],
+            up_vec, heading_vec
+        )
+    return step
+
+
+def make_unfused_step(state, obs_buf, dt, observation_space_map):
+    """compute_unimal_observations, compute_unimal_reward and the time outs
+    of VecTask.step, returns rewards, resets and time outs.
+    """
+    obs_step = make_jit_step(state, obs_buf, dt)
+    cum = {}
+    start = 0
+    for section, size in observation_space_map.items():
+        cum[section] = (start, start + size)
+        start += size
+    params = REWARD_PARAMS
+
+    def step():
+        prev_potentials = obs_step.potentials.clone()
+        obs_step()
+        reward, reset = compute_unimal_reward(
+            obs_buf, state["reset_buf"], state["progress_buf"], state["actions"],
+            params["up_weight"], params["heading_weight"],
+            obs_step.potentials, prev_potentials,
+            params["actions_cost_scale"], params["energy_cost_scale"],
+            params["joints_at_limit_cost_scale"], params["termination_height"],
+            params["death_cost"], params["max_episode_length"],
+            cum["dof_meas_vel"], cum["dof_meas_pos"]
+        )
+        timeout = torch.where(
+            state["progress_buf"] >= params["max_episode_length"] - 1,
+            torch.ones_like(state["reset_buf"]), torch.zeros_like(state["reset_buf"])
+        )
+        return reward, reset, timeout
+    return step
+
+
+def make_fused_step(state, obs_buf, dt):
+    potentials = state["potentials"].clone()
+    params = REWARD_PARAMS
+
+    def step():
+        obs, pot, _, _, _, reward, reset, timeout = compute_unimal_observations_and_reward(
+            obs_buf, state["root_states"], state["targets"], potentials,
+            state["inv_start_rot"], state["dof_pos"], state["dof_vel"],
+            state["dof_limits_lower"], state["dof_limits_upper"], 0.2,
+            state["basis_vec0"], state["basis_vec1"], 2,
+            state["sensors"], state["actions"], dt, 0.1, state["sensors"].shape[1],
+            state["reset_buf"], state["progress_buf"],
+            params["up_weight"], params["heading_weight"],
+            params["actions_cost_scale"], params["energy_cost_scale"],
+            params["joints_at_limit_cost_scale"], params["termination_height"],
+            params["death_cost"], params["max_episode_length"]
+        )
+        obs_buf[:] = obs
+        potentials[:] = pot
+        return reward, reset, timeout
+    return step
+
+
+def time_step(step, steps):
+    for _ in range(3):
+        step()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    return (time.perf_counter() - start) / steps
+
+
+def allocated_bytes(step):
+    """Bytes allocated by the CPU allocator during one step."""
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        step()
+    return sum(
+        event.self_cpu_memory_usage for event in prof.key_averages()
+        if event.self_cpu_memory_usage > 0
+    )
+
+
+def max_difference(obs1, obs2, observation_space_map):
+    views1 = get_section_views(obs1, observation_space_map)
+    views2 = get_section_views(obs2, observation_space_map)
+    diff = 0.0
+    for section in observation_space_map:
+        d = (views1[section] - views2[section]).abs()
+        if section in ANGLE_SECTIONS:
+            d = torch.minimum(d, 2 * math.pi - d)
+        diff = max(diff, d.max().item())
+    return diff
+
+
+def main():
+    args = parse_args()
+    torch.manual_seed(0)
+    dt = 0.0166
+    observation_space_map = obsu.get_observation_space_map(
+        args.num_dofs, args.num_sensors
+    )
+    num_obs = sum(observation_space_map.values())
+
+    # Equivalence of the kernels is checked by tests/test_unimal_kernels.py
+    for num_envs in args.num_envs:
+        state = random_state(num_envs, args.num_dofs, args.num_sensors)
+        jit_step = make_jit_step(state, torch.zeros(num_envs, num_obs), dt)
+        inplace_step = make_inplace_step(
+            state, torch.zeros(num_envs, num_obs), dt, observation_space_map
+        )
+        print(
+            "num_envs {}: jit {:.3f}ms {:.1f}KB, inplace {:.3f}ms {:.1f}KB per step".format(
+                num_envs,
+                1000 * time_step(jit_step, args.steps), allocated_bytes(jit_step) / 1024,
+                1000 * time_step(inplace_step, args.steps), allocated_bytes(inplace_step) / 1024,
+            )
+        )
+
+        unfused_step = make_unfused_step(
+            state, torch.zeros(num_envs, num_obs), dt, observation_space_map
+        )
+        fused_step = make_fused_step(state, torch.zeros(num_envs, num_obs), dt)
+        print(
+            "num_envs {}: obs+reward {:.3f}ms, fused {:.3f}ms per step".format(
+                num_envs,
+                1000 * time_step(unfused_step, args.steps),
+                1000 * time_step(fused_step, args.steps),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 from datetime import datetime
-from multiprocessing import Pool
 from pathlib import Path
 import os
 import networkx as nx
@@ -8,6 +7,7 @@ import copy
 
 from darei.config import cfg
 from darei.envs.morphology import SymmetricUnimal
+from darei.utils import executor
 from darei.utils import similarity as simu
 from darei.utils import sample as su
 from darei.utils import file as fu
@@ -36,14 +36,13 @@ def create_init_unimals():
     # Create unimal xmls. Note that 10*init_pop_size unimals are created for
     # diversity. We remove the ones that are too similar.
     # Generate all unimals on a single node but parallelize using processes.
-    p = Pool(cfg.EVO.NUM_CPU_PROCESSES)
     timestamp = datetime.now().strftime("%d-%H-%M-%S")
     idx_unimal_id = [
         (idx, "{}-{}-{}".format(cfg.NODE_ID, idx, timestamp))
         for idx in range(10 * init_pop_size)
     ]
 
-    unimal_ids = p.starmap(globals()[cfg.EVO.INIT_METHOD], idx_unimal_id)
+    unimal_ids = executor.starmap(globals()[cfg.EVO.INIT_METHOD], idx_unimal_id)
 
     # Create graph of initial population.
     G = simu.create_graph_from_uids(
@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+
+from darei.utils import store as pstore
+
+
+def parse_args():
+    """Parses the arguments."""
+    parser = argparse.ArgumentParser(
+        description="Import metadata of a run directory into its population store"
+    )
+    parser.add_argument(
+        "--out_dir", help="Run directory (cfg.OUT_DIR)", required=True, type=str
+    )
+    parser.add_argument(
+        "--journal", help="sqlite journal mode", default="delete", type=str
+    )
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store = pstore.PopulationStore(
+        os.path.join(args.out_dir, pstore.DB_NAME), journal_mode=args.journal
+    )
+    num_imported = store.import_run(args.out_dir)
+    print(
+        "Imported {} unimals, population size: {}".format(
+            num_imported, store.size()
+        )
+    )
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
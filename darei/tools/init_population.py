@@ -8,6 +8,8 @@ import random
 import sys
 import argparse
 import copy
+import contextlib
+import time
 
 from darei import agent
 from darei.config import cfg
@@ -17,6 +19,8 @@ from darei.utils import sample as su
 from darei.utils import file as fu
 from darei.utils import evo as eu
 from darei.utils import exception as exu
+from darei.utils import lease
+from darei.utils import store as pstore
 
 import hydra
 from omegaconf import DictConfig, OmegaConf
@@ -36,62 +40,173 @@ OmegaConf.register_new_resolver('if', lambda pred, a, b: a if pred else b)
 # num_ensv
 OmegaConf.register_new_resolver('resolve_default', lambda default, arg: default if arg=='' else arg)
 
-def init_done(unimal_id):
-    # unimal_idx = int(unimal_id.split(".")[0].split("-")[1])
+def get_done_ids():
+    """Return ids of unimals which were trained or failed training."""
+    store = pstore.get_store()
+    if store is not None:
+        return store.get_finished_ids()
+
     success_metadata = fu.get_files(fu.get_subfolder("metadata", config=copy.deepcopy(cfg)), ".*json")
     error_metadata = fu.get_files(fu.get_subfolder("error_metadata", config=copy.deepcopy(cfg)), ".*json")
     done_metadata = success_metadata + error_metadata
-    done_ids = [
+    return {
         path.split("/")[-1].split(".")[0]
         for path in done_metadata
-    ]
-    if unimal_id in done_ids:
+    }
+
+def init_done(unimal_id):
+    # unimal_idx = int(unimal_id.split(".")[0].split("-")[1])
+    store = pstore.get_store()
+    if store is not None:
+        return store.is_finished(unimal_id)
+
+    if unimal_id in get_done_ids():
         return True
     else:
         return False
 
-def init_population(proc_id):
-    # Divide work by num nodes and then num procs
-    xml_paths = fu.get_files(
-        fu.get_subfolder("xml", config=copy.deepcopy(cfg)), ".*xml", sort=True, sort_type="time"
-    )[: cfg.EVO.INIT_POPULATION_SIZE]
-    xml_paths.sort()
-    num_workers = (cfg.EVO.NUM_GPUS * cfg.EVO.NUM_WORKERS_PER_GPU)
-    xml_paths = fu.chunkify(xml_paths, cfg.NUM_NODES)[cfg.NODE_ID]
-    xml_paths = fu.chunkify(xml_paths, num_workers)[proc_id]
-
+def train_unimals(unimal_ids, proc_id, lease_lost=None):
+    """Train unimals, more than one are trained together in a single sim.
+    lease_lost is {unimal id: event} of the leases held on them, if any.
+    """
     num_parallel_envs = cfg.NUM_ISAAC_ENVS
     env_spacing = cfg.ISAAC_ENV_SPACING
     horizon_length = cfg.ISAAC_HORIZON_LENGTH
 
-    initialize(config_path="../cfg")
+    model_output_dir = os.path.join(cfg.OUT_DIR, "models")
+    if len(unimal_ids) == 1:
+        unimal_id = unimal_ids[0]
+        asset_filename = fu.id2path(unimal_id, "xml", config=copy.deepcopy(cfg))
+        overrides = [
+            "task=Unimal", f"experiment={unimal_id}",
+            f"assetFileName={asset_filename}",
+        ]
+    else:
+        unimal_id = unimal_ids
+        asset_filenames = ",".join(
+            "'{}'".format(fu.id2path(uid, "xml", config=copy.deepcopy(cfg)))
+            for uid in unimal_ids
+        )
+        overrides = [
+            "task=UnimalMulti", f"experiment=multi-{unimal_ids[0]}",
+            f"assetFileNames=[{asset_filenames}]",
+        ]
+
+    overrides = overrides + [
+        "headless=True", f"num_envs={num_parallel_envs}", 
+        "pipeline=gpu", f"output_dir={model_output_dir}", 
+        f"env_spacing={env_spacing}", f"horizon_length={horizon_length}",
+        f"profile_step={cfg.ISAAC_PROFILE_STEP}",
+        f"obs_kernel={cfg.ISAAC_OBS_KERNEL}",
+        f"force_sensors={cfg.ISAAC_FORCE_SENSORS}",
+        f"buffer_precision={cfg.ISAAC_BUFFER_PRECISION}"
+    ]
+
+    try:
+        # Successive halving applies to unimals trained on their own.
+        if cfg.EVO.FIDELITY_RUNGS > 1 and len(unimal_ids) == 1:
+            agent.train_agent_with_fidelity(
+                overrides, yacs_cfg=copy.deepcopy(cfg), lease_lost=lease_lost
+            )
+        else:
+            hydra_config = compose(config_name="config", overrides=overrides)
+            agent.train_agent(
+                hydra_config, yacs_cfg=copy.deepcopy(cfg), lease_lost=lease_lost
+            )
+    except Exception as e:
+        exu.handle_exception(
+            e, "ERROR in init_population::train_agent: {}, process id: {}".format(unimal_id, proc_id), unimal_id=unimal_id
+        )
+
+def init_population_static(xml_paths, proc_id):
+    # Divide work by num nodes and then num procs
+    num_workers = (cfg.EVO.NUM_GPUS * cfg.EVO.NUM_WORKERS_PER_GPU)
+    xml_paths = fu.chunkify(xml_paths, cfg.NUM_NODES)[cfg.NODE_ID]
+    xml_paths = fu.chunkify(xml_paths, num_workers)[proc_id]
 
-    for xml_path in xml_paths:
+    batch = []
+    for idx, xml_path in enumerate(xml_paths):
         unimal_id = fu.path2id(xml_path)
 
         if init_done(unimal_id):
             print("{} already done, proc_id: {}".format(unimal_id, proc_id))
+        else:
+            batch.append(unimal_id)
+
+        if len(batch) < cfg.EVO.MORPHOLOGIES_PER_SIM and idx < len(xml_paths) - 1:
+            continue
+        if len(batch) == 0:
             continue
-        
-        asset_filename = fu.id2path(unimal_id, "xml", config=copy.deepcopy(cfg))
-        model_output_dir = os.path.join(cfg.OUT_DIR, "models")
-        hydra_config = compose(config_name="config", overrides=[
-            "task=Unimal", "headless=True", f"num_envs={num_parallel_envs}", 
-            "pipeline=gpu", f"experiment={unimal_id}", 
-            f"assetFileName={asset_filename}", f"output_dir={model_output_dir}", 
-            f"env_spacing={env_spacing}", f"horizon_length={horizon_length}"
-        ])
-
-        try:
-            agent.train_agent(hydra_config, yacs_cfg=copy.deepcopy(cfg))
-        except Exception as e:
-            exu.handle_exception(
-                e, "ERROR in init_population::train_agent: {}, process id: {}".format(unimal_id, proc_id), unimal_id=unimal_id
-            )
+
+        train_unimals(batch, proc_id)
+        batch = []
 
         if eu.get_population_size() >= cfg.EVO.INIT_POPULATION_SIZE:
             break
 
+def init_population_lease(xml_paths, proc_id):
+    # Workers of all nodes claim unimals from a shared queue, a slow or
+    # crashed worker only holds back the unimals it has leased.
+    unimal_ids = [fu.path2id(xml_path) for xml_path in xml_paths]
+    num_workers = (cfg.EVO.NUM_GPUS * cfg.EVO.NUM_WORKERS_PER_GPU)
+    worker_idx = cfg.NODE_ID * num_workers + proc_id
+    queue = lease.LeaseQueue(
+        fu.get_subfolder("leases", config=copy.deepcopy(cfg)),
+        owner="{}-{}".format(cfg.NODE_ID, proc_id),
+        duration=cfg.EVO.LEASE_DURATION,
+    )
+
+    while eu.get_population_size() < cfg.EVO.INIT_POPULATION_SIZE:
+        done_ids = get_done_ids()
+        pending_ids = [uid for uid in unimal_ids if uid not in done_ids]
+        if len(pending_ids) == 0:
+            break
+
+        # Start at a different position per worker to avoid contention.
+        start = worker_idx * len(pending_ids) // (num_workers * cfg.NUM_NODES)
+        batch = []
+        while len(batch) < cfg.EVO.MORPHOLOGIES_PER_SIM:
+            unimal_id = queue.claim(
+                [uid for uid in pending_ids if uid not in batch], start=start
+            )
+            if unimal_id is None:
+                break
+            # The unimal could have finished right before we claimed it.
+            if init_done(unimal_id):
+                queue.release(unimal_id)
+                pending_ids.remove(unimal_id)
+                continue
+            batch.append(unimal_id)
+
+        if len(batch) == 0:
+            # Remaining unimals are leased by live workers. Wait in case one
+            # of them dies and its lease expires.
+            time.sleep(cfg.EVO.LEASE_DURATION / lease.RENEWALS_PER_DURATION)
+            continue
+
+        print("Proc ID: {} leased {}".format(proc_id, batch))
+        with contextlib.ExitStack() as stack:
+            lease_lost = {
+                unimal_id: stack.enter_context(queue.hold(unimal_id))
+                for unimal_id in batch
+            }
+            train_unimals(batch, proc_id, lease_lost=lease_lost)
+
+def init_population(proc_id):
+    xml_paths = fu.get_files(
+        fu.get_subfolder("xml", config=copy.deepcopy(cfg)), ".*xml", sort=True, sort_type="time"
+    )[: cfg.EVO.INIT_POPULATION_SIZE]
+    xml_paths.sort()
+
+    initialize(config_path="../cfg")
+
+    if cfg.EVO.INIT_SCHEDULER == "static":
+        init_population_static(xml_paths, proc_id)
+    elif cfg.EVO.INIT_SCHEDULER == "lease":
+        init_population_lease(xml_paths, proc_id)
+    else:
+        raise ValueError("Unsupported EVO.INIT_SCHEDULER: {}".format(cfg.EVO.INIT_SCHEDULER))
+
 def parse_args():
     """Parses the arguments."""
     parser = argparse.ArgumentParser()
@@ -103,20 +103,26 @@ class RLGPUAlgoObserver(AlgoObserver):
     """Allows us to log stats from the env along with the algorithm running stats. """
 
     def __init__(self):
-        pass
+        # Training results of the run, kept in memory and written to the
+        # metadata of the unimal once the run ends (see get_metrics).
+        self.metrics = {}
 
     def after_init(self, algo):
         self.algo = algo
         self.mean_scores = torch_ext.AverageMeter(1, self.algo.games_to_track).to(self.algo.ppo_device)
-        self.ep_infos = []
+        # Running sum and count of each episode info since the last print,
+        # kept on the rl device so updating them does not sync with the host.
+        self.ep_info_sums = {}
+        self.ep_info_counts = {}
         self.direct_info = {}
         self.writer = self.algo.writer
+        self.metrics = {}
 
     def process_infos(self, infos, done_indices):
         assert isinstance(infos, dict), "RLGPUAlgoObserver expects dict info"
         if isinstance(infos, dict):
             if 'episode' in infos:
-                self.ep_infos.append(infos['episode'])
+                self.accumulate_ep_info(infos['episode'])
 
             if len(infos) > 0 and isinstance(infos, dict):  # allow direct logging from env
                 self.direct_info = {}
@@ -125,29 +131,62 @@ class RLGPUAlgoObserver(AlgoObserver):
                     if isinstance(v, float) or isinstance(v, int) or (isinstance(v, torch.Tensor) and len(v.shape) == 0):
                         self.direct_info[k] = v
 
+    def accumulate_ep_info(self, ep_info):
+        for key, value in ep_info.items():
+            if key not in self.ep_info_sums:
+                self.ep_info_sums[key] = torch.zeros((), device=self.algo.device)
+                self.ep_info_counts[key] = torch.zeros((), device=self.algo.device)
+            # handle scalar and zero dimensional tensor infos
+            if isinstance(value, torch.Tensor):
+                value = value.to(self.algo.device, non_blocking=True)
+                self.ep_info_sums[key] += value.sum()
+                self.ep_info_counts[key] += value.numel()
+            else:
+                self.ep_info_sums[key] += float(value)
+                self.ep_info_counts[key] += 1
+
     def after_clear_stats(self):
         self.mean_scores.clear()
 
     def after_print_stats(self, frame, epoch_num, total_time):
-        if self.ep_infos:
-            for key in self.ep_infos[0]:
-                    infotensor = torch.tensor([], device=self.algo.device)
-                    for ep_info in self.ep_infos:
-                        # handle scalar and zero dimensional tensor infos
-                        if not isinstance(ep_info[key], torch.Tensor):
-                            ep_info[key] = torch.Tensor([ep_info[key]])
-                        if len(ep_info[key].shape) == 0:
-                            ep_info[key] = ep_info[key].unsqueeze(0)
-                        infotensor = torch.cat((infotensor, ep_info[key].to(self.algo.device)))
-                    value = torch.mean(infotensor)
-                    self.writer.add_scalar('Episode/' + key, value, epoch_num)
-            self.ep_infos.clear()
+        if self.ep_info_sums:
+            keys = list(self.ep_info_sums)
+            # Single transfer to the host for all the keys
+            sums = torch.stack([self.ep_info_sums[key] for key in keys]).cpu()
+            counts = torch.stack([self.ep_info_counts[key] for key in keys]).cpu()
+            for key, total, count in zip(keys, sums.tolist(), counts.tolist()):
+                if count == 0:
+                    continue
+                value = total / count
+                self.writer.add_scalar('Episode/' + key, value, epoch_num)
+                self.metrics[key] = value
+            for key in keys:
+                self.ep_info_sums[key].zero_()
+                self.ep_info_counts[key].zero_()
+
+        # Same mean reward rl_games puts in the names of its checkpoints.
+        if self.algo.game_rewards.current_size > 0:
+            reward = float(self.algo.game_rewards.get_mean()[0])
+            self.metrics["reward"] = reward
+            self.metrics["best_reward"] = max(
+                reward, self.metrics.get("best_reward", reward)
+            )
+            self.metrics["episode_length"] = float(self.algo.game_lengths.get_mean())
+        self.metrics["frames"] = int(frame)
+        self.metrics["epochs"] = int(epoch_num)
+        self.metrics["wall_time"] = float(total_time)
         
         for k, v in self.direct_info.items():
             self.writer.add_scalar(f'{k}/frame', v, frame)
             self.writer.add_scalar(f'{k}/iter', v, epoch_num)
             self.writer.add_scalar(f'{k}/time', v, total_time)
 
+        profiler = self.get_profiler()
+        if profiler is not None:
+            for k, v in profiler.interval_summary().items():
+                self.writer.add_scalar(f'profile/{k}', v, epoch_num)
+            self.metrics["profile"] = profiler.summary()
+
         if self.mean_scores.current_size > 0:
             mean_scores = self.mean_scores.get_mean()
             self.writer.add_scalar('scores/mean', mean_scores, frame)
@@ -155,6 +194,20 @@ class RLGPUAlgoObserver(AlgoObserver):
             self.writer.add_scalar('scores/time', mean_scores, total_time)
 
 
+    def get_profiler(self):
+        """Step profiler of the task, None if it is not profiled."""
+        vec_env = getattr(self.algo, "vec_env", None)
+        return getattr(getattr(vec_env, "env", None), "profiler", None)
+
+    def get_metrics(self):
+        """Return the results of the run: last and best mean reward, mean
+        episode length, frames, epochs, wall time and the mean of each
+        episode info (e.g __reward__forward) at the last epoch, and the
+        step profile of the task if enabled.
+        """
+        return dict(self.metrics)
+
+
 class RLGPUEnv(vecenv.IVecEnv):
     def __init__(self, config_name, num_actors, **kwargs):
         self.env = env_configurations.configurations[config_name]['env_creator'](**kwargs)
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+
+from darei.config import cfg
+from darei.utils import file as fu
+from darei.utils import similarity as simu
+from darei.utils import species
+
+
+def parse_args():
+    """Parses the arguments."""
+    parser = argparse.ArgumentParser(
+        description="Build the species index of a run directory and summarize it"
+    )
+    parser.add_argument(
+        "--out_dir", help="Run directory (cfg.OUT_DIR)", required=True, type=str
+    )
+    parser.add_argument(
+        "--metric", help="Similarity metric", default="geom_orientation", type=str,
+        choices=species.METRICS,
+    )
+    parser.add_argument(
+        "--top_k", help="Number of largest species to print", default=10, type=int
+    )
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cfg.OUT_DIR = args.out_dir
+    cfg.EVO.SPECIES_METRIC = args.metric
+    os.makedirs(fu.get_subfolder("species"), exist_ok=True)
+
+    # Add unimals saved before the index existed, e.g finished runs.
+    index = species.load_index()
+    metadata_paths = fu.get_files(fu.get_subfolder("metadata"), ".*json")
+    missing_ids = [
+        fu.path2id(path) for path in metadata_paths
+        if fu.path2id(path) not in index
+    ]
+    if len(missing_ids) > 0:
+        xml_paths = [fu.id2path(uid, "xml") for uid in missing_ids]
+        species.add_descriptors(simu.get_metric_in_parallel(xml_paths, args.metric))
+        index.refresh()
+        print("Added {} unimals to the index".format(len(missing_ids)))
+
+    print(
+        "Unimals: {}, species: {}".format(len(index), index.num_species())
+    )
+    all_species = sorted(
+        index.get_species().items(), key=lambda item: len(item[1]), reverse=True
+    )
+    for species_id, unimal_ids in all_species[: args.top_k]:
+        print("{}: {}".format(species_id, len(unimal_ids)))
+
+
+if __name__ == "__main__":
+    main()
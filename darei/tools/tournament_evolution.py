@@ -16,6 +16,8 @@ from darei.utils import sample as su
 from darei.utils import file as fu
 from darei.utils import evo as eu
 from darei.utils import exception as exu
+from darei.utils import checkpoint as ckptu
+from darei.utils import dedup
 
 import hydra
 from omegaconf import DictConfig, OmegaConf
@@ -40,14 +42,15 @@ def compute_cur_generation(cur_pop_size):
 
     return cur_gen
 
-def tournament_evolution(proc_id):
+# Exit code used by a worker which stopped only because it reached
+# EVO.MAX_JOBS_PER_WORKER. Being non-zero, DAREI.wait_or_kill relaunches it.
+RECYCLE_EXIT_CODE = 3
+
+def train_child(proc_id, job_idx):
     num_parallel_envs = cfg.NUM_ISAAC_ENVS
     env_spacing = cfg.ISAAC_ENV_SPACING
     horizon_length = cfg.ISAAC_HORIZON_LENGTH
 
-    # Initialize Hydra config
-    initialize(config_path="../cfg")
-
     cur_pop_size = eu.get_population_size()
     cur_gen = compute_cur_generation(cur_pop_size)
 
@@ -55,12 +58,15 @@ def tournament_evolution(proc_id):
     max_searched_space_size = min_searched_space_size + cfg.EVO.NUM_TOURNAMENTS_PER_GEN + cfg.EVO.INIT_POPULATION_SIZE
     print(f"Cur pop size: {cur_pop_size}, max pop size for gen {cur_gen}: {max_searched_space_size}")
 
-    seed = cfg.RNG_SEED + (cfg.EVO.NUM_TOURNAMENTS_PER_GEN * cfg.EVO.NUM_GENERATIONS*(cfg.NODE_ID + cur_gen) + proc_id) * 100
+    # job_idx keeps the children of a persistent worker from sharing a seed
+    # when they belong to the same generation.
+    seed = cfg.RNG_SEED + (cfg.EVO.NUM_TOURNAMENTS_PER_GEN * cfg.EVO.NUM_GENERATIONS*(cfg.NODE_ID + cur_gen) + proc_id) * 100 + job_idx
     su.set_seed(seed, use_strong_seeding=True)
-    seed += 1
     parent_metadata = eu.select_parent(min_searched_space_size)
-    child_id = "{}-{}-{}".format(
-        cfg.NODE_ID, proc_id, datetime.now().strftime("%d-%H-%M-%S")
+    # Children which duplicate a trained unimal finish within a second, the
+    # job index keeps their ids apart.
+    child_id = "{}-{}-{}-{}".format(
+        cfg.NODE_ID, proc_id, job_idx, datetime.now().strftime("%d-%H-%M-%S")
     )
     parent_id = parent_metadata["id"]
     unimal = SymmetricUnimal(
@@ -69,25 +75,74 @@ def tournament_evolution(proc_id):
     unimal.mutate()
     unimal.save()
 
+    if cfg.EVO.DUPLICATE_POLICY:
+        original = dedup.lookup(child_id, cfg.EVO.DUPLICATE_POLICY)
+        if original is not None:
+            # Same morphology was already trained, reuse its result.
+            dedup.link_model(child_id, original["id"])
+            agent.save_metadata(
+                None, child_id, None, train_time=0, parent_id=parent_id,
+                yacs_cfg=copy.deepcopy(cfg), metrics=dedup.get_metrics(original),
+                fidelity=original.get("fidelity"), duplicate_of=original["id"]
+            )
+            print(f"Generation {cur_gen}, {child_id} duplicates {original['id']}")
+            return
+
     asset_filename = fu.id2path(child_id, "xml", config=copy.deepcopy(cfg))
     model_output_dir = os.path.join(cfg.OUT_DIR, "models")
-    hydra_config = compose(config_name="config", overrides=[
+    overrides = [
         "task=Unimal", "headless=True", f"num_envs={num_parallel_envs}", 
         "pipeline=gpu", f"experiment={child_id}", 
         f"assetFileName={asset_filename}", f"output_dir={model_output_dir}", 
         f"env_spacing={env_spacing}", f"parent_name={parent_id}",
-        f"horizon_length={horizon_length}"
-    ])
+        f"horizon_length={horizon_length}",
+        f"profile_step={cfg.ISAAC_PROFILE_STEP}",
+        f"obs_kernel={cfg.ISAAC_OBS_KERNEL}",
+        f"force_sensors={cfg.ISAAC_FORCE_SENSORS}",
+        f"buffer_precision={cfg.ISAAC_BUFFER_PRECISION}"
+    ]
 
     try:
-        agent.train_agent(hydra_config, yacs_cfg=copy.deepcopy(cfg))
+        checkpoint = ""
+        if cfg.EVO.CHILD_CONTROLLER_STATE_INITIAL == "controller_inherit_parent":
+            checkpoint = ckptu.inherit_parent_checkpoint(
+                parent_id, child_id, config=copy.deepcopy(cfg)
+            ) or ""
+
+        if cfg.EVO.FIDELITY_RUNGS > 1:
+            agent.train_agent_with_fidelity(
+                overrides, yacs_cfg=copy.deepcopy(cfg), checkpoint=checkpoint
+            )
+        else:
+            # Checkpoint names can contain brackets, quote them for hydra.
+            hydra_config = compose(config_name="config", overrides=overrides + [
+                f"checkpoint='{checkpoint}'"
+            ])
+            agent.train_agent(hydra_config, yacs_cfg=copy.deepcopy(cfg))
         print(f"Generation {cur_gen}, trained {child_id}")
     except Exception as e:
         exu.handle_exception(
             e, "ERROR in tournament_evolution::train_agent: {}, process id: {}".format(child_id, proc_id), unimal_id=child_id
         )
 
-    sys.exit(1)
+def tournament_evolution(proc_id):
+    """Train children until evolution is over or the worker has to recycle.
+
+    Returns True if the search space has been exhausted, False if the worker
+    stopped after EVO.MAX_JOBS_PER_WORKER children.
+    """
+    # Initialize Hydra config once, it is shared by all jobs of this worker.
+    initialize(config_path="../cfg")
+
+    max_jobs = cfg.EVO.MAX_JOBS_PER_WORKER
+    job_idx = 0
+    while max_jobs < 0 or job_idx < max_jobs:
+        if eu.get_population_size() >= eu.get_max_searched_space_size():
+            return True
+        train_child(proc_id, job_idx)
+        job_idx += 1
+
+    return False
 
 def parse_args():
     """Parses the arguments."""
@@ -119,8 +174,12 @@ def main():
     if cfg.OUT_DIR == "/tmp":
         exu.handle_exception("", "ERROR TMP")
 
-    tournament_evolution(args.proc_id)
-    print("Node ID: {}, Proc ID: {} finished.".format(cfg.NODE_ID, args.proc_id))
+    if tournament_evolution(args.proc_id):
+        print("Node ID: {}, Proc ID: {} finished.".format(cfg.NODE_ID, args.proc_id))
+        sys.exit(0)
+
+    print("Node ID: {}, Proc ID: {} recycling.".format(cfg.NODE_ID, args.proc_id))
+    sys.exit(RECYCLE_EXIT_CODE)
 
 
 if __name__ == "__main__":
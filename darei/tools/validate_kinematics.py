@@ -0,0 +1,88 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from darei.utils import file as fu
+from darei.utils import similarity as simu
+
+
+def parse_args():
+    """Parses the arguments."""
+    parser = argparse.ArgumentParser(
+        description="Compare descriptors of utils/kinematics.py against MjSim"
+    )
+    parser.add_argument(
+        "--xml_dir", help="Dir of unimal xmls (e.g OUT_DIR/xml)", required=True, type=str
+    )
+    parser.add_argument(
+        "--num", help="Max number of unimals to compare", default=100, type=int
+    )
+    parser.add_argument(
+        "--atol", help="Max abs difference of geom orientations", default=1e-6, type=float
+    )
+    # Positions are rounded to 2 decimals, the backends can round a position
+    # near a boundary to neighbouring values.
+    parser.add_argument(
+        "--cloud_atol", help="Max abs difference of point cloud positions",
+        default=0.01 + 1e-6, type=float
+    )
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+
+def sort_points(points):
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    return points[np.lexsort(points.T[::-1])]
+
+
+def compare(fn, paths, backend):
+    start = time.time()
+    data = [fn(path, backend=backend)[1] for path in paths]
+    return data, (time.time() - start) / max(1, len(paths))
+
+
+def main():
+    args = parse_args()
+    paths = fu.get_files(args.xml_dir, ".*xml", sort=True)[: args.num]
+
+    mismatches = 0
+    clouds_mj, time_mj = compare(simu.point_cloud_from_xml, paths, "mujoco")
+    clouds_kin, time_kin = compare(simu.point_cloud_from_xml, paths, "kinematics")
+    print(
+        "point_cloud per unimal: mujoco {:.2e}s, kinematics {:.2e}s".format(
+            time_mj, time_kin
+        )
+    )
+    for path, m1, m2 in zip(paths, clouds_mj, clouds_kin):
+        # Site order can differ between the backends.
+        m1, m2 = sort_points(m1), sort_points(m2)
+        if m1.shape != m2.shape or not np.allclose(m1, m2, rtol=0, atol=args.cloud_atol):
+            mismatches += 1
+            print("point_cloud mismatch: {}".format(path))
+
+    orients_mj, time_mj = compare(simu.geom_orientations_from_xml, paths, "mujoco")
+    orients_kin, time_kin = compare(
+        simu.geom_orientations_from_xml, paths, "kinematics"
+    )
+    print(
+        "geom_orientation per unimal: mujoco {:.2e}s, kinematics {:.2e}s".format(
+            time_mj, time_kin
+        )
+    )
+    for path, m1, m2 in zip(paths, orients_mj, orients_kin):
+        m1, m2 = np.asarray(m1), np.asarray(m2)
+        if m1.shape != m2.shape or not np.allclose(m1, m2, atol=args.atol):
+            mismatches += 1
+            print("geom_orientation mismatch: {}".format(path))
+
+    print("Compared {} unimals, {} mismatches".format(len(paths), mismatches))
+    if mismatches > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""World frame capsules of a unimal for validating growth without MuJoCo.
+
+While a unimal grows all joints are at their zero position and bodies have
+no rotation, so the world position of a body is the sum of the pos of its
+ancestors. Geoms are spheres (torso) or capsules (limbs) which MuJoCo
+reports as in contact iff the distance of their segments is less than the
+sum of their radii.
+"""
+
+import numpy as np
+
+from darei.utils import geom as gu
+from darei.utils import xml as xu
+
+# MuJoCo default geom density
+DEFAULT_DENSITY = 1000.0
+
+# Tolerance on the center of mass component normal to the symmetry plane.
+# Mirrored positions are exact negations of each other in the xml, only the
+# order of summation differs from MuJoCo.
+SYMMETRY_TOL = 1e-9
+
+
+def _body_pos(body):
+    pos = body.get("pos")
+    if pos is None:
+        return np.zeros(3)
+    return xu.str2arr(pos)
+
+
+class UnimalCapsules:
+    """Capsule segments, radii and masses of the geoms of a unimal."""
+
+    def __init__(self, unimal):
+        self.names = []
+        self.p0 = np.zeros((0, 3))
+        self.p1 = np.zeros((0, 3))
+        self.radius = np.zeros(0)
+        self.mass = np.zeros(0)
+        # World position of the bodies of the unimal by name
+        self.body_xpos = {}
+
+        self.add(self.get_geoms(unimal.iter("body"), body_xpos=self.body_xpos))
+
+    def get_geoms(self, bodies, body_xpos=None):
+        """Return the geoms of bodies. The parent of each body is either an
+        existing body or earlier in bodies.
+        """
+        if body_xpos is None:
+            body_xpos = {}
+        names, p0, p1, radius, mass = [], [], [], [], []
+        for body in bodies:
+            parent = body.getparent()
+            if parent is None or parent.tag != "body":
+                xpos = _body_pos(body)
+            else:
+                parent_name = parent.get("name")
+                parent_xpos = body_xpos.get(parent_name)
+                if parent_xpos is None:
+                    parent_xpos = self.body_xpos[parent_name]
+                xpos = parent_xpos + _body_pos(body)
+            body_xpos[body.get("name")] = xpos
+
+            for geom in xu.find_elem(body, "geom", child_only=True):
+                size = float(geom.get("size").split(" ")[0])
+                if geom.get("type") == "sphere":
+                    start = end = xpos + xu.str2arr(geom.get("pos", "0 0 0"))
+                else:
+                    fromto = xu.str2arr(geom.get("fromto"))
+                    start, end = xpos + fromto[:3], xpos + fromto[3:]
+                density = float(geom.get("density", DEFAULT_DENSITY))
+                volume = gu.capsule_volume(size, np.linalg.norm(end - start))
+                names.append(geom.get("name"))
+                p0.append(start)
+                p1.append(end)
+                radius.append(size)
+                mass.append(density * volume)
+
+        return (
+            names,
+            np.array(p0).reshape(-1, 3),
+            np.array(p1).reshape(-1, 3),
+            np.array(radius),
+            np.array(mass),
+        )
+
+    def add(self, geoms):
+        names, p0, p1, radius, mass = geoms
+        self.names = self.names + names
+        self.p0 = np.concatenate([self.p0, p0])
+        self.p1 = np.concatenate([self.p1, p1])
+        self.radius = np.concatenate([self.radius, radius])
+        self.mass = np.concatenate([self.mass, mass])
+
+    def get_contacts(self, geoms):
+        """Return name pairs of geoms in contact with each other or with the
+        existing geoms. Contacts among the existing geoms are not checked.
+        """
+        names, p0, p1, radius, _ = geoms
+        all_names = self.names + names
+        all_p0 = np.concatenate([self.p0, p0])
+        all_p1 = np.concatenate([self.p1, p1])
+        all_radius = np.concatenate([self.radius, radius])
+
+        contacts = []
+        for idx, name in enumerate(names):
+            # Existing geoms and new geoms before this one
+            num_other = len(self.names) + idx
+            dist = gu.segment_distance(
+                p0[idx], p1[idx], all_p0[:num_other], all_p1[:num_other]
+            )
+            in_contact = dist < radius[idx] + all_radius[:num_other]
+            contacts.extend(
+                (all_names[other], name) for other in np.flatnonzero(in_contact)
+            )
+        return contacts
+
+    def get_com(self, geoms=None):
+        """Center of mass of the unimal, including geoms if given."""
+        mass = self.mass
+        center = (self.p0 + self.p1) / 2
+        if geoms is not None:
+            _, p0, p1, _, new_mass = geoms
+            mass = np.concatenate([mass, new_mass])
+            center = np.concatenate([center, (p0 + p1) / 2])
+        return mass @ center / np.sum(mass)
+
+    def is_symmetric(self, symmetry_plane, geoms=None):
+        """Check if the center of mass lies in symmetry_plane."""
+        normal_axis = list(symmetry_plane).index(0)
+        return abs(self.get_com(geoms)[normal_axis]) < SYMMETRY_TOL
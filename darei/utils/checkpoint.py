@@ -0,0 +1,146 @@
+"""Initialize the controller of a child from the checkpoint of its parent.
+
+Observation and action dims are matched by name (see utils/observation.py),
+so dims of limbs which survived the mutation keep their weights. Weights of
+new dims start at zero, i.e the child initially ignores new inputs and
+outputs a zero mean action for new joints.
+"""
+
+import os
+
+import torch
+
+from darei.config import cfg
+from darei.utils import file as fu
+from darei.utils import observation as obsu
+
+# Checkpoint saved by rl_games at the end of training, reward in brackets.
+_LAST_CHECKPOINT_REGEX = r'.*\[(.*)\].pth'
+
+
+def get_latest_checkpoint(model_dir):
+    """Return the last checkpoint saved in model_dir, None if there is none."""
+    if not os.path.isdir(model_dir):
+        return None
+    checkpoints = fu.get_files(
+        model_dir, _LAST_CHECKPOINT_REGEX, sort=True, sort_type="time"
+    )
+    if len(checkpoints) == 0:
+        return None
+    return checkpoints[-1]
+
+
+def _remap(tensor, index, dim, fill_value):
+    """Gather tensor along dim with index, -1 entries are set to fill_value."""
+    index = torch.as_tensor(index, dtype=torch.long)
+    shape = list(tensor.shape)
+    shape[dim] = len(index)
+    remapped = torch.full(shape, fill_value, dtype=tensor.dtype)
+    keep = index >= 0
+    remapped.index_copy_(
+        dim, keep.nonzero().flatten(), tensor.index_select(dim, index[keep])
+    )
+    return remapped
+
+
+def _remap_running_mean_std(state, obs_index, num_parent_obs):
+    for key in list(state.keys()):
+        if state[key].dim() != 1 or state[key].shape[0] != num_parent_obs:
+            continue
+        if key.endswith("running_mean"):
+            state[key] = _remap(state[key], obs_index, 0, 0.0)
+        elif key.endswith("running_var"):
+            state[key] = _remap(state[key], obs_index, 0, 1.0)
+
+
+def remap_checkpoint(checkpoint, obs_index, act_index, num_parent_obs, num_parent_act):
+    """Remap the input and output layers of an rl_games a2c checkpoint.
+
+    obs_index / act_index hold for each child dim the parent dim it is
+    copied from, -1 for new dims. Raises ValueError if the checkpoint does
+    not have num_parent_obs inputs and num_parent_act outputs, e.g because
+    the parent was trained by UnimalMulti.
+    """
+    model = checkpoint["model"]
+    checkpoint_obs = None
+    checkpoint_act = None
+    for key, tensor in model.items():
+        # First layer of the actor and critic mlps
+        if key.endswith("mlp.0.weight"):
+            checkpoint_obs = tensor.shape[1]
+        elif key.endswith("mu.bias"):
+            checkpoint_act = tensor.shape[0]
+
+    if checkpoint_obs is None or checkpoint_act is None:
+        raise ValueError("Unsupported network, no mlp input or mu output")
+    if checkpoint_obs != num_parent_obs or checkpoint_act != num_parent_act:
+        raise ValueError("Parent checkpoint does not match parent layout")
+
+    for key in list(model.keys()):
+        tensor = model[key]
+        if key.endswith("mlp.0.weight"):
+            model[key] = _remap(tensor, obs_index, 1, 0.0)
+        elif key.endswith(("mu.weight", "mu.bias", "sigma")):
+            model[key] = _remap(tensor, act_index, 0, 0.0)
+
+    # Depending on the rl_games version running mean std is part of the model
+    # or saved separately.
+    _remap_running_mean_std(model, obs_index, num_parent_obs)
+    if isinstance(checkpoint.get("running_mean_std"), dict):
+        _remap_running_mean_std(
+            checkpoint["running_mean_std"], obs_index, num_parent_obs
+        )
+
+    return checkpoint
+
+
+def inherit_parent_checkpoint(parent_id, child_id, config=None):
+    """Write the initial checkpoint of child based on the one of parent.
+
+    Returns the path of the checkpoint, None if the parent has no usable
+    checkpoint in which case the child starts from scratch.
+    """
+    if config is None:
+        config = cfg
+
+    models_dir = fu.get_subfolder("models", config=config)
+    parent_checkpoint = get_latest_checkpoint(
+        os.path.join(models_dir, parent_id, "nn")
+    )
+    if parent_checkpoint is None:
+        print(f"No checkpoint of parent {parent_id}, training from scratch.")
+        return None
+
+    parent_obs, parent_act = obsu.get_observation_layout(
+        fu.id2path(parent_id, "xml", config=config), config.ISAAC_FORCE_SENSORS
+    )
+    child_obs, child_act = obsu.get_observation_layout(
+        fu.id2path(child_id, "xml", config=config), config.ISAAC_FORCE_SENSORS
+    )
+    obs_index = obsu.get_layout_index(parent_obs, child_obs)
+    act_index = obsu.get_layout_index(parent_act, child_act)
+
+    checkpoint = torch.load(parent_checkpoint, map_location="cpu")
+    try:
+        checkpoint = remap_checkpoint(
+            checkpoint, obs_index, act_index, len(parent_obs), len(parent_act)
+        )
+    except ValueError as e:
+        print(f"Can not inherit checkpoint of {parent_id}: {e}")
+        return None
+
+    # The child trains for the full budget. Parameter shapes can change so the
+    # optimizer state is dropped, only its hyperparameters are kept.
+    checkpoint["epoch"] = 0
+    checkpoint["frame"] = 0
+    checkpoint["last_mean_rewards"] = -100500
+    checkpoint.pop("env_state", None)
+    if "optimizer" in checkpoint:
+        checkpoint["optimizer"]["state"] = {}
+
+    init_dir = os.path.join(models_dir, child_id, "init")
+    os.makedirs(init_dir, exist_ok=True)
+    path = os.path.join(init_dir, "{}_from_{}.pth".format(child_id, parent_id))
+    torch.save(checkpoint, path)
+    print(f"Initialized controller of {child_id} from {parent_checkpoint}")
+    return path
@@ -0,0 +1,85 @@
+"""Index of trained unimals by the hash of their xml.
+
+Mutations often recreate a morphology which was already trained, e.g
+density and gear mutations draw from small discrete ranges. The metadata of
+every trained unimal is appended to OUT_DIR/hash_index/<hash>.jsonl so that
+such duplicates can reuse the stored result instead of being retrained.
+"""
+
+import json
+import os
+
+from darei.config import cfg
+from darei.utils import file as fu
+from darei.utils import similarity as simu
+
+# Keys of a metadata which describe the unimal rather than the result of its
+# training, see get_metrics.
+UNIMAL_KEYS = ["id", "lineage", "train_time", "fidelity", "duplicate_of"]
+
+
+def get_hash(unimal_id, config=None):
+    if config is None:
+        config = cfg
+    return simu.get_metric(fu.id2path(unimal_id, "xml", config=config), "hash")
+
+
+def _index_path(unimal_hash, config):
+    return os.path.join(
+        fu.get_subfolder("hash_index", config=config), "{}.jsonl".format(unimal_hash)
+    )
+
+
+def record(unimal_id, metadata, config=None):
+    """Add the metadata of a trained unimal to the index."""
+    if config is None:
+        config = cfg
+
+    path = _index_path(get_hash(unimal_id, config=config), config)
+    fu.append_lines(path, json.dumps(metadata) + "\n")
+
+
+def lookup(unimal_id, policy, config=None):
+    """Return the stored metadata of a unimal with the same xml as unimal_id,
+    None if no such unimal was trained.
+
+    policy "reuse" returns the latest result.
+    """
+    if config is None:
+        config = cfg
+
+    path = _index_path(get_hash(unimal_id, config=config), config)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    if len(results) == 0:
+        return None
+
+    if policy == "reuse":
+        return results[-1]
+    else:
+        raise ValueError("Unsupported EVO.DUPLICATE_POLICY: {}".format(policy))
+
+
+def get_metrics(metadata):
+    """Return the training results of a stored metadata (reward, selection
+    criteria, ...), to be saved as the metrics of a duplicate so that it has
+    the same keys as a trained unimal.
+    """
+    return {
+        key: value for key, value in metadata.items() if key not in UNIMAL_KEYS
+    }
+
+
+def link_model(unimal_id, original_id, config=None):
+    """Point models/<unimal_id> to the models of the unimal it duplicates, so
+    that e.g its children can inherit the controller.
+    """
+    if config is None:
+        config = cfg
+
+    models_dir = fu.get_subfolder("models", config=config)
+    path = os.path.join(models_dir, unimal_id)
+    if not os.path.lexists(path):
+        os.symlink(original_id, path)
@@ -0,0 +1,115 @@
+"""On-disk cache of the similarity descriptors of unimal xmls.
+
+Descriptors are keyed by the sha224 of the xml file, so they stay valid for
+any unimal with the same xml. Each metric of a run has its own cache in
+<run dir>/descriptors: array descriptors are appended to <metric>.bin,
+read through a memory map, and <metric>.jsonl indexes them by key with
+their offset and shape. Scalar descriptors (e.g hash) are stored in the
+index directly.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+
+import numpy as np
+
+DTYPE = np.float64
+
+
+def get_cache_dir(xml_path):
+    """Cache dir of the run the xml belongs to (OUT_DIR/xml/<id>.xml)."""
+    run_dir = os.path.dirname(os.path.dirname(os.path.abspath(xml_path)))
+    return os.path.join(run_dir, "descriptors")
+
+
+def xml_key(xml_path, backend=None):
+    """sha224 of the xml, prefixed by the backend which computed the
+    descriptor if it depends on it (see EVO.DESCRIPTOR_BACKEND).
+    """
+    with open(xml_path, "rb") as f:
+        key = hashlib.sha224(f.read()).hexdigest()
+    if backend is not None:
+        key = "{}/{}".format(backend, key)
+    return key
+
+
+def to_array(descriptor):
+    """Array descriptor as stored in the cache, str descriptors are kept."""
+    if isinstance(descriptor, str):
+        return descriptor
+    array = np.asarray(descriptor, dtype=DTYPE)
+    if array.ndim == 1 and array.size == 0:
+        array = array.reshape(0, 0)
+    return array
+
+
+class DescriptorCache:
+    def __init__(self, cache_dir, metric_name):
+        self.data_path = os.path.join(cache_dir, "{}.bin".format(metric_name))
+        self.index_path = os.path.join(cache_dir, "{}.jsonl".format(metric_name))
+        self._index = {}
+        self._index_offset = 0
+        self._data = None
+
+    def _refresh(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r") as f:
+            f.seek(self._index_offset)
+            for line in iter(f.readline, ""):
+                # Partially written line, read it on the next refresh
+                if not line.endswith("\n"):
+                    break
+                self._index_offset = f.tell()
+                if line.strip():
+                    entry = json.loads(line)
+                    self._index[entry["key"]] = entry
+
+    def _read_array(self, offset, shape):
+        end = offset + int(np.prod(shape))
+        if self._data is None or len(self._data) < end:
+            self._data = np.memmap(self.data_path, dtype=DTYPE, mode="r")
+        return np.array(self._data[offset:end]).reshape(shape)
+
+    def get(self, key):
+        """Return the descriptor of key, None if it is not cached."""
+        if key not in self._index:
+            self._refresh()
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        if "value" in entry:
+            return entry["value"]
+        return self._read_array(entry["offset"], entry["shape"])
+
+    def put(self, key, descriptor):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        entry = {"key": key}
+        if isinstance(descriptor, str):
+            entry["value"] = descriptor
+        else:
+            array = to_array(descriptor)
+            entry["shape"] = list(array.shape)
+            with open(self.data_path, "ab") as f:
+                # Workers append concurrently, the lock makes the current
+                # size the offset of our array.
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0, os.SEEK_END)
+                    entry["offset"] = f.tell() // np.dtype(DTYPE).itemsize
+                    f.write(array.tobytes())
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+        # Index entry is written once the data is, so readers never see an
+        # entry without its data.
+        line = json.dumps(entry) + "\n"
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+        self._index[key] = entry
@@ -0,0 +1,36 @@
+"""Worker to supervisor events sent over an inherited pipe."""
+
+import json
+import os
+
+# Environment variable holding the write end of the event pipe of a worker.
+EVENT_FD_ENV = "DAREI_EVENT_FD"
+
+# Pipe capacity on linux, a read of this size drains the pipe.
+_READ_SIZE = 65536
+
+
+def notify(event, **kwargs):
+    """Send event to the supervisor. No-op if process was not launched by it."""
+    fd = os.environ.get(EVENT_FD_ENV)
+    if fd is None:
+        return
+
+    kwargs["event"] = event
+    kwargs["pid"] = os.getpid()
+    # Writes smaller than PIPE_BUF are atomic, so concurrent writers can not
+    # interleave messages.
+    msg = json.dumps(kwargs) + "\n"
+    try:
+        os.write(int(fd), msg.encode())
+    except OSError:
+        # Supervisor is gone, nothing to notify.
+        pass
+
+
+def read_events(fd):
+    """Return the list of pending events on fd, None if all writers exited."""
+    data = os.read(fd, _READ_SIZE)
+    if not data:
+        return None
+    return [json.loads(line) for line in data.decode().splitlines() if line]
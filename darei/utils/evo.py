@@ -6,6 +6,8 @@ import copy
 
 from darei.config import cfg
 from darei.utils import file as fu
+from darei.utils import store as pstore
+from darei.utils import window as aging_window
 
 
 # From: https://github.com/QUVA-Lab/artemis/blob/peter/artemis/general/pareto_efficiency.py
@@ -37,32 +39,126 @@ def is_pareto_efficient(costs, return_mask=True):
         return is_efficient
 
 
+# Number of rows of the domination matrix computed at once
+DOMINATION_BLOCK_SIZE = 1024
+
+
+def dominates(costs_a, costs_b):
+    """(A, B) mask, True where a point of costs_a dominates one of costs_b."""
+    # Loop over the few criteria, not over points, to avoid (A, B, n_costs)
+    # temporaries.
+    no_worse = np.ones((len(costs_a), len(costs_b)), dtype=bool)
+    better = np.zeros((len(costs_a), len(costs_b)), dtype=bool)
+    for obj in range(costs_a.shape[1]):
+        col_a = costs_a[:, obj, None]
+        col_b = costs_b[None, :, obj]
+        no_worse &= col_a <= col_b
+        better |= col_a < col_b
+    return no_worse & better
+
+
+def _num_dominated(costs, rows):
+    """For each point, number of points in rows which dominate it."""
+    counts = np.zeros(len(costs), dtype=np.int64)
+    for start in range(0, len(rows), DOMINATION_BLOCK_SIZE):
+        block = rows[start : start + DOMINATION_BLOCK_SIZE]
+        counts += dominates(costs[block], costs).sum(axis=0)
+    return counts
+
+
+def non_dominated_sort(costs):
+    """Return the Pareto rank of each point of the (n_points, n_costs) array,
+    0 for the first front. Fronts are peeled off by updating the number of
+    points dominating each point, the domination matrix is computed in
+    blocks of rows so memory stays O(DOMINATION_BLOCK_SIZE * n_points).
+    """
+    costs = np.asarray(costs, dtype=float)
+    num_points = len(costs)
+    rank = np.full(num_points, -1, dtype=np.int64)
+    counts = _num_dominated(costs, np.arange(num_points))
+
+    front = np.flatnonzero(counts == 0)
+    cur_rank = 0
+    while len(front) > 0:
+        rank[front] = cur_rank
+        counts -= _num_dominated(costs, front)
+        front = np.flatnonzero((counts == 0) & (rank == -1))
+        cur_rank += 1
+    return rank
+
+
+def crowding_distance(costs, rank):
+    """NSGA-II crowding distance of each point within its front. Boundary
+    points of a front get inf.
+    """
+    costs = np.asarray(costs, dtype=float)
+    num_points, num_costs = costs.shape
+    distance = np.zeros(num_points)
+    if num_points == 0:
+        return distance
+
+    for obj in range(num_costs):
+        # Sort by front, then by objective within the front
+        order = np.lexsort((costs[:, obj], rank))
+        values = costs[order, obj]
+        fronts = rank[order]
+        is_first = np.r_[True, fronts[1:] != fronts[:-1]]
+        is_last = np.r_[fronts[1:] != fronts[:-1], True]
+
+        # Range of the objective within the front of each point
+        front_start = np.maximum.accumulate(
+            np.where(is_first, np.arange(num_points), 0)
+        )
+        front_end = np.minimum.accumulate(
+            np.where(is_last, np.arange(num_points), num_points - 1)[::-1]
+        )[::-1]
+        value_range = values[front_end] - values[front_start]
+
+        prev_values = np.r_[values[0], values[:-1]]
+        next_values = np.r_[values[1:], values[-1]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            obj_distance = np.where(
+                value_range > 0, (next_values - prev_values) / value_range, 0.0
+            )
+        obj_distance[is_first | is_last] = np.inf
+        distance[order] += obj_distance
+    return distance
+
+
 def select_parent(min_searched_space_size):
+    if "nsga" in cfg.EVO.TOURNAMENT_TYPE:
+        return nsga_tournament(min_searched_space_size)
     if "aging" in cfg.EVO.TOURNAMENT_TYPE:
         return aging_tournament(min_searched_space_size)
     if "vanilla" in cfg.EVO.TOURNAMENT_TYPE:
         return vanilla_tournament()
 
 
-def get_dominate_mask(metadatas):
+def get_costs(metadatas):
+    """Selection criteria of metadatas as costs, i.e lower is better."""
     rew_keys = cfg.EVO.SELECTION_CRITERIA
     rews = []
     for m in metadatas:
         rews.append([float(m[rew_key]) for rew_key in rew_keys])
+    return cfg.EVO.SELECTION_CRITERIA_OBJ * np.asarray(rews).reshape(-1, len(rew_keys))
 
-    dominate_mask = is_pareto_efficient(
-        cfg.EVO.SELECTION_CRITERIA_OBJ * np.asarray(rews)
-    )
+
+def get_dominate_mask(metadatas):
+    dominate_mask = is_pareto_efficient(get_costs(metadatas))
     return dominate_mask
 
 
 def aging_tournament(min_searched_space_size):
+    num_unimals = cfg.EVO.NUM_PARTICIPANTS
+    window = aging_window.get_window()
+    if window is not None:
+        metadatas = window.sample(min_searched_space_size, num_unimals)
+        return select_from_participants(metadatas)
+
     metadata_paths = fu.get_files(fu.get_subfolder("metadata", config=copy.deepcopy(cfg)), ".*json")
     metadata_paths = sorted(metadata_paths, key=os.path.getmtime)
     metadata_paths = metadata_paths[min_searched_space_size :]
 
-    num_unimals = cfg.EVO.NUM_PARTICIPANTS
-
     # if "percent" in cfg.EVO.TOURNAMENT_TYPE:
     #     num_unimals = int(
     #         (cfg.EVO.PERCENT_PARTICIPANTS / 100) * cfg.EVO.AGING_WINDOW_SIZE
@@ -71,7 +167,75 @@ def aging_tournament(min_searched_space_size):
 
     metadata_paths = random.choices(metadata_paths, k=num_unimals)
     metadatas = [fu.load_json(m) for m in metadata_paths]
+    return select_from_participants(metadatas)
+
+
+def get_window_metadatas(min_searched_space_size):
+    """Metadata and costs of the unimals in the aging window."""
+    window = aging_window.get_window()
+    if window is not None:
+        metadatas, rews = window.get(min_searched_space_size)
+        return metadatas, cfg.EVO.SELECTION_CRITERIA_OBJ * rews
+
+    metadata_paths = fu.get_files(fu.get_subfolder("metadata", config=copy.deepcopy(cfg)), ".*json")
+    metadata_paths = sorted(metadata_paths, key=os.path.getmtime)
+    metadata_paths = metadata_paths[min_searched_space_size :]
+    metadatas = [fu.load_json(m) for m in metadata_paths]
+    return metadatas, get_costs(metadatas)
+
+
+# Ranks of the aging window computed by the last nsga tournament and the
+# (window, last_seq, count, offset) they were computed for.
+_nsga_ranks = None
+_nsga_ranks_key = None
+
+
+def get_window_ranks(min_searched_space_size):
+    """Metadata, Pareto rank and crowding distance of the unimals in the
+    aging window. They only change when unimals join the window, so they are
+    cached between the tournaments of a worker.
+    """
+    global _nsga_ranks, _nsga_ranks_key
+
+    window = aging_window.get_window()
+    key = None
+    if window is not None:
+        key = (window, window.last_seq, window.count, min_searched_space_size)
+        if _nsga_ranks is not None and _nsga_ranks_key == key:
+            return _nsga_ranks
+
+    metadatas, costs = get_window_metadatas(min_searched_space_size)
+    rank = non_dominated_sort(costs)
+    distance = crowding_distance(costs, rank)
+    _nsga_ranks = (metadatas, rank, distance)
+    _nsga_ranks_key = key
+    return _nsga_ranks
+
+
+def nsga_tournament(min_searched_space_size):
+    """Aging tournament where participants are ranked by their Pareto rank
+    and crowding distance over the whole aging window, as in NSGA-II.
+    """
+    metadatas, rank, distance = get_window_ranks(min_searched_space_size)
+
+    num_unimals = cfg.EVO.NUM_PARTICIPANTS
+    if "percent" in cfg.EVO.TOURNAMENT_TYPE:
+        num_unimals = int(
+            (cfg.EVO.PERCENT_PARTICIPANTS / 100) * cfg.EVO.AGING_WINDOW_SIZE
+        )
+        num_unimals = max(2, num_unimals)
+
+    participants = random.choices(range(len(metadatas)), k=num_unimals)
+    # Lowest rank wins, ties are broken by the largest crowding distance and
+    # then at random.
+    best = min(
+        participants,
+        key=lambda idx: (rank[idx], -distance[idx], random.random()),
+    )
+    return metadatas[best]
+
 
+def select_from_participants(metadatas):
     dominate_mask = get_dominate_mask(metadatas)
     pareto_front = [m for m, d_mask in zip(metadatas, dominate_mask) if d_mask]
     if np.all(dominate_mask):
@@ -83,18 +247,30 @@ def aging_tournament(min_searched_space_size):
 
 
 def vanilla_tournament():
-    metadata_paths = fu.get_files(fu.get_subfolder("metadata"), ".*json")
+    store = pstore.get_store()
+    if store is not None:
+        seqs = store.get_seqs()
+        pop_size = len(seqs)
+    else:
+        metadata_paths = fu.get_files(fu.get_subfolder("metadata"), ".*json")
+        pop_size = len(metadata_paths)
 
     num_unimals = cfg.EVO.NUM_PARTICIPANTS
 
     if "percent" in cfg.EVO.TOURNAMENT_TYPE:
         num_unimals = int(
-            (cfg.EVO.PERCENT_PARTICIPANTS / 100) * len(metadata_paths)
+            (cfg.EVO.PERCENT_PARTICIPANTS / 100) * pop_size
         )
         num_unimals = max(2, num_unimals)
 
-    metadata_paths = random.choices(metadata_paths, k=num_unimals)
-    metadatas = [fu.load_json(m) for m in metadata_paths]
+    if store is not None:
+        metadatas = store.get_by_seqs(random.choices(seqs, k=num_unimals))
+        metadata_paths = [
+            fu.id2path(m["id"], "metadata") for m in metadatas
+        ]
+    else:
+        metadata_paths = random.choices(metadata_paths, k=num_unimals)
+        metadatas = [fu.load_json(m) for m in metadata_paths]
 
     dominate_mask = get_dominate_mask(metadatas)
     pareto_front = [m for m, d_mask in zip(metadatas, dominate_mask) if d_mask]
@@ -106,6 +282,8 @@ def vanilla_tournament():
         # unimal which is dominated.
         for path, d_mask in zip(metadata_paths, dominate_mask):
             if not d_mask:
+                if store is not None:
+                    store.remove(fu.path2id(path))
                 fu.remove_file(path)
                 break
         return random.choice(pareto_front)
@@ -123,9 +301,20 @@ def get_searched_space_size():
 
 def get_population_size():
     """Return the current population size."""
+    store = pstore.get_store()
+    if store is not None:
+        return store.size()
     return len(os.listdir(fu.get_subfolder("metadata", config=copy.deepcopy(cfg))))
 
 
+def get_max_searched_space_size():
+    """Return the population size at which tournament evolution stops."""
+    return (
+        cfg.EVO.INIT_POPULATION_SIZE
+        + cfg.EVO.NUM_GENERATIONS * cfg.EVO.NUM_TOURNAMENTS_PER_GEN
+    )
+
+
 def should_save_video():
     """Return if video of unimal has to be saved."""
     # In case of RGS don't save video
@@ -4,11 +4,16 @@ from pathlib import Path
 import copy
 
 from darei.config import cfg
+from darei.utils import events
 from darei.utils import file as fu
+from darei.utils import store as pstore
 
 
 def handle_exception(err, custom_msg, unimal_id=None):
-    """Print err and custom message, save a file marking err and exit proc."""
+    """Print err and custom message, save a file marking err and exit proc.
+
+    unimal_id can also be a list of ids.
+    """
     print(custom_msg)
     print(err)
 
@@ -19,7 +24,21 @@ def handle_exception(err, custom_msg, unimal_id=None):
 
     process_end = os.path.join(cfg.OUT_DIR, "{}_{}".format(cfg.NODE_ID, proc_id))
     Path(process_end).touch()
-    if unimal_id:
+    # Multi morphology training fails for all the unimals it trains.
+    if isinstance(unimal_id, list):
+        unimal_ids = unimal_id
+    elif unimal_id:
+        unimal_ids = [unimal_id]
+    else:
+        unimal_ids = []
+
+    store = pstore.get_store() if unimal_ids else None
+    for unimal_id in unimal_ids:
+        if store is not None:
+            store.add_error(unimal_id)
         error_path = fu.id2path(unimal_id, "error_metadata", config=copy.deepcopy(cfg))
         Path(error_path).touch()
+    # Notify last, the supervisor relaunches the worker as soon as it reads
+    # the event.
+    events.notify("error", unimal_id=unimal_id)
     sys.exit(1)
@@ -0,0 +1,83 @@
+"""Process pool shared by the similarity and population tools.
+
+The pool is started on first use and reused by later calls in the same
+process, so repeated graph builds do not pay for starting workers and
+importing modules again. Workers are spawned rather than forked, so a pool
+started after CUDA was initialised in the parent is safe. They get a copy of
+cfg when they start, the pool is restarted if cfg changed since. It is shut
+down at exit.
+"""
+
+import atexit
+import importlib
+import math
+import multiprocessing
+import os
+
+from darei.config import cfg
+
+_context = multiprocessing.get_context("spawn")
+_pool = None
+# (pid, num workers, cfg version) the pool was started with
+_pool_key = None
+
+
+def _init_worker(parent_cfg, modules):
+    # Spawned workers import the default config.
+    cfg.merge_from_other_cfg(parent_cfg)
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def get_num_workers():
+    return cfg.EVO.NUM_CPU_PROCESSES
+
+
+def get_pool():
+    global _pool, _pool_key
+
+    key = (os.getpid(), get_num_workers(), cfg.version())
+    if _pool is not None and _pool_key == key:
+        return _pool
+
+    # A pool inherited from the parent process is not ours to close.
+    if _pool is not None and _pool_key[0] == os.getpid():
+        shutdown()
+    _pool = _context.Pool(
+        get_num_workers(),
+        initializer=_init_worker,
+        initargs=(cfg, list(cfg.EVO.EXECUTOR_PRELOAD)),
+    )
+    _pool_key = key
+    return _pool
+
+
+def shutdown():
+    global _pool, _pool_key
+
+    if _pool is not None and _pool_key[0] == os.getpid():
+        _pool.close()
+        _pool.join()
+    _pool = None
+    _pool_key = None
+
+
+atexit.register(shutdown)
+
+
+def _chunksize(num_items):
+    # A few chunks per worker balances load without a round trip per item.
+    return max(1, math.ceil(num_items / (4 * get_num_workers())))
+
+
+def map(fn, items):
+    items = list(items)
+    return get_pool().map(fn, items, chunksize=_chunksize(len(items)))
+
+
+def starmap(fn, items):
+    items = list(items)
+    return get_pool().starmap(fn, items, chunksize=_chunksize(len(items)))
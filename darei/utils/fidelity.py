@@ -0,0 +1,72 @@
+"""Asynchronous successive halving over the training budget of unimals.
+
+Unimals are trained for a fraction of the epochs (rung 0) first. They are
+promoted to the next rung, and resume training from their checkpoint, only
+if their reward is in the top 1 / EVO.FIDELITY_ETA of the rewards recorded
+at their rung so far.
+"""
+
+import json
+import os
+
+from darei.config import cfg
+from darei.utils import file as fu
+
+
+def get_rung_epochs(max_epochs, min_epochs=1, config=None):
+    """Return the cumulative number of epochs a unimal trains for per rung.
+
+    rl_games only reports a reward once an episode finished, so rungs train
+    for at least min_epochs.
+    """
+    if config is None:
+        config = cfg
+
+    num_rungs = config.EVO.FIDELITY_RUNGS
+    eta = config.EVO.FIDELITY_ETA
+    rung_epochs = [
+        max(min_epochs, int(round(max_epochs / eta ** (num_rungs - 1 - rung))))
+        for rung in range(num_rungs)
+    ]
+    # Drop rungs which collapsed onto the next one.
+    return sorted(set(min(epochs, max_epochs) for epochs in rung_epochs))
+
+
+def _rung_path(rung, config):
+    return os.path.join(
+        fu.get_subfolder("fidelity", config=config), "rung_{}.jsonl".format(rung)
+    )
+
+
+def record_result(rung, unimal_id, reward, config=None):
+    if config is None:
+        config = cfg
+
+    fu.append_lines(
+        _rung_path(rung, config),
+        json.dumps({"id": unimal_id, "reward": float(reward)}) + "\n"
+    )
+
+
+def get_rung_rewards(rung, config=None):
+    if config is None:
+        config = cfg
+
+    path = _rung_path(rung, config)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line)["reward"] for line in f if line.strip()]
+
+
+def should_promote(rung, reward, config=None):
+    """Return True if reward, already recorded, is in the top 1 / eta of
+    rung. Until a rung has eta results the best result so far is promoted.
+    """
+    if config is None:
+        config = cfg
+
+    rewards = get_rung_rewards(rung, config=config)
+    num_promoted = max(1, len(rewards) // config.EVO.FIDELITY_ETA)
+    rank = sum(1 for r in rewards if r > float(reward))
+    return rank < num_promoted
@@ -43,6 +43,18 @@ def load_json(path):
         return json.load(f)
 
 
+def append_lines(path, lines):
+    """Append lines (a str ending with a newline) to path. The lines go out
+    in a single write to a file opened with O_APPEND, so appends of
+    different workers do not interleave.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, lines.encode())
+    finally:
+        os.close(fd)
+
+
 def save_pickle(data, path):
     with open(path, "wb") as f:
         pickle.dump(data, f)
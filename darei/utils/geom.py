@@ -67,3 +67,53 @@ def normalize_vec(a):
     """Return unit vector in dir of a."""
     return a / np.linalg.norm(a)
 
+
+
+def segment_distance(p0, p1, q0, q1, eps=1e-12):
+    """Distance between segment p0-p1 and each of the segments q0-q1.
+
+    q0 and q1 are (N, 3) arrays. Follows the closest points computation in
+    Ericson, Real-Time Collision Detection, 5.1.9. A segment with equal end
+    points is a point.
+    """
+    p0 = np.asarray(p0, dtype=float)
+    q0 = np.asarray(q0, dtype=float).reshape(-1, 3)
+    q1 = np.asarray(q1, dtype=float).reshape(-1, 3)
+    d1 = np.asarray(p1, dtype=float) - p0
+    d2 = q1 - q0
+    r = p0 - q0
+
+    a = np.dot(d1, d1)
+    e = np.einsum("ij,ij->i", d2, d2)
+    f = np.einsum("ij,ij->i", d2, r)
+    c = r @ d1
+    b = d2 @ d1
+    safe_e = np.maximum(e, eps)
+
+    if a <= eps:
+        s = np.zeros(len(q0))
+        t = np.clip(f / safe_e, 0.0, 1.0)
+    else:
+        denom = a * e - b * b
+        s = np.where(
+            denom > eps,
+            np.clip((b * f - c * e) / np.maximum(denom, eps), 0.0, 1.0),
+            0.0,
+        )
+        t = (b * s + f) / safe_e
+        # Clamp t to the segment and recompute s for the clamped t.
+        s = np.where(t < 0.0, np.clip(-c / a, 0.0, 1.0), s)
+        s = np.where(t > 1.0, np.clip((b - c) / a, 0.0, 1.0), s)
+        t = np.clip(t, 0.0, 1.0)
+        # Second segment is a point
+        s = np.where(e <= eps, np.clip(-c / a, 0.0, 1.0), s)
+        t = np.where(e <= eps, 0.0, t)
+
+    closest_p = p0 + s[:, None] * d1
+    closest_q = q0 + t[:, None] * d2
+    return np.linalg.norm(closest_p - closest_q, axis=1)
+
+
+def capsule_volume(radius, length):
+    """Volume of a capsule, a sphere if length is 0."""
+    return np.pi * radius ** 2 * length + 4.0 / 3.0 * np.pi * radius ** 3
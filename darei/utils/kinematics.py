@@ -0,0 +1,104 @@
+"""Forward kinematics of a unimal xml without MuJoCo.
+
+Descriptors are taken at qpos0: joints are at their zero position and
+bodies have no rotation, so the world position of a body is the sum of the
+pos of its ancestors. Limb geoms are fromto capsules whose frame is
+computed like the MuJoCo compiler does (mjuu_z2quat), i.e the minimal
+rotation taking the z axis to from - to.
+
+The unimal_init state alone is not enough, the radii of the parents which
+offset the limbs are only in the xml. Parsing the xml is still orders of
+magnitude faster than compiling a model.
+"""
+
+import numpy as np
+
+from darei.utils import xml as xu
+
+# Site prefixes of the point cloud, see similarity.point_cloud_from_sim
+POINT_CLOUD_SITE_PREFIXES = ["limb/btm/", "torso", "limb/mid/"]
+
+
+def _pos(elem):
+    pos = elem.get("pos")
+    if pos is not None:
+        return xu.str2arr(pos)
+    fromto = elem.get("fromto")
+    if fromto is not None:
+        fromto = xu.str2arr(fromto)
+        return (fromto[:3] + fromto[3:]) / 2
+    return np.zeros(3)
+
+
+def z2mat(vecs):
+    """Rotation matrices (N, 3, 3) taking the z axis to each of vecs."""
+    vecs = np.asarray(vecs, dtype=float).reshape(-1, 3)
+    # axis = z x vec
+    axis = np.stack(
+        [-vecs[:, 1], vecs[:, 0], np.zeros(len(vecs))], axis=1
+    )
+    s = np.linalg.norm(axis, axis=1)
+    parallel = s < 1e-10
+    axis[parallel] = [1.0, 0.0, 0.0]
+    axis[~parallel] /= s[~parallel, None]
+    angle = np.arctan2(s, vecs[:, 2])
+
+    # Rodrigues' rotation formula
+    cos, sin = np.cos(angle), np.sin(angle)
+    x, y, z = axis[:, 0], axis[:, 1], axis[:, 2]
+    cross = np.zeros((len(vecs), 3, 3))
+    cross[:, 0, 1], cross[:, 0, 2] = -z, y
+    cross[:, 1, 0], cross[:, 1, 2] = z, -x
+    cross[:, 2, 0], cross[:, 2, 1] = -y, x
+    outer = axis[:, :, None] * axis[:, None, :]
+    return (
+        cos[:, None, None] * np.eye(3)
+        + sin[:, None, None] * cross
+        + (1 - cos)[:, None, None] * outer
+    )
+
+
+def forward_kinematics(root):
+    """Return world positions of bodies and sites, and the geoms of a unimal
+    xml root, each as {name: value} in MuJoCo order.
+    """
+    worldbody = root.findall("./worldbody")[0]
+    body_xpos = {}
+    site_xpos = {}
+    geoms = {}
+    # Pre-order traversal, the order in which MuJoCo numbers bodies.
+    for body in worldbody.iter("body"):
+        parent = body.getparent()
+        xpos = _pos(body)
+        if parent.tag == "body":
+            xpos = body_xpos[parent.get("name")] + xpos
+        body_xpos[body.get("name")] = xpos
+        for site in xu.find_elem(body, "site", child_only=True):
+            site_xpos[site.get("name")] = xpos + _pos(site)
+        for geom in xu.find_elem(body, "geom", child_only=True):
+            geoms[geom.get("name")] = (xpos, geom)
+    return body_xpos, site_xpos, geoms
+
+
+def point_cloud(root):
+    """Same as similarity.point_cloud_from_sim."""
+    _, site_xpos, _ = forward_kinematics(root)
+    return [
+        [round(_, 2) for _ in pos]
+        for name, pos in site_xpos.items()
+        if any(name.startswith(prefix) for prefix in POINT_CLOUD_SITE_PREFIXES)
+    ]
+
+
+def geom_orientations(root):
+    """Same as similarity.geom_orientations_from_sim."""
+    _, _, geoms = forward_kinematics(root)
+    vecs = []
+    for name, (_, geom) in geoms.items():
+        if not name.startswith("limb/"):
+            continue
+        fromto = xu.str2arr(geom.get("fromto"))
+        vecs.append(fromto[:3] - fromto[3:])
+    if len(vecs) == 0:
+        return []
+    return list(z2mat(vecs).reshape(-1, 9))
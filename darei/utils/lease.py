@@ -0,0 +1,155 @@
+"""Work queue where workers claim jobs with time limited leases.
+
+A lease is a file in a directory shared by all nodes. It is created with
+os.link, which is atomic on local and network filesystems, and renewed by
+touching it. A lease which has not been touched for the lease duration is
+expired and can be claimed by any worker.
+"""
+
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from darei.utils import file as fu
+
+# Leases are renewed, and waiting workers poll, this many times per duration.
+RENEWALS_PER_DURATION = 3
+
+
+class LeaseQueue:
+    def __init__(self, lease_dir, owner, duration):
+        """owner identifies the worker slot (e.g node and proc id). A relaunched
+        worker with the same owner can reclaim the leases of its predecessor
+        without waiting for them to expire.
+        """
+        self.lease_dir = lease_dir
+        self.owner = owner
+        self.duration = duration
+        # Unique per LeaseQueue, tells apart workers with the same owner.
+        self.token = uuid.uuid4().hex
+        os.makedirs(lease_dir, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.lease_dir, "{}.lease".format(job_id))
+
+    def _read(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _create(self, path):
+        tmp_path = "{}.{}.tmp".format(path, self.token)
+        lease = {
+            "owner": self.owner,
+            "token": self.token,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+        }
+        with open(tmp_path, "w") as f:
+            json.dump(lease, f)
+        try:
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            fu.remove_file(tmp_path)
+
+    def _is_stale(self, path, lease):
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        if age > self.duration:
+            return True
+        # Previous incarnation of this worker, it is not running anymore.
+        return (
+            lease is not None
+            and lease["owner"] == self.owner
+            and lease["token"] != self.token
+        )
+
+    def _steal(self, path):
+        # Only one worker can move the stale lease away.
+        stale_path = "{}.{}.stale".format(path, self.token)
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return False
+
+        # Another worker could have replaced the stale lease with a live one
+        # between our check and the rename. Put it back in that case.
+        if not self._is_stale(stale_path, self._read(stale_path)):
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass
+            fu.remove_file(stale_path)
+            return False
+
+        fu.remove_file(stale_path)
+        return self._create(path)
+
+    def is_ours(self, job_id):
+        lease = self._read(self._path(job_id))
+        return lease is not None and lease["token"] == self.token
+
+    def claim(self, job_ids, start=0):
+        """Return the first job in job_ids (rotated by start) which could be
+        leased, None if all of them are leased by live workers.
+        """
+        if len(job_ids) == 0:
+            return None
+        start = start % len(job_ids)
+        for job_id in job_ids[start:] + job_ids[:start]:
+            path = self._path(job_id)
+            if self._create(path):
+                return job_id
+            if self._is_stale(path, self._read(path)) and self._steal(path):
+                return job_id
+        return None
+
+    def renew(self, job_id):
+        """Extend the lease, returns False if it was lost to another worker."""
+        if not self.is_ours(job_id):
+            return False
+        try:
+            os.utime(self._path(job_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, job_id):
+        if self.is_ours(job_id):
+            fu.remove_file(self._path(job_id))
+
+    @contextlib.contextmanager
+    def hold(self, job_id):
+        """Renew the lease in a background thread while the job runs. Yields
+        an event which is set if the lease is lost to another worker, the job
+        should then drop its results as the other worker runs it again.
+        """
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def renew_loop():
+            while not stop.wait(self.duration / RENEWALS_PER_DURATION):
+                if not self.renew(job_id):
+                    print("Lost lease of {}".format(job_id))
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=renew_loop, daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+            self.release(job_id)
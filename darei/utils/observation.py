@@ -0,0 +1,135 @@
+"""Observation and action layout of the Unimal tasks.
+
+The layout names every observation and action dimension after the joint or
+body it belongs to, so that the dimensions of two morphologies can be
+matched, e.g to reuse the controller of a parent for its mutated child.
+"""
+
+from collections import OrderedDict
+
+from darei.utils import kinematics
+from darei.utils import xml as xu
+
+# Each force sensor state has forces (3) and torques (3) data => 6.
+SENSOR_DIM = 6
+
+# Bodies with a force sensor. all: every body with a touch site, leaves:
+# bodies without child bodies, feet: bodies which touch the ground at qpos0
+# (see FOOT_CONTACT_TOL), none: no force sensor.
+SENSOR_MODES = ["all", "leaves", "feet", "none"]
+
+# Max height of the lowest point of a foot above the lowest point of the unimal
+FOOT_CONTACT_TOL = 0.05
+
+# Refer to section A.2.1 in IsaacGym Paper for details on observation space.
+# Number of dims of the sections which do not depend on the morphology.
+COMMON_OBS = OrderedDict(
+    [
+        ("torso_vertical_position", 1),
+        ("velocity_positional", 3),
+        ("velocity_angular", 3),
+        ("angle_to_target", 3),
+        ("up_and_heading_vec_proj", 2),
+    ]
+)
+
+
+def get_observation_space_map(num_dofs, num_sensors):
+    """Return the size of each observation section, in order."""
+    observation_space_map = OrderedDict(COMMON_OBS)
+    observation_space_map['dof_meas_pos'] = num_dofs
+    observation_space_map['dof_meas_vel'] = num_dofs
+    observation_space_map['sensor_state'] = num_sensors * SENSOR_DIM
+    observation_space_map['actions'] = num_dofs
+    return observation_space_map
+
+
+def get_dof_names(root):
+    """Names of the actuated joints in the order IsaacGym creates dofs."""
+    return [
+        joint.get("name")
+        for joint in root.findall("./worldbody//joint")
+        if joint.get("class") != "free"
+    ]
+
+
+def get_body_names(root):
+    """Names of the bodies in the order IsaacGym creates rigid bodies."""
+    return [body.get("name") for body in root.findall("./worldbody//body")]
+
+
+def _get_lowest_points(root):
+    """Height of the lowest point of each body at qpos0."""
+    _, _, geoms = kinematics.forward_kinematics(root)
+    lowest_points = {}
+    for xpos, geom in geoms.values():
+        radius = xu.str2arr(geom.get("size"))[0]
+        fromto = geom.get("fromto")
+        if fromto is not None:
+            fromto = xu.str2arr(fromto)
+            z = xpos[2] + min(fromto[2], fromto[5]) - radius
+        else:
+            z = xpos[2] + xu.str2arr(geom.get("pos", "0 0 0"))[2] - radius
+        body_name = geom.getparent().get("name")
+        lowest_points[body_name] = min(z, lowest_points.get(body_name, z))
+    return lowest_points
+
+
+def get_sensor_body_names(root, mode="all"):
+    """Names of the bodies with a force sensor, in rigid body order."""
+    assert mode in SENSOR_MODES, "Invalid force sensor mode: {}".format(mode)
+    if mode == "none":
+        return []
+
+    # Touch sensors of the xml name the site of each body with a sensor.
+    touch_sites = {
+        sensor.get("site") for sensor in xu.find_elem(root, "touch")
+    }
+    bodies = [
+        body for body in root.findall("./worldbody//body")
+        if any(
+            site.get("name") in touch_sites
+            for site in xu.find_elem(body, "site", child_only=True)
+        )
+    ]
+    if mode == "leaves":
+        bodies = [
+            body for body in bodies
+            if len(xu.find_elem(body, "body", child_only=True)) == 0
+        ]
+    elif mode == "feet":
+        lowest_points = _get_lowest_points(root)
+        ground = min(lowest_points.values())
+        bodies = [
+            body for body in bodies
+            if lowest_points[body.get("name")] <= ground + FOOT_CONTACT_TOL
+        ]
+    return [body.get("name") for body in bodies]
+
+
+def get_observation_layout(xml_path, sensor_mode="all"):
+    """Return names of the observation and of the action dims of a unimal."""
+    root, _ = xu.etree_from_xml(xml_path)
+    dof_names = get_dof_names(root)
+    body_names = get_sensor_body_names(root, sensor_mode)
+
+    obs_names = []
+    for section, size in COMMON_OBS.items():
+        obs_names.extend("{}/{}".format(section, idx) for idx in range(size))
+    for section in ['dof_meas_pos', 'dof_meas_vel']:
+        obs_names.extend("{}/{}".format(section, name) for name in dof_names)
+    for name in body_names:
+        obs_names.extend(
+            "sensor_state/{}/{}".format(name, idx) for idx in range(SENSOR_DIM)
+        )
+    obs_names.extend("actions/{}".format(name) for name in dof_names)
+
+    return obs_names, dof_names
+
+
+def get_layout_index(src_names, dst_names):
+    """For each name in dst_names return its index in src_names, -1 if the
+    name is missing.
+    """
+    src_index = {name: idx for idx, name in enumerate(src_names)}
+    return [src_index.get(name, -1) for name in dst_names]
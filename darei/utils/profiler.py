@@ -0,0 +1,104 @@
+"""Per phase timers of VecTask.step.
+
+Phases are delimited by marks: mark(name) attributes the time since the
+previous mark to name. On GPU the time of a phase is measured with CUDA
+events recorded on the current stream, so profiling does not synchronize
+the host with the device, events are only resolved when a summary is read.
+A task without profiling has no profiler (VecTask.profiler is None).
+"""
+
+import time
+from collections import defaultdict
+
+import torch
+
+
+class _Timings:
+    def __init__(self):
+        self.steps = 0
+        self.wall_time = 0.0
+        self.phases = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def summary(self, num_envs):
+        if self.steps == 0:
+            return {}
+        env_steps = self.steps * num_envs
+        phase_time = sum(self.phases.values())
+        summary = {
+            "steps": self.steps,
+            "env_steps_per_sec": env_steps / max(self.wall_time, 1e-9),
+            "reset_fraction": self.counts["resets"] / env_steps,
+        }
+        for name, total in self.phases.items():
+            summary["ms_per_step/{}".format(name)] = 1000 * total / self.steps
+            summary["fraction/{}".format(name)] = total / max(phase_time, 1e-9)
+        for name, total in self.counts.items():
+            summary["count/{}".format(name)] = total
+        return summary
+
+
+class StepProfiler:
+    def __init__(self, num_envs, device):
+        self.num_envs = num_envs
+        self.use_events = str(device).startswith("cuda")
+        # Run totals and totals since the last interval summary
+        self.run = _Timings()
+        self.interval = _Timings()
+        self._step_start = None
+        self._last_mark = None
+        # (phase, start event, end event) not resolved yet
+        self._pending = []
+
+    def _now(self):
+        if self.use_events:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def start_step(self):
+        self._step_start = time.perf_counter()
+        self._last_mark = self._now()
+
+    def mark(self, phase):
+        now = self._now()
+        if self.use_events:
+            self._pending.append((phase, self._last_mark, now))
+        else:
+            self._add_phase(phase, now - self._last_mark)
+        self._last_mark = now
+
+    def count(self, name, value=1):
+        self.run.counts[name] += value
+        self.interval.counts[name] += value
+
+    def end_step(self):
+        wall_time = time.perf_counter() - self._step_start
+        for timings in (self.run, self.interval):
+            timings.steps += 1
+            timings.wall_time += wall_time
+
+    def _add_phase(self, phase, seconds):
+        self.run.phases[phase] += seconds
+        self.interval.phases[phase] += seconds
+
+    def _resolve(self):
+        if not self._pending:
+            return
+        self._pending[-1][2].synchronize()
+        for phase, start, end in self._pending:
+            self._add_phase(phase, start.elapsed_time(end) / 1000)
+        self._pending = []
+
+    def interval_summary(self):
+        """Summary of the steps since the last call, e.g for TensorBoard."""
+        self._resolve()
+        summary = self.interval.summary(self.num_envs)
+        self.interval = _Timings()
+        return summary
+
+    def summary(self):
+        """Summary of all the steps of the run, e.g for the metadata."""
+        self._resolve()
+        return self.run.summary(self.num_envs)
@@ -1,23 +1,37 @@
+import functools
 import hashlib
 import itertools
-import multiprocessing
-from multiprocessing import Pool
+from collections import defaultdict
 
 import networkx as nx
+import numpy as np
 from scipy.optimize import linear_sum_assignment
 from scipy.spatial.distance import cdist
 
+from darei.config import cfg
+from darei.utils import descriptor as desc
+from darei.utils import executor
 from darei.utils import file as fu
+from darei.utils import kinematics as kin
 from darei.utils import mjpy as mu
 from darei.utils import xml as xu
 
+# Metrics which only depend on the xml, see utils/descriptor.py
+CACHED_METRICS = ["point_cloud", "geom_orientation", "hash"]
 
-def point_cloud_from_xml(path):
-    """Create point cloud from unimal xml path."""
-    unimal_id = fu.path2id(path)
-    root, tree = xu.etree_from_xml(path)
-    sim = mu.mjsim_from_etree(root)
-    sim.forward()
+# Cached metrics whose value depends on EVO.DESCRIPTOR_BACKEND
+BACKEND_METRICS = ["point_cloud", "geom_orientation"]
+
+# Max number of points for which check_all_pair_sim solves assignments
+# exactly in numpy, larger ones are solved by scipy. The subset dp grows as
+# n * 2^n, past 6 points scipy per pair is faster.
+EXACT_MATCH_MAX_POINTS = 6
+
+# Number of pairs whose cost matrices are computed at once
+MATCH_BATCH_SIZE = 4096
+
+
+def point_cloud_from_sim(sim):
     # Get sites which describe the limbs
     site_prefixes = ["limb/btm/", "torso", "limb/mid/"]
     sites = mu.names_from_prefixes(sim, site_prefixes, "site")
@@ -29,15 +43,23 @@ def point_cloud_from_xml(path):
         pos = [x, y, z]
         pos = [round(_, 2) for _ in pos]
         sparse_point_cloud.append(pos)
-    return [unimal_id, sparse_point_cloud]
+    return sparse_point_cloud
 
 
-def geom_orientations_from_xml(path):
-    """Create a list of geom orientations."""
+def point_cloud_from_xml(path, backend=None):
+    """Create point cloud from unimal xml path."""
+    if backend is None:
+        backend = cfg.EVO.DESCRIPTOR_BACKEND
     unimal_id = fu.path2id(path)
     root, tree = xu.etree_from_xml(path)
+    if backend == "kinematics":
+        return [unimal_id, kin.point_cloud(root)]
     sim = mu.mjsim_from_etree(root)
     sim.forward()
+    return [unimal_id, point_cloud_from_sim(sim)]
+
+
+def geom_orientations_from_sim(sim):
     limbs = mu.names_from_prefixes(sim, ["limb/"], "geom")
 
     limb_orientations = []
@@ -45,7 +67,20 @@ def geom_orientations_from_xml(path):
         geom_frame = sim.data.get_geom_xmat(limb_name).copy().ravel()
         limb_orientations.append(geom_frame)
 
-    return [unimal_id, limb_orientations]
+    return limb_orientations
+
+
+def geom_orientations_from_xml(path, backend=None):
+    """Create a list of geom orientations."""
+    if backend is None:
+        backend = cfg.EVO.DESCRIPTOR_BACKEND
+    unimal_id = fu.path2id(path)
+    root, tree = xu.etree_from_xml(path)
+    if backend == "kinematics":
+        return [unimal_id, kin.geom_orientations(root)]
+    sim = mu.mjsim_from_etree(root)
+    sim.forward()
+    return [unimal_id, geom_orientations_from_sim(sim)]
 
 
 def hash_from_xml(path):
@@ -72,47 +107,210 @@ def get_ancestor_from_xml(path):
     return [unimal_id, metadata["lineage"].split("/")[0]]
 
 
+METRIC_FNS = {
+    "point_cloud": point_cloud_from_xml,
+    "geom_orientation": geom_orientations_from_xml,
+    "ancestor": get_ancestor_from_xml,
+    "hash": hash_from_xml,
+}
+
+
+def get_cache_key(path, metric_name):
+    """Key of the descriptor of a unimal in the descriptor cache."""
+    backend = None
+    if metric_name in BACKEND_METRICS:
+        backend = cfg.EVO.DESCRIPTOR_BACKEND
+    return desc.xml_key(path, backend=backend)
+
+
+def get_cached_metric(paths, metric_name):
+    """Same as get_metric_in_parallel, metrics of unimals whose xml is in the
+    descriptor cache are read from it, the rest are computed and cached.
+    Array metrics are returned as np.ndarray either way.
+    """
+    caches = {}
+    data = {}
+    missing_paths = []
+    for path in paths:
+        cache_dir = desc.get_cache_dir(path)
+        if cache_dir not in caches:
+            caches[cache_dir] = desc.DescriptorCache(cache_dir, metric_name)
+        m = caches[cache_dir].get(get_cache_key(path, metric_name))
+        if m is None:
+            missing_paths.append(path)
+        else:
+            data[fu.path2id(path)] = m
+
+    computed = {}
+    if len(missing_paths) == 1:
+        # Not worth a pool, e.g a unimal saved before the cache existed.
+        computed = dict([METRIC_FNS[metric_name](missing_paths[0])])
+    elif len(missing_paths) > 1:
+        computed = _get_metric_in_parallel(missing_paths, metric_name)
+    for path in missing_paths:
+        m = desc.to_array(computed[fu.path2id(path)])
+        caches[desc.get_cache_dir(path)].put(get_cache_key(path, metric_name), m)
+        data[fu.path2id(path)] = m
+
+    return {fu.path2id(path): data[fu.path2id(path)] for path in paths}
+
+
+def get_metric(path, metric_name):
+    """Get similarity metric for a single unimal."""
+    if cfg.EVO.DESCRIPTOR_CACHE and metric_name in CACHED_METRICS:
+        return get_cached_metric([path], metric_name)[fu.path2id(path)]
+    return METRIC_FNS[metric_name](path)[1]
+
+
 def get_metric_in_parallel(paths, metric_name):
     """Get similarity metric for a list of unimals."""
-    p = Pool()
-    if metric_name == "point_cloud":
-        data = p.map(point_cloud_from_xml, paths)
-    elif metric_name == "geom_orientation":
-        data = p.map(geom_orientations_from_xml, paths)
-    elif metric_name == "ancestor":
-        data = p.map(get_ancestor_from_xml, paths)
-    elif metric_name == "hash":
-        data = p.map(hash_from_xml, paths)
-    else:
+    if cfg.EVO.DESCRIPTOR_CACHE and metric_name in CACHED_METRICS:
+        return get_cached_metric(paths, metric_name)
+    return _get_metric_in_parallel(paths, metric_name)
+
+
+def _get_metric_in_parallel(paths, metric_name):
+    if metric_name not in METRIC_FNS:
         raise ValueError("Metric {} not supported.".format(metric_name))
 
-    p.close()
-    p.join()
+    data = executor.map(METRIC_FNS[metric_name], paths)
     return {uid: m for uid, m in data}
 
 
+def get_match_eps(dim):
+    """Max assignment cost of the same morphology for a metric of dim."""
+    if dim == 9:
+        return 0.2
+    else:
+        return 1e-3
+
+
 def is_same_morphology(m1, m2):
     """Return True if unimals have same num_limbs and same metric for all limbs."""
     cost = cdist(m1, m2)
     row_ind, col_ind = linear_sum_assignment(cost)
     assignment_cost = cost[row_ind, col_ind].sum()
-    if len(m1[0]) == 9:
-        eps = 0.2
-    else:
-        eps = 1e-3
+    eps = get_match_eps(len(m1[0]))
     if assignment_cost < eps and len(m1) == len(m2):
         return True
     else:
         return False
 
 
+def get_candidate_pairs(unimal_m):
+    """Return the pairs of unimals which can pass is_same_morphology.
+
+    Unimals are bucketed by the number of points of their metric. Within a
+    bucket, the sum of the points of two matching unimals differs by at most
+    the assignment cost (triangle inequality), so only pairs with sums closer
+    than the eps of is_same_morphology are candidates. Pairs are found by
+    sweeping the sums sorted along their axis of largest spread.
+    """
+    buckets = defaultdict(list)
+    for uid, m in unimal_m.items():
+        buckets[len(m)].append(uid)
+
+    candidate_pairs = []
+    for num_points, uids in buckets.items():
+        if len(uids) < 2:
+            continue
+        if num_points == 0:
+            candidate_pairs.extend(itertools.combinations(uids, 2))
+            continue
+
+        sums = np.array([np.sum(unimal_m[uid], axis=0) for uid in uids])
+        # Slack for the rounding errors of the sums
+        eps = get_match_eps(sums.shape[1]) + 1e-6
+        axis = np.argmax(np.ptp(sums, axis=0))
+        order = np.argsort(sums[:, axis], kind="stable")
+        sorted_sums = sums[order]
+
+        for idx in range(len(order)):
+            other = idx + 1
+            while (
+                other < len(order)
+                and sorted_sums[other, axis] - sorted_sums[idx, axis] < eps
+            ):
+                if np.linalg.norm(sorted_sums[other] - sorted_sums[idx]) < eps:
+                    candidate_pairs.append((uids[order[idx]], uids[order[other]]))
+                other += 1
+
+    return candidate_pairs
+
+
+def get_equal_pairs(unimal_m):
+    """Return the pairs of unimals with equal metric, e.g hash or ancestor."""
+    groups = defaultdict(list)
+    for uid, m in unimal_m.items():
+        groups[m].append(uid)
+
+    equal_pairs = []
+    for uids in groups.values():
+        equal_pairs.extend(itertools.combinations(uids, 2))
+    return equal_pairs
+
+
+@functools.lru_cache(maxsize=None)
+def _masks_by_popcount(num_points):
+    masks = np.arange(2 ** num_points)
+    popcount = np.array([bin(mask).count("1") for mask in masks])
+    return [masks[popcount == k] for k in range(num_points + 1)]
+
+
+def min_assignment_costs(cost):
+    """Min cost of assigning rows to columns of each of the (P, n, n) cost
+    matrices. Exact dynamic programming over subsets of columns, batched
+    over the matrices, for n <= EXACT_MATCH_MAX_POINTS, scipy otherwise.
+    """
+    num_pairs, num_points = cost.shape[:2]
+    if num_points == 0:
+        return np.zeros(num_pairs)
+    if num_points > EXACT_MATCH_MAX_POINTS:
+        costs = []
+        for pair_cost in cost:
+            row_ind, col_ind = linear_sum_assignment(pair_cost)
+            costs.append(pair_cost[row_ind, col_ind].sum())
+        return np.array(costs)
+
+    # dp[:, mask]: min cost of assigning the first popcount(mask) rows to
+    # the columns in mask.
+    dp = np.full((num_pairs, 2 ** num_points), np.inf)
+    dp[:, 0] = 0.0
+    for row, masks in enumerate(_masks_by_popcount(num_points)[:-1]):
+        for col in range(num_points):
+            src = masks[(masks & (1 << col)) == 0]
+            dst = src | (1 << col)
+            dp[:, dst] = np.minimum(
+                dp[:, dst], dp[:, src] + cost[:, row, col, None]
+            )
+    return dp[:, -1]
+
+
+def batch_is_same_morphology(ms1, ms2):
+    """is_same_morphology for stacked metrics of shape (P, n, d)."""
+    ms1, ms2 = np.asarray(ms1, dtype=float), np.asarray(ms2, dtype=float)
+    if ms1.shape[1] == 0:
+        return np.ones(len(ms1), dtype=bool)
+    cost = np.linalg.norm(ms1[:, :, None, :] - ms2[:, None, :, :], axis=-1)
+    return min_assignment_costs(cost) < get_match_eps(ms1.shape[2])
+
+
 def check_all_pair_sim(all_pairs, unimal_m):
-    # Create all pairs metric
-    all_pairs_pc = [[unimal_m[u1], unimal_m[u2]] for u1, u2 in all_pairs]
-    p = Pool(int(multiprocessing.cpu_count() * 0.50))
-    data = p.starmap(is_same_morphology, all_pairs_pc)
-    p.close()
-    p.join()
+    # Pairs are matched in batches of pairs with the same number of points,
+    # unimals with a different number of points are never the same.
+    pairs_by_size = defaultdict(list)
+    for idx, (u1, u2) in enumerate(all_pairs):
+        if len(unimal_m[u1]) == len(unimal_m[u2]):
+            pairs_by_size[len(unimal_m[u1])].append(idx)
+
+    data = [False] * len(all_pairs)
+    for pair_idxs in pairs_by_size.values():
+        for start in range(0, len(pair_idxs), MATCH_BATCH_SIZE):
+            batch = pair_idxs[start : start + MATCH_BATCH_SIZE]
+            ms1 = [unimal_m[all_pairs[idx][0]] for idx in batch]
+            ms2 = [unimal_m[all_pairs[idx][1]] for idx in batch]
+            for idx, same in zip(batch, batch_is_same_morphology(ms1, ms2)):
+                data[idx] = bool(same)
     return data
 
 
@@ -136,10 +334,12 @@ def check_all_pair_same_individual(all_pairs, unimal_hash):
     return all_pairs_same_ind
 
 
-def create_graph(all_pairs, all_pairs_sim):
+def create_graph(all_pairs, all_pairs_sim, nodes=None):
     # Create graph with nodes as unimal ids and edges between
     # them if they have the same morphology
     G = nx.Graph()
+    if nodes is not None:
+        G.add_nodes_from(nodes)
     for pair, pair_sim in zip(all_pairs, all_pairs_sim):
         if not pair_sim:
             G.add_nodes_from(list(pair))
@@ -153,23 +353,23 @@ def create_graph(all_pairs, all_pairs_sim):
 def create_graph_from_xml_paths(xml_paths, metric_name, graph_type):
     # Create dict {uid: point_cloud}
     unimal_m = get_metric_in_parallel(xml_paths, metric_name)
-    # Create list of all unimal pairing
-    all_pairs = list(itertools.combinations(unimal_m.keys(), 2))
+    uids = list(unimal_m.keys())
 
     if graph_type == "individual":
-        all_pairs_sim = check_all_pair_same_individual(all_pairs, unimal_m)
-        return create_graph(all_pairs, all_pairs_sim)
+        all_pairs = get_equal_pairs(unimal_m)
+        return create_graph(all_pairs, [True] * len(all_pairs), nodes=uids)
 
-    # Check if two unimals have the same morphology
+    # Check if two unimals have the same morphology, only for the pairs which
+    # can match instead of all pairs.
+    all_pairs = get_candidate_pairs(unimal_m)
     all_pairs_sim = check_all_pair_sim(all_pairs, unimal_m)
     if graph_type == "family":
         unimal_ancestor = get_metric_in_parallel(xml_paths, "ancestor")
-        all_pairs_sim_a = check_all_pair_ancestry(all_pairs, unimal_ancestor)
-        all_pairs_sim = [
-            s1 or s2 for s1, s2 in zip(all_pairs_sim, all_pairs_sim_a)
-        ]
+        ancestor_pairs = get_equal_pairs(unimal_ancestor)
+        all_pairs = all_pairs + ancestor_pairs
+        all_pairs_sim = all_pairs_sim + [True] * len(ancestor_pairs)
 
-    return create_graph(all_pairs, all_pairs_sim)
+    return create_graph(all_pairs, all_pairs_sim, nodes=uids)
 
 
 def create_graph_from_uids(
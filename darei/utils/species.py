@@ -0,0 +1,166 @@
+"""Incremental species index of the evaluated unimals.
+
+Two unimals are of the same species if they are connected in the graph of
+create_graph_from_xml_paths(..., graph_type="species"). Instead of
+rebuilding that graph, each unimal is inserted into a union-find by
+matching it only against the candidates of similarity.get_candidate_pairs,
+i.e unimals with the same number of points whose sum of points is close.
+
+The descriptor (similarity metric) of every saved unimal is appended to
+OUT_DIR/species/<metric>.jsonl, from which an index is built or refreshed
+in any process, during evolution or on a finished run.
+"""
+
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from darei.config import cfg
+from darei.utils import file as fu
+from darei.utils import similarity as simu
+
+METRICS = ["point_cloud", "geom_orientation"]
+
+
+class SpeciesIndex:
+    """Union-find over unimals, joined if they have the same morphology."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._offset = 0
+        self._parent = {}
+        self._size = {}
+        self._descriptors = {}
+        # Number of points => (uids, sums of points)
+        self._buckets = defaultdict(lambda: ([], []))
+
+    def __len__(self):
+        return len(self._parent)
+
+    def __contains__(self, unimal_id):
+        return unimal_id in self._parent
+
+    def find(self, unimal_id):
+        root = unimal_id
+        while self._parent[root] != root:
+            root = self._parent[root]
+        # Path compression
+        while self._parent[unimal_id] != root:
+            self._parent[unimal_id], unimal_id = root, self._parent[unimal_id]
+        return root
+
+    def _union(self, uid1, uid2):
+        root1, root2 = self.find(uid1), self.find(uid2)
+        if root1 == root2:
+            return
+        if self._size[root1] < self._size[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._size[root1] += self._size[root2]
+
+    def _get_candidates(self, m):
+        uids, sums = self._buckets[len(m)]
+        if len(uids) == 0 or len(m) == 0:
+            return list(uids)
+        m_sum = np.sum(m, axis=0)
+        eps = simu.get_match_eps(len(m_sum)) + 1e-6
+        dist = np.linalg.norm(np.asarray(sums) - m_sum, axis=1)
+        return [uids[idx] for idx in np.flatnonzero(dist < eps)]
+
+    def insert(self, unimal_id, m):
+        """Add a unimal with descriptor m, return its species id."""
+        if unimal_id in self._parent:
+            return self.find(unimal_id)
+
+        self._parent[unimal_id] = unimal_id
+        self._size[unimal_id] = 1
+        self._descriptors[unimal_id] = m
+        for other in self._get_candidates(m):
+            if self.find(other) == self.find(unimal_id):
+                continue
+            if len(m) == 0 or simu.is_same_morphology(m, self._descriptors[other]):
+                self._union(unimal_id, other)
+
+        uids, sums = self._buckets[len(m)]
+        uids.append(unimal_id)
+        sums.append(np.sum(m, axis=0) if len(m) > 0 else np.zeros(0))
+        return self.find(unimal_id)
+
+    def get_species_id(self, unimal_id):
+        return self.find(unimal_id)
+
+    def get_cluster_size(self, unimal_id):
+        return self._size[self.find(unimal_id)]
+
+    def get_species(self):
+        """Return {species id: [unimal ids]}."""
+        species = defaultdict(list)
+        for unimal_id in self._parent:
+            species[self.find(unimal_id)].append(unimal_id)
+        return dict(species)
+
+    def num_species(self):
+        return sum(1 for uid, parent in self._parent.items() if uid == parent)
+
+    def refresh(self):
+        """Insert the unimals recorded in path since the last refresh."""
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+
+        num_inserted = 0
+        with open(self.path, "r") as f:
+            f.seek(self._offset)
+            for line in iter(f.readline, ""):
+                # Partially written line, read it on the next refresh
+                if not line.endswith("\n"):
+                    break
+                self._offset = f.tell()
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self.insert(record["id"], record["m"])
+                num_inserted += 1
+        return num_inserted
+
+
+def get_index_path(config=None):
+    if config is None:
+        config = cfg
+    return os.path.join(
+        fu.get_subfolder("species", config=config),
+        "{}.jsonl".format(config.EVO.SPECIES_METRIC),
+    )
+
+
+def add_descriptors(descriptors, config=None):
+    """Append {unimal id: descriptor} to the index file."""
+    if config is None:
+        config = cfg
+
+    lines = "".join(
+        json.dumps({"id": unimal_id, "m": np.asarray(m).tolist()}) + "\n"
+        for unimal_id, m in descriptors.items()
+    )
+    fu.append_lines(get_index_path(config=config), lines)
+
+
+def record(unimal_id, config=None):
+    """Add the descriptor of a saved unimal to the index file."""
+    if config is None:
+        config = cfg
+
+    m = simu.get_metric(
+        fu.id2path(unimal_id, "xml", config=config), config.EVO.SPECIES_METRIC
+    )
+    add_descriptors({unimal_id: m}, config=config)
+
+
+def load_index(config=None):
+    """Return the index of all unimals recorded so far, call refresh() on it
+    to add unimals recorded later.
+    """
+    index = SpeciesIndex(path=get_index_path(config=config))
+    index.refresh()
+    return index
@@ -0,0 +1,253 @@
+"""SQLite index of the population.
+
+Metadata json files are still written for every trained unimal, the store
+mirrors them so that parent selection, population counting and completion
+checks do not have to list and parse the metadata folders.
+"""
+
+import json
+import os
+import sqlite3
+
+from darei.config import cfg
+from darei.utils import file as fu
+
+# Name of the database file in OUT_DIR
+DB_NAME = "population.db"
+
+# Status of a unimal in the store. Removed unimals were trained but killed
+# by vanilla tournament selection.
+DONE = "done"
+ERROR = "error"
+REMOVED = "removed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS population (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    status TEXT NOT NULL,
+    reward REAL,
+    lineage TEXT,
+    parent_id TEXT,
+    train_time REAL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS population_status_seq
+    ON population (status, seq);
+CREATE INDEX IF NOT EXISTS population_status_reward
+    ON population (status, reward);
+"""
+
+# Stores are opened once per process, connections can not be shared across
+# fork.
+_stores = {}
+
+
+def get_store(config=None):
+    """Return the population store of the run, None if it is disabled."""
+    if config is None:
+        config = cfg
+
+    if not config.EVO.USE_POPULATION_STORE:
+        return None
+
+    # WAL keeps its index in shared memory, which other nodes do not see.
+    assert config.EVO.POPULATION_STORE_JOURNAL != "wal" or config.NUM_NODES == 1, \
+        "EVO.POPULATION_STORE_JOURNAL wal needs NUM_NODES == 1"
+    path = os.path.join(config.OUT_DIR, DB_NAME)
+    key = (path, os.getpid())
+    if key not in _stores:
+        _stores[key] = PopulationStore(
+            path, journal_mode=config.EVO.POPULATION_STORE_JOURNAL
+        )
+    return _stores[key]
+
+
+class PopulationStore:
+    def __init__(self, path, journal_mode="delete", timeout=60):
+        self.path = path
+        # Autocommit, every write below is a single statement transaction.
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode={}".format(journal_mode))
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, metadata, parent_id=None):
+        """Record a trained unimal, metadata is the content of its json."""
+        if parent_id == "None":
+            parent_id = None
+        self.conn.execute(
+            """
+            INSERT INTO population
+                (id, status, reward, lineage, parent_id, train_time, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                status = excluded.status,
+                reward = excluded.reward,
+                lineage = excluded.lineage,
+                parent_id = excluded.parent_id,
+                train_time = excluded.train_time,
+                metadata = excluded.metadata
+            """,
+            (
+                metadata["id"],
+                DONE,
+                float(metadata["reward"]),
+                metadata["lineage"],
+                parent_id,
+                metadata.get("train_time"),
+                json.dumps(metadata),
+            ),
+        )
+
+    def add_error(self, unimal_id):
+        """Record a unimal whose training failed."""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO population (id, status) VALUES (?, ?)",
+            (unimal_id, ERROR),
+        )
+
+    def remove(self, unimal_id):
+        """Mark a unimal as no longer part of the population."""
+        self.conn.execute(
+            "UPDATE population SET status = ? WHERE id = ? AND status = ?",
+            (REMOVED, unimal_id, DONE),
+        )
+
+    def is_finished(self, unimal_id):
+        """Return True if the unimal was trained or failed training."""
+        row = self.conn.execute(
+            "SELECT 1 FROM population WHERE id = ?", (unimal_id,)
+        ).fetchone()
+        return row is not None
+
+    def get_finished_ids(self):
+        """Return ids of all unimals which were trained or failed training."""
+        rows = self.conn.execute("SELECT id FROM population").fetchall()
+        return {row[0] for row in rows}
+
+    def get(self, unimal_id):
+        """Return the metadata of a trained unimal, None if not present."""
+        row = self.conn.execute(
+            "SELECT metadata FROM population WHERE id = ? AND metadata IS NOT NULL",
+            (unimal_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def size(self):
+        """Return the current population size."""
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM population WHERE status = ?", (DONE,)
+        ).fetchone()
+        return row[0]
+
+    def get_seqs(self, offset=0, limit=-1):
+        """Return creation sequence numbers of the population, oldest first.
+
+        offset skips the oldest unimals, i.e the ones outside the aging window.
+        """
+        rows = self.conn.execute(
+            """
+            SELECT seq FROM population WHERE status = ?
+            ORDER BY seq LIMIT ? OFFSET ?
+            """,
+            (DONE, limit, offset),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_since(self, seq):
+        """Return (seq, metadata) of the population added after seq, oldest
+        first.
+        """
+        rows = self.conn.execute(
+            """
+            SELECT seq, metadata FROM population WHERE status = ? AND seq > ?
+            ORDER BY seq
+            """,
+            (DONE, seq),
+        ).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def get_by_seqs(self, seqs):
+        """Return metadata for each seq in seqs, repeated seqs are allowed."""
+        if len(seqs) == 0:
+            return []
+        unique_seqs = list(set(seqs))
+        rows = self.conn.execute(
+            "SELECT seq, metadata FROM population WHERE seq IN ({})".format(
+                ",".join("?" * len(unique_seqs))
+            ),
+            unique_seqs,
+        ).fetchall()
+        metadatas = {seq: json.loads(m) for seq, m in rows}
+        return [metadatas[seq] for seq in seqs]
+
+    def top_k(self, k):
+        """Return metadata of the k unimals with highest reward."""
+        rows = self.conn.execute(
+            """
+            SELECT metadata FROM population WHERE status = ?
+            ORDER BY reward DESC LIMIT ?
+            """,
+            (DONE, k),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def import_run(self, out_dir):
+        """Add unimals of an existing run directory which are not in the store.
+
+        Trained unimals are added in the order of their metadata mtime, which
+        is the order aging tournament used. Returns number of unimals added.
+        """
+        num_before = self.conn.execute(
+            "SELECT COUNT(*) FROM population"
+        ).fetchone()[0]
+
+        metadata_paths = fu.get_files(
+            os.path.join(out_dir, "metadata"), ".*json", sort=True,
+            sort_type="time"
+        )
+        rows = []
+        for path in metadata_paths:
+            metadata = fu.load_json(path)
+            lineage = metadata["lineage"].split("/")
+            parent_id = lineage[-2] if len(lineage) > 1 else None
+            rows.append(
+                (
+                    metadata["id"],
+                    DONE,
+                    float(metadata["reward"]),
+                    metadata["lineage"],
+                    parent_id,
+                    metadata.get("train_time"),
+                    json.dumps(metadata),
+                )
+            )
+
+        error_paths = fu.get_files(os.path.join(out_dir, "error_metadata"), ".*json")
+        error_rows = [(fu.path2id(path), ERROR) for path in error_paths]
+
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                """
+                INSERT OR IGNORE INTO population
+                    (id, status, reward, lineage, parent_id, train_time, metadata)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO population (id, status) VALUES (?, ?)",
+                error_rows,
+            )
+
+        num_after = self.conn.execute(
+            "SELECT COUNT(*) FROM population"
+        ).fetchone()[0]
+        return num_after - num_before
@@ -0,0 +1,96 @@
+"""Most recent members of the population for aging tournaments.
+
+AgingWindow is a ring buffer of the metadata of the last `capacity` unimals
+of the population store and of their selection criteria. refresh() adds the
+unimals stored since the last refresh, so only the first refresh of a
+process reads the whole population, and sampling participants is
+O(participants).
+"""
+
+import random
+
+import numpy as np
+
+from darei.config import cfg
+from darei.utils import store as pstore
+
+
+class AgingWindow:
+    def __init__(self, capacity, criteria):
+        self.capacity = capacity
+        self.criteria = list(criteria)
+        self.metadatas = np.empty(capacity, dtype=object)
+        # Selection criteria of each member, nan if missing in its metadata
+        self.rewards = np.full((capacity, len(self.criteria)), np.nan)
+        # Number of members added so far, i.e position of the next member in
+        # the population.
+        self.count = 0
+        self.last_seq = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def add(self, metadata):
+        idx = self.count % self.capacity
+        self.metadatas[idx] = metadata
+        self.rewards[idx] = [
+            float(metadata.get(key, np.nan)) for key in self.criteria
+        ]
+        self.count += 1
+
+    def refresh(self, store):
+        for seq, metadata in store.get_since(self.last_seq):
+            self.add(metadata)
+            self.last_seq = seq
+
+    def _num_members(self, offset):
+        """Number of members at position >= offset which are in the window."""
+        return max(0, min(len(self), self.count - offset))
+
+    def _ring_indices(self, positions):
+        return np.asarray(positions, dtype=np.int64) % self.capacity
+
+    def sample(self, offset, k):
+        """Return metadata of k members at position >= offset, with
+        replacement.
+        """
+        num_members = self._num_members(offset)
+        positions = [
+            self.count - num_members + idx
+            for idx in random.choices(range(num_members), k=k)
+        ]
+        return list(self.metadatas[self._ring_indices(positions)])
+
+    def get(self, offset):
+        """Return metadata and criteria of all members at position >= offset."""
+        num_members = self._num_members(offset)
+        idxs = self._ring_indices(
+            np.arange(self.count - num_members, self.count)
+        )
+        return list(self.metadatas[idxs]), self.rewards[idxs]
+
+
+_window = None
+_window_store = None
+
+
+def get_window():
+    """Return the aging window of the population store, refreshed. None if
+    the store is disabled.
+    """
+    global _window, _window_store
+
+    store = pstore.get_store()
+    if store is None:
+        return None
+    if _window is None or _window_store is not store:
+        # Aging tournaments sample from up to INIT_POPULATION_SIZE +
+        # NUM_TOURNAMENTS_PER_GEN recent unimals.
+        capacity = max(
+            cfg.EVO.AGING_WINDOW_SIZE,
+            cfg.EVO.INIT_POPULATION_SIZE + cfg.EVO.NUM_TOURNAMENTS_PER_GEN,
+        )
+        _window = AgingWindow(capacity, cfg.EVO.SELECTION_CRITERIA)
+        _window_store = store
+    _window.refresh(store)
+    return _window
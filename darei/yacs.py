@@ -70,6 +70,7 @@ class CfgNode(dict):
     DEPRECATED_KEYS = "__deprecated_keys__"
     RENAMED_KEYS = "__renamed_keys__"
     NEW_ALLOWED = "__new_allowed__"
+    VERSION = "__version__"
 
     def __init__(self, init_dict=None, key_list=None, new_allowed=False):
         """
@@ -108,6 +109,9 @@ class CfgNode(dict):
         # Allow new attributes after initialisation
         self.__dict__[CfgNode.NEW_ALLOWED] = new_allowed
 
+        # Number of values set since initialisation, see version
+        self.__dict__[CfgNode.VERSION] = 0
+
     @classmethod
     def _create_config_tree_from_dict(cls, dic, key_list):
         """
@@ -161,6 +165,11 @@ class CfgNode(dict):
 
         self[name] = value
 
+    def __setitem__(self, key, value):
+        super(CfgNode, self).__setitem__(key, value)
+        # Copies are filled item by item before their state may be set.
+        self.__dict__[CfgNode.VERSION] = self.__dict__.get(CfgNode.VERSION, 0) + 1
+
     def __str__(self):
         def _indent(s_, num_spaces):
             s = s_.split("\n")
@@ -270,6 +279,15 @@ class CfgNode(dict):
             if isinstance(v, CfgNode):
                 v._immutable(is_immutable)
 
+    def version(self):
+        """Return the number of values set in this CfgNode and its children.
+        It changes whenever the config does, which is cheaper to check than
+        comparing dumps. Lists mutated in place are not counted.
+        """
+        return self.__dict__.get(CfgNode.VERSION, 0) + sum(
+            v.version() for v in self.values() if isinstance(v, CfgNode)
+        )
+
     def clone(self):
         """Recursively copy this CfgNode."""
         return copy.deepcopy(self)
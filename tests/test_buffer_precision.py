@@ -0,0 +1,159 @@
+import math
+
+import pytest
+
+# The scripted kernels live in the Unimal task, which imports isaacgym
+# before torch.
+pytest.importorskip("isaacgym")
+
+import torch
+
+from darei.tasks.base.vec_task import BUFFER_PRECISIONS
+from darei.tasks.unimal import (
+    compute_unimal_observations,
+    compute_unimal_observations_and_reward,
+    compute_unimal_reward,
+)
+from darei.tasks.unimal_kernels import OBS_KERNELS, ObservationWriter, get_section_views
+from darei.tools.bench_unimal_kernels import ANGLE_SECTIONS, REWARD_PARAMS, random_state
+from darei.utils import observation as obsu
+
+DT = 0.0166
+NUM_ENVS, NUM_DOFS, NUM_SENSORS = 4096, 12, 13
+
+# Max abs difference of the float32 observations of the kernels
+ATOL = 1e-4
+
+# Max mean abs error of the rewards of each reduced precision. Rewards read
+# the torso height from obs_buf, envs whose height rounds across the
+# termination height get the death cost instead.
+REWARD_TOLERANCE = {"float16": 1e-2, "bfloat16": 5e-2}
+
+# Max fraction of envs whose reset differs
+RESET_TOLERANCE = 0.01
+
+
+def compute_reward(obs_buf, state, potentials, prev_potentials, observation_space_map):
+    cum = {}
+    start = 0
+    for section, size in observation_space_map.items():
+        cum[section] = (start, start + size)
+        start += size
+    params = REWARD_PARAMS
+    return compute_unimal_reward(
+        obs_buf, state["reset_buf"], state["progress_buf"], state["actions"],
+        params["up_weight"], params["heading_weight"], potentials, prev_potentials,
+        params["actions_cost_scale"], params["energy_cost_scale"],
+        params["joints_at_limit_cost_scale"], params["termination_height"],
+        params["death_cost"], params["max_episode_length"],
+        cum["dof_meas_vel"], cum["dof_meas_pos"]
+    )
+
+
+def compute_jit(state, dt, obs_dtype, flag_dtype, observation_space_map):
+    """obs_buf, reward and resets of obsKernel jit, obs_buf in obs_dtype."""
+    obs, potentials, prev_potentials, _, _ = compute_unimal_observations(
+        torch.zeros(0), state["root_states"], state["targets"], state["potentials"],
+        state["inv_start_rot"], state["dof_pos"], state["dof_vel"],
+        state["dof_limits_lower"], state["dof_limits_upper"], 0.2,
+        state["basis_vec0"], state["basis_vec1"], 2,
+        state["sensors"], state["actions"], dt, 0.1, state["sensors"].shape[1]
+    )
+    # As in the task: obs_buf in obs_dtype, rewards computed from it.
+    obs_buf = obs.to(obs_dtype)
+    state_flags = dict(state, reset_buf=state["reset_buf"].to(flag_dtype))
+    reward, reset = compute_reward(
+        obs_buf, state_flags, potentials, prev_potentials, observation_space_map
+    )
+    return obs_buf, reward, reset
+
+
+def compute_inplace(state, dt, obs_dtype, flag_dtype, observation_space_map):
+    """obs_buf, reward and resets of obsKernel inplace, obs_buf in obs_dtype."""
+    num_envs = state["root_states"].shape[0]
+    num_obs = sum(observation_space_map.values())
+    obs_buf = torch.zeros(num_envs, num_obs, dtype=obs_dtype)
+    potentials = state["potentials"].clone()
+    prev_potentials = torch.zeros_like(potentials)
+    ObservationWriter(obs_buf, observation_space_map).write(
+        state["root_states"], state["targets"], potentials, prev_potentials,
+        state["inv_start_rot"], state["dof_pos"], state["dof_vel"],
+        state["dof_limits_lower"], state["dof_limits_upper"], 0.2,
+        state["basis_vec0"], state["basis_vec1"], 2,
+        state["sensors"], state["actions"], dt, 0.1, state["sensors"].shape[1],
+        torch.zeros_like(state["basis_vec1"]), torch.zeros_like(state["basis_vec0"])
+    )
+    state_flags = dict(state, reset_buf=state["reset_buf"].to(flag_dtype))
+    reward, reset = compute_reward(
+        obs_buf, state_flags, potentials, prev_potentials, observation_space_map
+    )
+    return obs_buf, reward, reset
+
+
+def compute_fused(state, dt, obs_dtype, flag_dtype, observation_space_map):
+    """obs_buf, reward and resets of obsKernel fused, obs_buf in obs_dtype."""
+    num_envs = state["root_states"].shape[0]
+    num_obs = sum(observation_space_map.values())
+    obs_buf = torch.zeros(num_envs, num_obs, dtype=obs_dtype)
+    params = REWARD_PARAMS
+    obs, _, _, _, _, reward, reset, _ = compute_unimal_observations_and_reward(
+        obs_buf, state["root_states"], state["targets"], state["potentials"],
+        state["inv_start_rot"], state["dof_pos"], state["dof_vel"],
+        state["dof_limits_lower"], state["dof_limits_upper"], 0.2,
+        state["basis_vec0"], state["basis_vec1"], 2,
+        state["sensors"], state["actions"], dt, 0.1, state["sensors"].shape[1],
+        state["reset_buf"].to(flag_dtype), state["progress_buf"],
+        params["up_weight"], params["heading_weight"],
+        params["actions_cost_scale"], params["energy_cost_scale"],
+        params["joints_at_limit_cost_scale"], params["termination_height"],
+        params["death_cost"], params["max_episode_length"]
+    )
+    # Same cast as the assignment in Unimal.compute_observations_and_reward
+    obs_buf[:] = obs
+    return obs_buf, reward, reset
+
+
+KERNEL_FNS = {
+    "jit": compute_jit,
+    "inplace": compute_inplace,
+    "fused": compute_fused,
+}
+
+
+@pytest.fixture(scope="module")
+def reference():
+    """State and float32 jit obs_buf, reward and resets."""
+    torch.manual_seed(0)
+    observation_space_map = obsu.get_observation_space_map(NUM_DOFS, NUM_SENSORS)
+    state = random_state(NUM_ENVS, NUM_DOFS, NUM_SENSORS)
+    # Torso heights around the termination height, so resets are checked.
+    state["root_states"][:, 2] = REWARD_PARAMS["termination_height"] + \
+        0.1 * torch.randn(NUM_ENVS)
+    outputs = compute_jit(state, DT, torch.float, torch.long, observation_space_map)
+    return state, observation_space_map, outputs
+
+
+@pytest.mark.parametrize("kernel", OBS_KERNELS)
+@pytest.mark.parametrize("precision", ["float16", "bfloat16"])
+def test_reduced_precision_accuracy(reference, precision, kernel):
+    state, observation_space_map, (obs, reward, reset) = reference
+    obs_dtype, flag_dtype = BUFFER_PRECISIONS[precision]
+    obs_buf, reduced_reward, reduced_reset = KERNEL_FNS[kernel](
+        state, DT, obs_dtype, flag_dtype, observation_space_map
+    )
+
+    # Observations are computed in float32 and rounded once to obs_dtype.
+    eps = torch.finfo(obs_dtype).eps
+    views = get_section_views(obs, observation_space_map)
+    reduced_views = get_section_views(obs_buf.float(), observation_space_map)
+    for section in observation_space_map:
+        error = (views[section] - reduced_views[section]).abs()
+        if section in ANGLE_SECTIONS:
+            error = torch.minimum(error, 2 * math.pi - error)
+        assert torch.all(error <= eps * views[section].abs() + ATOL), section
+
+    reward_error = (reward - reduced_reward.float()).abs()
+    assert reward_error.mean().item() <= REWARD_TOLERANCE[precision]
+
+    reset_mismatches = (reset != reduced_reset.long()).sum().item()
+    assert reset_mismatches <= RESET_TOLERANCE * NUM_ENVS
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+pytest.importorskip("mujoco_py")
+
+from darei.config import cfg
+from darei.utils import dedup
+from darei.utils import evo as eu
+from darei.utils import store as pstore
+
+
+def make_metadata(unimal_id, metrics, lineage, train_time, duplicate_of=None):
+    # Same keys as agent.save_metadata
+    metadata = dict(metrics)
+    metadata["id"] = unimal_id
+    metadata["train_time"] = train_time
+    if duplicate_of is not None:
+        metadata["duplicate_of"] = duplicate_of
+    metadata["lineage"] = lineage
+    return metadata
+
+
+@pytest.mark.parametrize("use_store", [False, True])
+@pytest.mark.parametrize("tournament_type", ["aging_num", "aging_nsga_num", "vanilla_num"])
+def test_duplicate_child_is_selectable(tmp_path, monkeypatch, use_store, tournament_type):
+    monkeypatch.setattr(cfg, "OUT_DIR", str(tmp_path))
+    monkeypatch.setattr(cfg.EVO, "USE_POPULATION_STORE", use_store)
+    monkeypatch.setattr(cfg.EVO, "POPULATION_STORE_JOURNAL", "delete")
+    monkeypatch.setattr(cfg.EVO, "TOURNAMENT_TYPE", tournament_type)
+    monkeypatch.setattr(cfg.EVO, "NUM_PARTICIPANTS", 8)
+    (tmp_path / "metadata").mkdir()
+
+    metadatas = [
+        make_metadata(
+            "0-0-{}".format(idx),
+            {"reward": 10.0 * idx, "__reward__forward": 5.0 * idx,
+             "__reward__stand": 3.0 - idx, "frames": 1000},
+            "0-0-{}".format(idx), 100.0,
+        )
+        for idx in range(3)
+    ]
+    original = metadatas[-1]
+    metadatas.append(make_metadata(
+        "0-1-0", dedup.get_metrics(original), "{}/0-1-0".format(original["id"]),
+        0, duplicate_of=original["id"],
+    ))
+    for key in cfg.EVO.SELECTION_CRITERIA:
+        assert metadatas[-1][key] == original[key]
+
+    store = pstore.get_store()
+    for metadata in metadatas:
+        with open(tmp_path / "metadata" / "{}.json".format(metadata["id"]), "w") as f:
+            json.dump(metadata, f)
+        if store is not None:
+            store.add(metadata)
+
+    ids = {metadata["id"] for metadata in metadatas}
+    for _ in range(3):
+        assert eu.select_parent(0)["id"] in ids
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from darei.utils import descriptor as desc
+
+UNIMAL_XML = """<mujoco>
+<worldbody>
+<body name="torso/0" pos="0 0 1">
+  <geom name="torso/0" type="sphere" size="0.1"/>
+  <site name="torso/touch/0" pos="0 0 0"/>
+  <body name="limb/1" pos="0 0 0">
+    <joint name="limbx/1" type="hinge"/>
+    <geom name="limb/1" type="capsule" fromto="0 0 0 0 0 -0.5" size="0.05"/>
+    <site name="limb/touch/1" pos="0 0 -0.25"/>
+  </body>
+</body>
+</worldbody>
+<contact><exclude body1="torso/0" body2="limb/1"/></contact>
+</mujoco>
+"""
+
+
+@pytest.fixture
+def xml_path(tmp_path):
+    (tmp_path / "xml").mkdir()
+    path = tmp_path / "xml" / "0-0-0.xml"
+    path.write_text(UNIMAL_XML)
+    return str(path)
+
+
+def test_cache_round_trip(tmp_path):
+    cache = desc.DescriptorCache(str(tmp_path), "point_cloud")
+    cache.put("a", [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    cache.put("b", [])
+    cache.put("c", "hash")
+
+    reader = desc.DescriptorCache(str(tmp_path), "point_cloud")
+    assert np.array_equal(reader.get("a"), [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    assert reader.get("b").shape == (0, 0)
+    assert reader.get("c") == "hash"
+    assert reader.get("d") is None
+
+
+def test_xml_key_depends_on_backend(xml_path):
+    assert desc.xml_key(xml_path) != desc.xml_key(xml_path, backend="kinematics")
+    assert desc.xml_key(xml_path, backend="mujoco") != \
+        desc.xml_key(xml_path, backend="kinematics")
+
+
+def test_cached_metric_is_array(xml_path, monkeypatch):
+    pytest.importorskip("mujoco_py")
+    from darei.config import cfg
+    from darei.utils import similarity as simu
+
+    monkeypatch.setattr(cfg.EVO, "DESCRIPTOR_BACKEND", "kinematics")
+    computed = simu.get_cached_metric([xml_path], "point_cloud")["0-0-0"]
+    cached = simu.get_cached_metric([xml_path], "point_cloud")["0-0-0"]
+    assert isinstance(computed, np.ndarray)
+    assert isinstance(cached, np.ndarray)
+    assert np.array_equal(computed, cached)
+    assert isinstance(simu.get_cached_metric([xml_path], "hash")["0-0-0"], str)
+
+    # Descriptors of another backend are not read from the cache.
+    monkeypatch.setattr(cfg.EVO, "DESCRIPTOR_BACKEND", "mujoco")
+    cache = desc.DescriptorCache(desc.get_cache_dir(xml_path), "point_cloud")
+    assert cache.get(simu.get_cache_key(xml_path, "point_cloud")) is None
@@ -0,0 +1,35 @@
+from darei.config import cfg
+from darei.utils import executor
+
+
+def get_cfg_value(key):
+    node = cfg
+    for subkey in key.split("."):
+        node = node[subkey]
+    return node
+
+
+def test_cfg_version_counts_changes(monkeypatch):
+    version = cfg.version()
+    # Copies, such as those passed to utils/file.py, leave cfg unchanged.
+    cfg.clone()
+    assert cfg.version() == version
+    monkeypatch.setattr(cfg.EVO, "NUM_CPU_PROCESSES", 3)
+    assert cfg.version() > version
+
+
+def test_pool_is_restarted_when_cfg_changes(monkeypatch):
+    monkeypatch.setattr(cfg.EVO, "NUM_CPU_PROCESSES", 1)
+    monkeypatch.setattr(cfg.EVO, "EXECUTOR_PRELOAD", [])
+    monkeypatch.setattr(cfg, "OUT_DIR", "first")
+    try:
+        pool = executor.get_pool()
+        assert executor.get_pool() is pool
+        assert executor.map(get_cfg_value, ["OUT_DIR"]) == ["first"]
+
+        # Spawned workers only see the config they were started with.
+        monkeypatch.setattr(cfg, "OUT_DIR", "second")
+        assert executor.get_pool() is not pool
+        assert executor.map(get_cfg_value, ["OUT_DIR"]) == ["second"]
+    finally:
+        executor.shutdown()
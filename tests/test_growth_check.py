@@ -0,0 +1,36 @@
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip("mujoco_py")
+
+from darei.config import cfg
+from darei.envs.morphology import SymmetricUnimal
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_analytic_growth_check_matches_mujoco(monkeypatch, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    monkeypatch.setattr(cfg.BODY, "GROWTH_CHECK", "analytic")
+    monkeypatch.setattr(cfg.BODY, "GROWTH_CHECK_CONFIRM", False)
+
+    # (analytic accepts, mujoco accepts) of every grow_limb attempt. Growth
+    # follows the mujoco check, as with BODY.GROWTH_CHECK mujoco.
+    verdicts = []
+    new_contacts_analytic = SymmetricUnimal._new_contacts_analytic
+
+    def check_both(self, capsules, limbs, exclude_geom_pairs):
+        analytic = new_contacts_analytic(self, capsules, limbs, exclude_geom_pairs)
+        mujoco = self._new_contacts_mujoco(exclude_geom_pairs)
+        verdicts.append((analytic is not None, mujoco is not None))
+        return mujoco
+
+    monkeypatch.setattr(SymmetricUnimal, "_new_contacts_analytic", check_both)
+    unimal = SymmetricUnimal("0-0-{}".format(seed))
+    for _ in range(6):
+        unimal.grow_limb()
+
+    assert len(verdicts) > 0
+    assert verdicts == [(mujoco, mujoco) for _, mujoco in verdicts]
@@ -0,0 +1,16 @@
+from darei.utils import store as pstore
+
+
+def make_store(tmp_path):
+    return pstore.PopulationStore(str(tmp_path / pstore.DB_NAME))
+
+
+def test_get_by_seqs(tmp_path):
+    store = make_store(tmp_path)
+    for idx in range(3):
+        store.add({"id": "0-0-{}".format(idx), "reward": float(idx), "lineage": "0-0-{}".format(idx)})
+    seqs = store.get_seqs()
+    assert [m["id"] for m in store.get_by_seqs([seqs[2], seqs[0], seqs[2]])] == \
+        ["0-0-2", "0-0-0", "0-0-2"]
+    assert store.get_by_seqs([]) == []
+    store.close()
@@ -0,0 +1,162 @@
+import pytest
+
+# The scripted kernels live in the Unimal task, which imports isaacgym
+# before torch.
+pytest.importorskip("isaacgym")
+
+import torch
+
+from darei.tasks.base.vec_task import VecTask
+from darei.tasks.unimal import (
+    Unimal,
+    compute_unimal_observations,
+    compute_unimal_observations_and_reward,
+    compute_unimal_reward,
+)
+from darei.tools.bench_unimal_kernels import (
+    REWARD_PARAMS,
+    make_inplace_step,
+    make_jit_step,
+    max_difference,
+    random_state,
+)
+from darei.utils import observation as obsu
+
+DT = 0.0166
+ATOL = 1e-4
+
+# (num_envs, num_dofs, num_sensors), small enough for a quick CPU run
+SIZES = [(64, 12, 13), (32, 4, 0), (1, 1, 1)]
+
+
+@pytest.mark.parametrize("num_envs,num_dofs,num_sensors", SIZES)
+def test_inplace_observations_match_jit(num_envs, num_dofs, num_sensors):
+    torch.manual_seed(0)
+    observation_space_map = obsu.get_observation_space_map(num_dofs, num_sensors)
+    num_obs = sum(observation_space_map.values())
+    state = random_state(num_envs, num_dofs, num_sensors)
+    jit_obs = torch.zeros(num_envs, num_obs)
+    inplace_obs = torch.zeros(num_envs, num_obs)
+    jit_step = make_jit_step(state, jit_obs, DT)
+    inplace_step = make_inplace_step(state, inplace_obs, DT, observation_space_map)
+
+    # The second step reuses the scratch buffers of the writer.
+    for _ in range(2):
+        jit_step()
+        inplace_step()
+        assert max_difference(jit_obs, inplace_obs, observation_space_map) <= ATOL
+
+
+class TaskBuffers:
+    """Buffers of a Unimal task stepped as VecTask.step and
+    Unimal.post_physics_step do, without the simulation. The time outs are
+    those of the task methods.
+    """
+
+    def __init__(self, state, observation_space_map, max_episode_length, obs_kernel):
+        num_envs = state["root_states"].shape[0]
+        self.state = state
+        self.cum = {}
+        start = 0
+        for section, size in observation_space_map.items():
+            self.cum[section] = (start, start + size)
+            start += size
+        self.max_episode_length = max_episode_length
+        self.obs_kernel = obs_kernel
+        self.obs_buf = torch.zeros(num_envs, start)
+        self.rew_buf = torch.zeros(num_envs)
+        self.reset_buf = torch.ones(num_envs, dtype=torch.long)
+        self.progress_buf = torch.zeros(num_envs, dtype=torch.long)
+        self.timeout_buf = torch.zeros(num_envs, dtype=torch.long)
+        self.initial_root_states = state["root_states"].clone()
+        self.potentials = state["potentials"].clone()
+        self.prev_potentials = self.potentials.clone()
+        Unimal.init_next_timeouts(self)
+
+    def compute_timeouts(self):
+        if self.obs_kernel == "fused":
+            Unimal.compute_timeouts(self)
+        else:
+            VecTask.compute_timeouts(self)
+
+    def reset_idx(self, env_ids):
+        to_target = self.state["targets"][env_ids] - self.initial_root_states[env_ids, 0:3]
+        to_target[:, 2] = 0.0
+        self.prev_potentials[env_ids] = -torch.norm(to_target, p=2, dim=-1) / DT
+        self.potentials[env_ids] = self.prev_potentials[env_ids].clone()
+        self.progress_buf[env_ids] = 0
+        self.reset_buf[env_ids] = 0
+
+    def step(self, inputs):
+        state = dict(self.state, **inputs)
+        params = REWARD_PARAMS
+        obs_args = (
+            self.obs_buf, state["root_states"], state["targets"], self.potentials,
+            state["inv_start_rot"], state["dof_pos"], state["dof_vel"],
+            state["dof_limits_lower"], state["dof_limits_upper"], 0.2,
+            state["basis_vec0"], state["basis_vec1"], 2,
+            state["sensors"], state["actions"], DT, 0.1, state["sensors"].shape[1]
+        )
+
+        self.compute_timeouts()
+        self.progress_buf += 1
+        env_ids = self.reset_buf.nonzero(as_tuple=False).flatten()
+        if len(env_ids) > 0:
+            self.reset_idx(env_ids)
+
+        if self.obs_kernel == "fused":
+            (self.obs_buf[:], self.potentials[:], self.prev_potentials[:], _, _,
+             self.rew_buf[:], self.reset_buf[:], self.next_timeout_buf) = \
+                compute_unimal_observations_and_reward(
+                    *obs_args,
+                    self.reset_buf, self.progress_buf,
+                    params["up_weight"], params["heading_weight"],
+                    params["actions_cost_scale"], params["energy_cost_scale"],
+                    params["joints_at_limit_cost_scale"], params["termination_height"],
+                    params["death_cost"], float(self.max_episode_length)
+                )
+            return
+
+        self.obs_buf[:], self.potentials[:], self.prev_potentials[:], _, _ = \
+            compute_unimal_observations(*obs_args)
+        self.rew_buf[:], self.reset_buf[:] = compute_unimal_reward(
+            self.obs_buf, self.reset_buf, self.progress_buf, state["actions"],
+            params["up_weight"], params["heading_weight"],
+            self.potentials, self.prev_potentials,
+            params["actions_cost_scale"], params["energy_cost_scale"],
+            params["joints_at_limit_cost_scale"], params["termination_height"],
+            params["death_cost"], float(self.max_episode_length),
+            self.cum["dof_meas_vel"], self.cum["dof_meas_pos"]
+        )
+
+
+def random_step_inputs(num_envs, num_dofs, num_sensors):
+    """Inputs which change every step. Torso heights are around the
+    termination height, so envs also reset by falling.
+    """
+    state = random_state(num_envs, num_dofs, num_sensors)
+    state["root_states"][:, 2] = REWARD_PARAMS["termination_height"] + \
+        0.1 * torch.randn(num_envs)
+    return {
+        key: state[key]
+        for key in ["root_states", "dof_pos", "dof_vel", "sensors", "actions"]
+    }
+
+
+@pytest.mark.parametrize("max_episode_length", [0, 1, 2, 3, 5, 1000])
+def test_fused_kernel_matches_jit(max_episode_length):
+    torch.manual_seed(0)
+    num_envs, num_dofs, num_sensors = 64, 12, 13
+    observation_space_map = obsu.get_observation_space_map(num_dofs, num_sensors)
+    state = random_state(num_envs, num_dofs, num_sensors)
+    jit = TaskBuffers(state, observation_space_map, max_episode_length, "jit")
+    fused = TaskBuffers(state, observation_space_map, max_episode_length, "fused")
+
+    for _ in range(12):
+        inputs = random_step_inputs(num_envs, num_dofs, num_sensors)
+        jit.step(inputs)
+        fused.step(inputs)
+        assert max_difference(jit.obs_buf, fused.obs_buf, observation_space_map) <= ATOL
+        assert (jit.rew_buf - fused.rew_buf).abs().max().item() <= ATOL
+        assert torch.equal(jit.reset_buf, fused.reset_buf)
+        assert torch.equal(jit.timeout_buf, fused.timeout_buf)